@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк методов Database на базах разного размера
+
+Для каждого размера (по умолчанию 1k, 10k и 100k анкет) временная база
+создается генератором generate_dataset.py (те же распределения филиалов,
+имен и популярности, что и в синтетических данных для нагрузочного теста), и
+каждый метод выполняется --repeat раз. Результат - время p50/p95 по каждому
+методу и размеру, то есть кривая роста стоимости, а не одно число.
+
+Примеры:
+    python benchmark.py                              # 1k/10k/100k, 1M лайков
+    python benchmark.py --sizes 1000,10000 --likes 200000 --json result.json
+    python benchmark.py --save-baseline              # записать benchmark_baseline.json
+    python benchmark.py --fail-on-regression         # сравнить с базовой линией, код 1 при замедлении
+
+Базовую линию имеет смысл записывать на той же машине, где потом сравнивают.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from database import Database
+from generate_dataset import USER_ID_BASE, generate_dataset
+
+# Файл базовой линии по умолчанию
+BASELINE_PATH = 'benchmark_baseline.json'
+
+# Доли уже просмотренных анкет у зрителей для get_random_user
+EXCLUSION_LEVELS = (0.0, 0.1, 0.5, 0.9)
+
+# Запросы поиска: по ключевым словам (FTS) и по подстроке имени (trigram и перебор для коротких)
+KEYWORD_QUERIES = ['python', 'аналитикой данных', 'походы', 'Инженер Казань', 'шахматы кино']
+NAME_QUERIES = ['Анна', 'Иванов', 'Дмитр', 'ольга', 'Петров']
+SHORT_NAME_QUERIES = ['Ан', 'Ив', 'Ма']
+
+
+def prepare_viewers(db_path: str, users: int, seed: int) -> Dict[str, Any]:
+    """Подготовить базу от generate_dataset к замерам
+
+    Первые len(EXCLUSION_LEVELS) анкет становятся зрителями: их лайки и
+    просмотры заменяются просмотрами ровно соответствующей доли остальных
+    анкет. Заодно выбираются самая популярная анкета и образец пар для
+    check_match.
+    """
+    rng = random.Random(seed)
+    ids = list(range(USER_ID_BASE, USER_ID_BASE + users))
+    viewers = ids[:len(EXCLUSION_LEVELS)]
+    placeholders = ', '.join('?' * len(viewers))
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous=OFF")
+    with conn:
+        conn.execute(f"DELETE FROM views WHERE viewer_id IN ({placeholders})", viewers)
+        conn.execute(f"DELETE FROM likes WHERE from_user_id IN ({placeholders})", viewers)
+        conn.execute(f"""
+            DELETE FROM matches WHERE user_low IN ({placeholders}) OR user_high IN ({placeholders})
+        """, viewers + viewers)
+        for viewer_id, level in zip(viewers, EXCLUSION_LEVELS):
+            seen = rng.sample(ids[len(viewers):], int(level * (users - len(viewers))))
+            conn.executemany(
+                "INSERT OR IGNORE INTO views (viewer_id, viewed_id) VALUES (?, ?)",
+                ((viewer_id, viewed_id) for viewed_id in seen)
+            )
+
+    likes = conn.execute("SELECT COUNT(*) FROM likes").fetchone()[0]
+    matches = conn.execute("SELECT COUNT(*) FROM matches").fetchone()[0]
+    top_target = conn.execute("""
+        SELECT to_user_id FROM likes GROUP BY to_user_id ORDER BY COUNT(*) DESC LIMIT 1
+    """).fetchone()
+    # Случайные строки по rowid: ORDER BY RANDOM() на миллионе лайков заметно дольше
+    max_rowid = conn.execute("SELECT MAX(rowid) FROM likes").fetchone()[0] or 0
+    sample = [rng.randint(1, max_rowid) for _ in range(min(1000, likes))]
+    pairs = conn.execute(f"""
+        SELECT from_user_id, to_user_id FROM likes WHERE rowid IN ({', '.join('?' * len(sample))})
+    """, sample).fetchall() if sample else []
+    conn.execute("ANALYZE")
+    conn.close()
+    return {
+        'likes': likes,
+        'matches': matches,
+        'ids': ids,
+        'viewers': viewers,
+        'top_target': top_target[0] if top_target else ids[0],
+        'pairs': pairs or [(ids[0], ids[-1])],
+    }
+
+
+def describe(times: List[float]) -> Dict[str, float]:
+    times = sorted(times)
+    return {
+        'runs': len(times),
+        'min_ms': round(times[0] * 1000, 4),
+        'p50_ms': round(statistics.median(times) * 1000, 4),
+        'p95_ms': round(times[min(len(times) - 1, int(0.95 * len(times)))] * 1000, 4),
+        'mean_ms': round(statistics.fmean(times) * 1000, 4),
+        'max_ms': round(times[-1] * 1000, 4),
+    }
+
+
+async def measure(call: Callable[[int], Awaitable[Any]], repeat: int,
+                  prepare: Optional[Callable[[int], None]] = None) -> Dict[str, float]:
+    """Выполнить call(i) repeat раз; prepare(i) вызывается до замера и в него не входит"""
+    times = []
+    for i in range(repeat):
+        if prepare is not None:
+            prepare(i)
+        started = time.perf_counter()
+        await call(i)
+        times.append(time.perf_counter() - started)
+    return describe(times)
+
+
+async def run_size(workdir: str, users: int, likes: int, repeat: int, seed: int) -> Dict[str, Any]:
+    db_path = os.path.join(workdir, f'bench_{users}.db')
+    started = time.perf_counter()
+    await generate_dataset(db_path, users, likes, seed=seed, id_base=USER_ID_BASE)
+    data = prepare_viewers(db_path, users, seed)
+    load_s = time.perf_counter() - started
+    print(f"  {users} анкет, {data['likes']} лайков, {data['matches']} совпадений - загружено за {load_s:.1f} с")
+
+    db = Database(db_path)
+    await db.open()
+    rng = random.Random(seed)
+    cases: Dict[str, Dict[str, float]] = {}
+    try:
+        for viewer_id, level in zip(data['viewers'], EXCLUSION_LEVELS):
+            label = f"excl={level:.0%}"
+            # Холодный вызов: колода строится заново (полный проход по кандидатам)
+            cases[f'get_random_user_cold[{label}]'] = await measure(
+                lambda i, viewer_id=viewer_id: db.get_random_user(viewer_id), repeat,
+                prepare=lambda i, viewer_id=viewer_id: db._decks.invalidate(viewer_id)
+            )
+            # Теплый вызов: карта снимается с уже построенной колоды
+            db._decks.invalidate(viewer_id)
+            await db.get_random_user(viewer_id)
+            cases[f'get_random_user[{label}]'] = await measure(
+                lambda i, viewer_id=viewer_id: db.get_random_user(viewer_id), repeat
+            )
+
+        cases['search_users_by_keywords'] = await measure(
+            lambda i: db.search_users_by_keywords(KEYWORD_QUERIES[i % len(KEYWORD_QUERIES)]), repeat
+        )
+        cases['search_users_by_name'] = await measure(
+            lambda i: db.search_users_by_name(NAME_QUERIES[i % len(NAME_QUERIES)]), repeat
+        )
+        cases['search_users_by_name[short]'] = await measure(
+            lambda i: db.search_users_by_name(SHORT_NAME_QUERIES[i % len(SHORT_NAME_QUERIES)]), repeat
+        )
+        cases['get_pending_likes'] = await measure(
+            lambda i: db.get_pending_likes(data['top_target']), repeat
+        )
+        pairs = data['pairs']
+        cases['check_match'] = await measure(
+            lambda i: db.check_match(*pairs[rng.randrange(len(pairs))]), repeat
+        )
+
+        # Удаление - последним: каждый повтор удаляет новую анкету вместе с её лайками
+        protected = set(data['viewers']) | {data['top_target']}
+        candidates = rng.sample(data['ids'], min(len(data['ids']), repeat + len(protected)))
+        victims = [telegram_id for telegram_id in candidates if telegram_id not in protected][:repeat]
+        cases['delete_user'] = await measure(lambda i: db.delete_user(victims[i]), len(victims))
+    finally:
+        await db.close()
+        os.remove(db_path)
+
+    return {
+        'users': users,
+        'likes': data['likes'],
+        'matches': data['matches'],
+        'load_s': round(load_s, 2),
+        'cases': cases,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Tuple[str, str, float]]:
+    """Случаи, где p50 вырос больше чем в threshold раз относительно базовой линии"""
+    regressions = []
+    for size, result in current['results'].items():
+        base_cases = baseline.get('results', {}).get(size, {}).get('cases', {})
+        for case, stats in result['cases'].items():
+            base = base_cases.get(case)
+            if base and base['p50_ms'] > 0:
+                ratio = stats['p50_ms'] / base['p50_ms']
+                stats['baseline_p50_ms'] = base['p50_ms']
+                stats['ratio'] = round(ratio, 3)
+                if ratio > threshold:
+                    regressions.append((size, case, ratio))
+    return regressions
+
+
+def print_table(report: Dict[str, Any]):
+    sizes = list(report['results'])
+    cases = []
+    for size in sizes:
+        for case in report['results'][size]['cases']:
+            if case not in cases:
+                cases.append(case)
+
+    width = max(len(case) for case in cases) + 2
+    print()
+    print("p50, мс" + " " * (width - 7) + ''.join(f"{size + ' анкет':>22}" for size in sizes))
+    for case in cases:
+        cells = []
+        for size in sizes:
+            stats = report['results'][size]['cases'].get(case)
+            if stats is None:
+                cells.append(f"{'-':>22}")
+                continue
+            ratio = f" (×{stats['ratio']:.2f})" if 'ratio' in stats else ''
+            cells.append(f"{stats['p50_ms']:.3f}{ratio}".rjust(22))
+        print(case.ljust(width) + ''.join(cells))
+
+
+async def run_benchmark(options: argparse.Namespace) -> Dict[str, Any]:
+    sizes = [int(size) for size in options.sizes.split(',') if size]
+    workdir = tempfile.mkdtemp(prefix='db_bench_')
+    report = {
+        'meta': {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'repeat': options.repeat,
+            'likes': options.likes,
+            'seed': options.seed,
+        },
+        'results': {},
+    }
+    try:
+        for users in sizes:
+            print(f"Размер {users}:")
+            report['results'][str(users)] = await run_size(
+                workdir, users, options.likes, options.repeat, options.seed
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк методов Database")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="число анкет через запятую")
+    parser.add_argument('--likes', type=int, default=1_000_000,
+                        help="число лайков (не больше половины всех пар для малых размеров)")
+    parser.add_argument('--repeat', type=int, default=200, help="повторов каждого метода")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="записать результат в JSON-файл")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="файл базовой линии для сравнения")
+    parser.add_argument('--save-baseline', action='store_true', help="записать результат как базовую линию")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="во сколько раз p50 может вырасти, прежде чем считаться замедлением")
+    parser.add_argument('--fail-on-regression', action='store_true', help="код выхода 1 при замедлении")
+    return parser.parse_args()
+
+
+def main():
+    options = parse_args()
+    report = asyncio.run(run_benchmark(options))
+
+    regressions = []
+    if not options.save_baseline and os.path.exists(options.baseline):
+        with open(options.baseline, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), options.threshold)
+        print(f"\nСравнение с {options.baseline} (в скобках - отношение к базовой линии)")
+
+    print_table(report)
+
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультат записан в {options.json}")
+    if options.save_baseline:
+        with open(options.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nБазовая линия записана в {options.baseline}")
+
+    if regressions:
+        print(f"\n⚠️ Замедление больше чем в {options.threshold} раза:")
+        for size, case, ratio in regressions:
+            print(f"  {case} на {size} анкетах: ×{ratio:.2f}")
+        if options.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
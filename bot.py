@@ -2,19 +2,30 @@
 Telegram бот для знакомств
 """
 import asyncio
+import contextvars
 import logging
 from functools import lru_cache
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command, StateFilter
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, InputMediaPhoto
+from aiogram.types import (
+    InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, InputMediaPhoto, MessageEntity,
+    BufferedInputFile,
+)
+from aiogram.utils.formatting import Bold, Text
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 import os
-from config import MESSAGES
+from config import (
+    MESSAGES, RUN_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN,
+    WEBAPP_HOST, WEBAPP_PORT, MAX_CONCURRENT_UPDATES, ADMIN_IDS, TELEGRAM_API_URL,
+)
 
 # Получаем токен из переменных окружения или config.py
 BOT_TOKEN = os.getenv('BOT_TOKEN')
@@ -24,23 +35,57 @@ if not BOT_TOKEN:
     except ImportError:
         raise ValueError("BOT_TOKEN не найден!")
 
-# Создаем объект бота
-bot = Bot(token=BOT_TOKEN)
+# Создаем объект бота; TELEGRAM_API_URL направляет запросы на другой сервер Bot API
+if TELEGRAM_API_URL:
+    bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=BOT_TOKEN)
 # BOT_ID будет получен асинхронно в main()
 BOT_ID = None
 
 from database import Database
-
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+from fsm_storage import SQLiteStorage
+from cache import TTLCache
+from middlewares import ConcurrencyLimitMiddleware, LogContextMiddleware
+from log_config import setup_logging
+from metrics import (
+    MetricsMiddleware, TelegramApiTimer, observe_db, register_collector,
+    render_prometheus, handler_summary, start_metrics_server,
+)
+from notifications import NotificationScheduler
+from broadcast import BroadcastRunner
+from update_recorder import RECORD_UPDATES_PATH, UpdateRecorderMiddleware
+
+# Настройка логирования: записи уходят в очередь, вывод - в отдельном потоке
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Инициализация диспетчера (бот уже создан выше)
-storage = MemoryStorage()
+# Состояния FSM хранятся в SQLite и переживают перезапуск; Dispatcher закрывает хранилище при остановке
+storage = SQLiteStorage()
 dp = Dispatcher(storage=storage)
+# Запись обновлений для replay.py - до очереди, чтобы время записи было временем получения
+recorder = UpdateRecorderMiddleware(RECORD_UPDATES_PATH) if RECORD_UPDATES_PATH else None
+if recorder is not None:
+    dp.update.outer_middleware(recorder)
+dp.update.outer_middleware(ConcurrencyLimitMiddleware(MAX_CONCURRENT_UPDATES))
+# user_id и имя обработчика попадают в каждую запись лога
+dp.message.middleware(LogContextMiddleware())
+dp.callback_query.middleware(LogContextMiddleware())
+# Время, вызовы и ошибки каждого обработчика, отдельно - время базы и Telegram API
+dp.message.middleware(MetricsMiddleware())
+dp.callback_query.middleware(MetricsMiddleware())
+bot.session.middleware(TelegramApiTimer())
 
 # Инициализация базы данных
 db = Database()
+db.timing_hook = observe_db
+
+# Уведомления другим пользователям уходят через очередь с учетом лимитов Telegram
+notifier = NotificationScheduler(bot)
+
+# Рассылки организаторов
+broadcaster = BroadcastRunner(db, notifier)
 
 
 class ProfileStates(StatesGroup):
@@ -62,15 +107,15 @@ class SearchStates(StatesGroup):
 # Временное хранилище для текущего просматриваемого профиля
 current_viewing = {}
 
-# Хранилище просмотренных пользователей для каждого пользователя
-viewed_users = {}
-
 # Кэш для часто используемых данных
-user_cache = {}  # {telegram_id: user_data}
 cache_ttl = 300  # 5 минут
+cache_max_size = 10000  # анкет в кэше
+user_cache = TTLCache(maxsize=cache_max_size, ttl=cache_ttl)  # {telegram_id: user_data}
 
-# Очищаем кэш при запуске
-user_cache.clear()
+# Готовые карточки: {(telegram_id, version): (text, entities)}. Правка анкеты и повторная
+# регистрация после сброса дают новую version, поэтому запись не нужно сбрасывать -
+# старая просто вытеснится
+card_cache = TTLCache(maxsize=cache_max_size, ttl=3600)
 
 def get_cached_user(telegram_id: int) -> Optional[Dict[str, Any]]:
     """Получить пользователя из кэша"""
@@ -78,12 +123,116 @@ def get_cached_user(telegram_id: int) -> Optional[Dict[str, Any]]:
 
 def set_cached_user(telegram_id: int, user_data: Dict[str, Any]):
     """Сохранить пользователя в кэш"""
-    user_cache[telegram_id] = user_data
+    user_cache.set(telegram_id, user_data)
+
+def invalidate_cached_user(telegram_id: int):
+    """Удалить из кэша одного пользователя после изменения его анкеты"""
+    user_cache.invalidate(telegram_id)
 
 def clear_cache():
     """Очистить кэш"""
     user_cache.clear()
 
+async def get_user_profile(telegram_id: int) -> Optional[Dict[str, Any]]:
+    """Получить анкету пользователя: из кэша, а при промахе - из базы"""
+    user = get_cached_user(telegram_id)
+    if user is None:
+        user = await db.get_user(telegram_id)
+        if user:
+            set_cached_user(telegram_id, user)
+    return user
+
+async def get_contact_info(telegram_id: int) -> Dict[str, Any]:
+    """Контактная информация пользователя (имя, филиал, должность, о себе) из кэша анкет"""
+    return await get_user_profile(telegram_id) or {}
+
+# Предвыборка следующей анкеты случайного поиска: {telegram_id зрителя: asyncio.Task}.
+# Задача возвращает telegram_id кандидата, его анкета и карточка уже лежат в кэшах
+prefetch_slots = TTLCache(maxsize=cache_max_size, ttl=600)
+prefetch_stats = {'hits': 0, 'waits': 0, 'misses': 0, 'invalidated': 0}
+
+async def prefetch_candidate(user_id: int) -> Optional[int]:
+    """Выбрать следующего кандидата и прогреть его анкету и карточку"""
+    candidate = await db.get_random_user(user_id)
+    if candidate is None:
+        return None
+    set_cached_user(candidate['telegram_id'], candidate)
+    render_profile_card(candidate)
+    return candidate['telegram_id']
+
+def schedule_prefetch(user_id: int):
+    """Запустить выбор следующей анкеты в фоне, пока пользователь смотрит текущую"""
+    previous = prefetch_slots.get(user_id)
+    if previous is not None:
+        release_prefetch(user_id, previous)
+    # Задача запускается в чистом контексте: иначе время ее запросов к базе
+    # попало бы в метрики и логи обработчика, который ее запустил
+    task = contextvars.Context().run(asyncio.create_task, prefetch_candidate(user_id))
+    prefetch_slots.set(user_id, task)
+
+def release_prefetch(user_id: int, task: asyncio.Task, skip_id: int = None):
+    """Вернуть кандидата невостребованной выборки в колоду, когда она завершится
+
+    Выборку не отменяем: get_random_user уже мог снять кандидата с колоды,
+    и отмена потеряла бы его до пересборки колоды. skip_id не возвращается.
+    """
+    def release(done: asyncio.Task):
+        if done.cancelled() or done.exception() is not None:
+            return
+        candidate_id = done.result()
+        if candidate_id is not None and candidate_id != skip_id:
+            db.return_to_deck(user_id, candidate_id)
+    task.add_done_callback(release)
+
+def discard_prefetch(user_id: int, candidate_id: int = None):
+    """Сбросить предвыбранную анкету (всю или только если это candidate_id)"""
+    task = prefetch_slots.get(user_id)
+    if task is None:
+        return
+    # Готовый результат с другим кандидатом оставляем; незавершенную выборку
+    # сбрасываем - она могла выбрать именно эту анкету
+    if (candidate_id is not None and task.done() and not task.cancelled()
+            and task.exception() is None and task.result() != candidate_id):
+        return
+    prefetch_slots.invalidate(user_id)
+    release_prefetch(user_id, task, candidate_id)
+    prefetch_stats['invalidated'] += 1
+
+async def next_random_candidate(user_id: int) -> Optional[Dict[str, Any]]:
+    """Следующая анкета для случайного поиска: предвыбранная, если она еще актуальна"""
+    task = prefetch_slots.get(user_id)
+    if task is not None:
+        prefetch_slots.invalidate(user_id)
+        ready = task.done()
+        try:
+            candidate_id = await task
+        except Exception as e:
+            logger.error("Ошибка предвыборки анкеты для %s: %s", user_id, e)
+            candidate_id = None
+        
+        # Пока анкета ждала показа, ее могли удалить, а пользователь - увидеть
+        # через поиск по филиалу или ключевым словам
+        if (candidate_id is not None and db.profile_exists(candidate_id)
+                and await db.is_unseen(user_id, candidate_id)):
+            candidate = await get_user_profile(candidate_id)
+            if candidate:
+                prefetch_stats['hits' if ready else 'waits'] += 1
+                return candidate
+        if candidate_id is not None:
+            prefetch_stats['invalidated'] += 1
+    
+    prefetch_stats['misses'] += 1
+    return await db.get_random_user(user_id)
+
+def get_prefetch_stats() -> Dict[str, Any]:
+    """Счетчики предвыборки; hit_rate - доля нажатий, обслуженных готовой анкетой"""
+    lookups = prefetch_stats['hits'] + prefetch_stats['waits'] + prefetch_stats['misses']
+    return {
+        **prefetch_stats,
+        'pending': len(prefetch_slots),
+        'hit_rate': prefetch_stats['hits'] / lookups if lookups else None,
+    }
+
 
 @dp.message(Command("cancel"))
 async def cmd_cancel(message: types.Message, state: FSMContext):
@@ -96,16 +245,15 @@ async def cmd_start(message: types.Message, state: FSMContext):
     await state.clear()
     
     # Проверяем, есть ли уже анкета у пользователя
-    user = await db.get_user(message.from_user.id)
-    
-    if user:
+    if db.profile_exists(message.from_user.id):
         # Показываем главное меню с улучшенным приветствием
         await message.answer(
             "🎉 **Добро пожаловать в Формулу молодежи!**\n\n"
             "Здесь вы можете знакомиться с другими участниками форума и находить интересные связи для общения.\n\n"
             "**🔍 Поиск людей:**\n"
             "• Случайный поиск\n"
-            "• Поиск по ключевым словам\n\n"
+            "• Поиск по ключевым словам\n"
+            "• Просмотр по филиалам\n\n"
             "**👤 Управление профилем:**\n"
             "• Просмотр и редактирование\n"
             "• История просмотров\n"
@@ -308,7 +456,8 @@ async def process_skip_photo(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     is_edit = data.get('is_edit', False)
     
-    await save_profile(callback.message, state, photo_file_id=None, is_edit=is_edit, remove_photo=True)
+    await save_profile(callback.message, state, photo_file_id=None, is_edit=is_edit, remove_photo=True,
+                       user_id=callback.from_user.id)
     await callback.answer()
 
 
@@ -330,21 +479,27 @@ async def process_photo_invalid(message: types.Message, state: FSMContext):
     await message.answer("❌ Пожалуйста, отправьте фото или нажмите 'Пропустить'")
 
 
-async def save_profile(message: types.Message, state: FSMContext, photo_file_id: str = None, is_edit: bool = False, remove_photo: bool = False):
-    """Сохранение профиля в базу данных"""
+async def save_profile(message: types.Message, state: FSMContext, photo_file_id: str = None, is_edit: bool = False, remove_photo: bool = False,
+                       user_id: Optional[int] = None):
+    """Сохранение профиля в базу данных
+    
+    user_id нужен, когда message - сообщение бота (нажатие inline-кнопки):
+    его from_user - сам бот, а не владелец анкеты.
+    """
+    if user_id is None:
+        user_id = message.from_user.id
     data = await state.get_data()
     
     # Отладочная информация
-    logger.info(f"💾 save_profile: photo_file_id = {photo_file_id}")
-    logger.info(f"💾 is_edit = {is_edit}")
-    logger.info(f"💾 data keys: {list(data.keys())}")
+    logger.debug("💾 save_profile: photo_file_id = %s, is_edit = %s, data keys: %s",
+                 photo_file_id, is_edit, data.keys())
     
     # Проверяем наличие обязательных полей
     required_fields = ['name', 'branch', 'job_title', 'about']
     missing_fields = [field for field in required_fields if field not in data or not data[field]]
     
     if missing_fields:
-        logger.error(f"❌ Отсутствуют обязательные поля: {missing_fields}")
+        logger.error("❌ Отсутствуют обязательные поля: %s", missing_fields)
         await message.answer(
             f"❌ **Ошибка:** Не все поля заполнены!\n\n"
             f"Отсутствуют: {', '.join(missing_fields)}\n\n"
@@ -367,13 +522,11 @@ async def save_profile(message: types.Message, state: FSMContext, photo_file_id:
             # Используем существующее фото из FSM
             final_photo_file_id = data.get('photo_file_id')
         
-        logger.info(f"🔄 Обновление профиля: final_photo_file_id = {final_photo_file_id}")
-        logger.info(f"🔄 photo_file_id из параметра = {photo_file_id}")
-        logger.info(f"🔄 photo_file_id из FSM = {data.get('photo_file_id')}")
-        logger.info(f"🔄 remove_photo = {remove_photo}")
+        logger.debug("🔄 Обновление профиля: final_photo_file_id = %s, из параметра = %s, из FSM = %s, remove_photo = %s",
+                     final_photo_file_id, photo_file_id, data.get('photo_file_id'), remove_photo)
         
         success = await db.update_user(
-            telegram_id=message.from_user.id,
+            telegram_id=user_id,
             name=data['name'],
             branch=data['branch'],
             job_title=data['job_title'],
@@ -382,12 +535,12 @@ async def save_profile(message: types.Message, state: FSMContext, photo_file_id:
             update_photo=True
         )
         
-        logger.info(f"🔄 Результат обновления: success = {success}")
+        logger.debug("🔄 Результат обновления: success = %s", success)
         
         if success:
             await state.clear()
             # Очищаем кэш пользователя после обновления профиля
-            clear_cache()
+            invalidate_cached_user(user_id)
             await message.answer(
                 "✅ **Профиль успешно обновлен!**\n\n"
                 "Изменения сохранены.",
@@ -401,7 +554,7 @@ async def save_profile(message: types.Message, state: FSMContext, photo_file_id:
         final_photo_file_id = photo_file_id
         
         success = await db.add_user(
-            telegram_id=message.from_user.id,
+            telegram_id=user_id,
             name=data['name'],
             branch=data['branch'],
             job_title=data['job_title'],
@@ -411,6 +564,7 @@ async def save_profile(message: types.Message, state: FSMContext, photo_file_id:
         
         if success:
             await state.clear()
+            invalidate_cached_user(user_id)
             await message.answer(
                 "🎉 **Профиль успешно создан!**\n\n"
                 "Теперь вы можете знакомиться с другими участниками форума.",
@@ -420,18 +574,24 @@ async def save_profile(message: types.Message, state: FSMContext, photo_file_id:
             await message.answer("❌ Произошла ошибка при сохранении анкеты. Попробуйте еще раз.")
 
 
+@lru_cache(maxsize=None)
 def get_main_menu_keyboard():
-    """Создание главного меню с улучшенным дизайном"""
+    """Главное меню с улучшенным дизайном
+    
+    Клавиатура строится один раз и переиспользуется - не изменяйте её.
+    """
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         # Группа поиска - универсальный поиск
         [InlineKeyboardButton(text="🔍 Найти людей", callback_data="search")],
         [InlineKeyboardButton(text="🔎 Поиск по ключевым словам", callback_data="search_by_keywords")],
+        [InlineKeyboardButton(text="🏢 Люди по филиалам", callback_data="browse_branches")],
         
         # Разделитель
         [InlineKeyboardButton(text="━━━━━━━━━━━━━━━━━━━━", callback_data="separator")],
         
         # Управление профилем
         [InlineKeyboardButton(text="👤 Мой профиль", callback_data="my_profile")],
+        [InlineKeyboardButton(text="💌 Входящие интересы", callback_data="inbox")],
         [InlineKeyboardButton(text="👀 Просмотренные", callback_data="viewed_list")],
         [InlineKeyboardButton(text="📊 Статистика", callback_data="statistics")],
         
@@ -446,8 +606,7 @@ def get_main_menu_keyboard():
 
 async def check_profile_exists(user_id: int) -> bool:
     """Проверяет, существует ли анкета у пользователя"""
-    user = await db.get_user(user_id)
-    return user is not None
+    return db.profile_exists(user_id)
 
 async def cancel_profile_creation(message: types.Message, state: FSMContext):
     """Отмена создания анкеты"""
@@ -496,14 +655,11 @@ async def start_search(callback: CallbackQuery, state: FSMContext):
         await callback.answer()
         return
     
-    # Получаем список уже просмотренных пользователей
-    user_viewed = viewed_users.get(user_id, [])
-    
-    # Получаем случайного пользователя, исключая просмотренных
-    random_user = await db.get_random_user(user_id, user_viewed)
+    # Получаем случайного пользователя, исключая просмотренных и лайкнутых
+    random_user = await next_random_candidate(user_id)
     if not random_user:
         # Если все пользователи просмотрены, сбрасываем список
-        viewed_users[user_id] = []
+        await db.clear_views(user_id)
         await callback.message.edit_text(
             "🎉 **Все профили просмотрены!**\n\n"
             "Список обновлен, попробуйте снова.",
@@ -515,19 +671,21 @@ async def start_search(callback: CallbackQuery, state: FSMContext):
         await callback.answer()
         return
     
-    # Добавляем текущего пользователя в список просмотренных
-    viewed_users[user_id] = user_viewed + [random_user['telegram_id']]
+    # Добавляем показанного пользователя в список просмотренных
+    await db.add_view(user_id, random_user['telegram_id'])
     
     # Сохраняем текущего просматриваемого пользователя
     current_viewing[user_id] = random_user
     
-    # Показываем карточку
+    # Показываем карточку и сразу готовим следующую
     await show_profile_card(callback.message, random_user)
+    schedule_prefetch(user_id)
     await callback.answer()
 
 
+@lru_cache(maxsize=None)
 def get_profile_card_keyboard():
-    """Создание клавиатуры для карточки профиля"""
+    """Клавиатура для карточки профиля (общая, не изменяйте)"""
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🤝 Познакомиться", callback_data="like")],
         [InlineKeyboardButton(text="➡️ Дальше", callback_data="next")],
@@ -536,23 +694,59 @@ def get_profile_card_keyboard():
     return keyboard
 
 
-def format_profile_card(user_data: dict):
-    """Форматирует карточку профиля с улучшенным дизайном"""
-    card = f"👤 **{user_data['name']}**\n\n"
+@lru_cache(maxsize=None)
+def get_own_profile_keyboard():
+    """Клавиатура для карточки собственного профиля (общая, не изменяйте)"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✏️ Редактировать", callback_data="edit_profile")],
+        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
+    ])
+
+
+@lru_cache(maxsize=None)
+def get_search_more_keyboard():
+    """Кнопки 'Найти еще' и 'Главное меню' (общая, не изменяйте)"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔍 Найти еще", callback_data="search")],
+        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
+    ])
+
+
+CARD_FOOTER = "\n" + "─" * 30 + "\n💡 Нажмите '🤝 Познакомиться' для обмена контактами"
+
+
+def format_profile_card(user_data: dict) -> Tuple[str, List[MessageEntity]]:
+    """Форматирует карточку профиля: текст и разметку (entities)
+    
+    Жирный шрифт передается entities, а не Markdown, поэтому символы
+    * и _ в имени или описании не ломают разбор сообщения.
+    """
+    parts = ["👤 ", Bold(user_data['name']), "\n\n"]
     
     if user_data.get('branch'):
-        card += f"🏢 **Филиал:** {user_data['branch']}\n"
+        parts += ["🏢 ", Bold("Филиал:"), f" {user_data['branch']}\n"]
     
     if user_data.get('job_title'):
-        card += f"💼 **Должность:** {user_data['job_title']}\n"
+        parts += ["💼 ", Bold("Должность:"), f" {user_data['job_title']}\n"]
     
     if user_data.get('about'):
-        card += f"📝 **О себе:** {user_data['about']}\n"
+        parts += ["📝 ", Bold("О себе:"), f" {user_data['about']}\n"]
     
-    card += "\n" + "─" * 30 + "\n"
-    card += "💡 Нажмите '🤝 Познакомиться' для обмена контактами"
+    parts.append(CARD_FOOTER)
+    return Text(*parts).render()
+
+
+def render_profile_card(user_data: dict) -> Tuple[str, List[MessageEntity]]:
+    """Карточка профиля из кэша по (telegram_id, version); при промахе - форматирование"""
+    key = (user_data.get('telegram_id'), user_data.get('version'))
+    if None in key:
+        return format_profile_card(user_data)
     
-    return card
+    rendered = card_cache.get(key)
+    if rendered is None:
+        rendered = format_profile_card(user_data)
+        card_cache.set(key, rendered)
+    return rendered
 
 def format_contact_info(user_data: dict, telegram_id: int) -> str:
     """Форматирование контактной информации для совпадений"""
@@ -570,8 +764,9 @@ def format_contact_info(user_data: dict, telegram_id: int) -> str:
     
     return text
 
+@lru_cache(maxsize=4096)
 def get_contact_keyboard(telegram_id: int) -> InlineKeyboardMarkup:
-    """Создание клавиатуры с контактами для совпадений"""
+    """Клавиатура с контактами для совпадений (кэшируется по telegram_id, не изменяйте)"""
     # Проверяем, является ли ID реальным Telegram ID (обычно больше 100000000)
     # и не является ли тестовым ID
     if telegram_id > 100000000 and telegram_id not in [123456789, 4001, 5001, 6001, 7001, 8001]:
@@ -586,56 +781,51 @@ def get_contact_keyboard(telegram_id: int) -> InlineKeyboardMarkup:
             pass
     
     # Для тестовых ID или в случае ошибки показываем только навигационные кнопки
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔍 Найти еще", callback_data="search")],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-    ])
+    return get_search_more_keyboard()
 
+@lru_cache(maxsize=4096)
 def get_response_keyboard(from_user_id: int) -> InlineKeyboardMarkup:
-    """Создание клавиатуры с кнопками ответа на запрос знакомства"""
+    """Клавиатура с кнопками ответа на запрос знакомства (кэшируется, не изменяйте)"""
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🤝 Познакомиться", callback_data=f"respond_like_{from_user_id}")],
         [InlineKeyboardButton(text="➡️ Пропустить", callback_data=f"skip_like_{from_user_id}")],
         [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
     ])
 
-async def show_profile_card(message: types.Message, user_data: dict, is_own_profile: bool = False):
+async def show_profile_card(message: types.Message, user_data: dict, is_own_profile: bool = False,
+                            keyboard: InlineKeyboardMarkup = None):
     """Показ карточки профиля"""
-    text = format_profile_card(user_data)
+    text, entities = render_profile_card(user_data)
     
-    # Отладочная информация
-    logger.info(f"🔍 show_profile_card: photo_file_id = {user_data.get('photo_file_id')}")
-    logger.info(f"🔍 user_data keys: {list(user_data.keys())}")
-    logger.info(f"🔍 is_own_profile = {is_own_profile}")
+    # Отладочная информация (сэмплируется, см. log_config.SamplingFilter)
+    logger.debug("🔍 show_profile_card: photo_file_id = %s, keys = %s, is_own_profile = %s",
+                 user_data.get('photo_file_id'), user_data.keys(), is_own_profile)
     
     # Выбираем клавиатуру в зависимости от того, чей это профиль
-    if is_own_profile:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="✏️ Редактировать", callback_data="edit_profile")],
-            [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-        ])
-    else:
+    if keyboard is None and is_own_profile:
+        keyboard = get_own_profile_keyboard()
+    elif keyboard is None:
         keyboard = get_profile_card_keyboard()
     
     if user_data.get('photo_file_id'):
-        logger.info("📸 Отправляем фото с подписью")
+        logger.debug("📸 Отправляем фото с подписью")
         await message.answer_photo(
             photo=user_data['photo_file_id'],
             caption=text,
-            parse_mode="Markdown",
+            caption_entities=entities,
             reply_markup=keyboard
         )
     else:
-        logger.info("📝 Отправляем только текст")
+        logger.debug("📝 Отправляем только текст")
         await message.answer(
             text,
-            parse_mode="Markdown",
+            entities=entities,
             reply_markup=keyboard
         )
 
 async def edit_profile_card(callback: CallbackQuery, user_data: dict):
     """Редактирование карточки профиля"""
-    text = format_profile_card(user_data)
+    text, entities = render_profile_card(user_data)
     
     if user_data.get('photo_file_id'):
         try:
@@ -643,7 +833,7 @@ async def edit_profile_card(callback: CallbackQuery, user_data: dict):
                 media=InputMediaPhoto(
                     media=user_data['photo_file_id'],
                     caption=text,
-                    parse_mode="Markdown"
+                    caption_entities=entities
                 ),
                 reply_markup=get_profile_card_keyboard()
             )
@@ -652,13 +842,13 @@ async def edit_profile_card(callback: CallbackQuery, user_data: dict):
             await callback.message.answer_photo(
                 photo=user_data['photo_file_id'],
                 caption=text,
-                parse_mode="Markdown",
+                caption_entities=entities,
                 reply_markup=get_profile_card_keyboard()
             )
     else:
         await callback.message.edit_text(
             text,
-            parse_mode="Markdown",
+            entities=entities,
             reply_markup=get_profile_card_keyboard()
         )
 
@@ -669,24 +859,22 @@ async def process_like(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     viewed_user = current_viewing.get(user_id)
     
-    logger.info(f"🤝 Пользователь {user_id} нажал 'Познакомиться' с {viewed_user['name'] if viewed_user else 'неизвестным'}")
+    logger.info("🤝 Пользователь %s нажал 'Познакомиться' с %s", user_id, viewed_user['name'] if viewed_user else 'неизвестным')
     
     if not viewed_user:
         await callback.message.edit_text("❌ Профиль не найден. Попробуйте поиск заново.")
         await callback.answer()
         return
     
-    # Добавляем интерес к знакомству
-    await db.add_like(user_id, viewed_user['telegram_id'])
-    logger.info(f"✅ Лайк добавлен: {user_id} -> {viewed_user['telegram_id']}")
+    # Добавляем интерес к знакомству и в той же транзакции проверяем взаимность
+    result = await db.like(user_id, viewed_user['telegram_id'])
+    # Лайкнутую анкету больше не показываем, даже если она уже предвыбрана
+    discard_prefetch(user_id, viewed_user['telegram_id'])
+    logger.info("✅ Лайк %s -> %s: новый = %s, взаимный = %s", user_id, viewed_user['telegram_id'], result.is_new, result.is_match)
     
-    # Проверяем на взаимный интерес
-    is_match = await db.check_match(user_id, viewed_user['telegram_id'])
-    logger.info(f"🔍 Проверка взаимного интереса: {is_match}")
-    
-    if is_match:
+    if result.is_match:
         # Получаем полную контактную информацию
-        contact_info = await db.get_user_contact_info(viewed_user['telegram_id'])
+        contact_info = await get_contact_info(viewed_user['telegram_id'])
         
         try:
             await callback.message.edit_text(
@@ -698,7 +886,7 @@ async def process_like(callback: CallbackQuery, state: FSMContext):
                 reply_markup=get_contact_keyboard(viewed_user['telegram_id'])
             )
         except Exception as e:
-            logger.error(f"Ошибка редактирования сообщения: {e}")
+            logger.error("Ошибка редактирования сообщения: %s", e)
             await callback.message.answer(
                 f"🎉 **Взаимный интерес!**\n\n"
                 f"Вы и {viewed_user['name']} хотите познакомиться!\n\n"
@@ -708,58 +896,47 @@ async def process_like(callback: CallbackQuery, state: FSMContext):
                 reply_markup=get_contact_keyboard(viewed_user['telegram_id'])
             )
         
-        # Уведомляем другого пользователя о взаимном интересе
-        other_contact_info = await db.get_user_contact_info(user_id)
-        try:
-            await bot.send_message(
-                viewed_user['telegram_id'],
-                f"🎉 **Взаимный интерес!**\n\n"
-                f"Вы и {other_contact_info['name']} хотите познакомиться!\n\n"
-                f"💬 **Контакты для связи:**\n"
-                f"{format_contact_info(other_contact_info, user_id)}\n"
-                f"Теперь вы можете связаться и общаться!",
-                reply_markup=get_contact_keyboard(user_id)
-            )
-        except Exception as e:
-            logger.error(f"Не удалось отправить уведомление: {e}")
+        # Уведомляем другого пользователя о взаимном интересе (отправка в фоне)
+        other_contact_info = await get_contact_info(user_id)
+        notifier.send_message(
+            viewed_user['telegram_id'],
+            f"🎉 **Взаимный интерес!**\n\n"
+            f"Вы и {other_contact_info['name']} хотите познакомиться!\n\n"
+            f"💬 **Контакты для связи:**\n"
+            f"{format_contact_info(other_contact_info, user_id)}\n"
+            f"Теперь вы можете связаться и общаться!",
+            reply_markup=get_contact_keyboard(user_id)
+        )
     else:
-        # Отправляем уведомление другому пользователю о новом интересе
-        try:
-            await send_like_notification_with_buttons(viewed_user['telegram_id'], user_id)
-            logger.info(f"Уведомление о лайке отправлено пользователю {viewed_user['telegram_id']}")
-        except Exception as e:
-            logger.error(f"Не удалось отправить уведомление о лайке: {e}")
+        if result.is_new:
+            # Отправляем уведомление другому пользователю о новом интересе
+            if await send_like_notification_with_buttons(viewed_user['telegram_id'], user_id):
+                logger.info("Уведомление о лайке поставлено в очередь для %s", viewed_user['telegram_id'])
+        else:
+            # Повторное нажатие ничего не изменило - уведомление не дублируем
+            logger.info("Интерес %s -> %s уже был отправлен", user_id, viewed_user['telegram_id'])
         
         try:
             await callback.message.edit_text(
                 f"✅ **Интерес отправлен!**\n\n"
                 f"Вы выразили желание познакомиться с {viewed_user['name']}!\n\n"
                 f"Если {viewed_user['name']} тоже захочет познакомиться, вы получите уведомление о взаимном интересе.",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="🔍 Найти еще", callback_data="search")],
-                    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-                ])
+                reply_markup=get_search_more_keyboard()
             )
         except Exception as e:
-            logger.error(f"Ошибка редактирования сообщения: {e}")
+            logger.error("Ошибка редактирования сообщения: %s", e)
             await callback.message.answer(
                 f"✅ **Интерес отправлен!**\n\n"
                 f"Вы выразили желание познакомиться с {viewed_user['name']}!\n\n"
                 f"Если {viewed_user['name']} тоже захочет познакомиться, вы получите уведомление о взаимном интересе.",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="🔍 Найти еще", callback_data="search")],
-                    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-                ])
+                reply_markup=get_search_more_keyboard()
             )
     
     # Добавляем в список просмотренных
-    if user_id not in viewed_users:
-        viewed_users[user_id] = []
-    if viewed_user['telegram_id'] not in viewed_users[user_id]:
-        viewed_users[user_id].append(viewed_user['telegram_id'])
-        logger.info(f"Добавлен в просмотренные: {viewed_user['name']} (ID: {viewed_user['telegram_id']})")
+    if await db.add_view(user_id, viewed_user['telegram_id']):
+        logger.debug("Добавлен в просмотренные: %s (ID: %s)", viewed_user['name'], viewed_user['telegram_id'])
     else:
-        logger.info(f"Уже в просмотренных: {viewed_user['name']} (ID: {viewed_user['telegram_id']})")
+        logger.debug("Уже в просмотренных: %s (ID: %s)", viewed_user['name'], viewed_user['telegram_id'])
     
     # Удаляем из текущего просмотра
     if user_id in current_viewing:
@@ -776,23 +953,17 @@ async def process_next(callback: CallbackQuery, state: FSMContext):
     # Добавляем текущего пользователя в список просмотренных
     if user_id in current_viewing:
         viewed_user = current_viewing[user_id]
-        if user_id not in viewed_users:
-            viewed_users[user_id] = []
-        if viewed_user['telegram_id'] not in viewed_users[user_id]:
-            viewed_users[user_id].append(viewed_user['telegram_id'])
-            logger.info(f"Добавлен в просмотренные (Дальше): {viewed_user['name']} (ID: {viewed_user['telegram_id']})")
+        if await db.add_view(user_id, viewed_user['telegram_id']):
+            logger.debug("Добавлен в просмотренные (Дальше): %s (ID: %s)", viewed_user['name'], viewed_user['telegram_id'])
         else:
-            logger.info(f"Уже в просмотренных (Дальше): {viewed_user['name']} (ID: {viewed_user['telegram_id']})")
+            logger.debug("Уже в просмотренных (Дальше): %s (ID: %s)", viewed_user['name'], viewed_user['telegram_id'])
         del current_viewing[user_id]
     
-    # Получаем список уже просмотренных пользователей
-    user_viewed = viewed_users.get(user_id, [])
-    
-    # Ищем следующего пользователя, исключая просмотренных
-    random_user = await db.get_random_user(user_id, user_viewed)
+    # Ищем следующего пользователя, исключая просмотренных и лайкнутых
+    random_user = await next_random_candidate(user_id)
     if not random_user:
         # Если все пользователи просмотрены, сбрасываем список
-        viewed_users[user_id] = []
+        await db.clear_views(user_id)
         try:
             await callback.message.edit_text(
                 "🎉 **Все профили просмотрены!**\n\n"
@@ -803,7 +974,7 @@ async def process_next(callback: CallbackQuery, state: FSMContext):
                 ])
             )
         except Exception as e:
-            logger.error(f"Ошибка редактирования сообщения в process_next: {e}")
+            logger.error("Ошибка редактирования сообщения в process_next: %s", e)
             await callback.message.answer(
                 "🎉 **Все профили просмотрены!**\n\n"
                 "Список обновлен, попробуйте снова.",
@@ -816,13 +987,148 @@ async def process_next(callback: CallbackQuery, state: FSMContext):
         return
     
     # Добавляем нового пользователя в список просмотренных
-    viewed_users[user_id] = user_viewed + [random_user['telegram_id']]
+    await db.add_view(user_id, random_user['telegram_id'])
     
     # Сохраняем нового пользователя
     current_viewing[user_id] = random_user
     
-    # Показываем новую карточку
+    # Показываем новую карточку и сразу готовим следующую
     await show_profile_card(callback.message, random_user)
+    schedule_prefetch(user_id)
+    await callback.answer()
+
+
+# Максимум кнопок с филиалами в одном сообщении
+BRANCH_BUTTONS_LIMIT = 50
+
+
+@lru_cache(maxsize=None)
+def get_branch_card_keyboard():
+    """Клавиатура для карточки профиля при просмотре филиала (общая, не изменяйте)"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🤝 Познакомиться", callback_data="like")],
+        [InlineKeyboardButton(text="➡️ Дальше", callback_data="branch_next")],
+        [InlineKeyboardButton(text="🏢 Другой филиал", callback_data="browse_branches")],
+        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
+    ])
+
+
+@dp.callback_query(F.data == "browse_branches")
+async def browse_branches(callback: CallbackQuery, state: FSMContext):
+    """Список филиалов для просмотра анкет"""
+    user_id = callback.from_user.id
+    
+    # Проверяем, есть ли анкета у пользователя
+    if not await check_profile_exists(user_id):
+        await callback.message.edit_text(
+            "❌ **Сначала создайте профиль!**\n\n"
+            "Для поиска людей необходимо заполнить анкету.",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="📝 Создать профиль", callback_data="create_profile")]
+            ])
+        )
+        await callback.answer()
+        return
+    
+    branch_counts = await db.get_branch_counts(exclude_telegram_id=user_id)
+    if not branch_counts:
+        await callback.message.edit_text(
+            "😔 **Пока нет доступных профилей**\n\n"
+            "Попробуйте позже.",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
+            ])
+        )
+        await callback.answer()
+        return
+    
+    # Свой филиал показываем первым
+    user = await get_user_profile(user_id)
+    own_branch = user['branch'] if user else None
+    branch_counts.sort(key=lambda item: item[0] != own_branch)
+    branch_counts = branch_counts[:BRANCH_BUTTONS_LIMIT]
+    
+    # Название филиала может не поместиться в callback_data (64 байта), поэтому
+    # сохраняем список в FSM, а в кнопку кладем только номер
+    await state.update_data(browse_branches=[branch for branch, _ in branch_counts])
+    
+    buttons = []
+    for i, (branch, count) in enumerate(branch_counts):
+        mark = "⭐ " if branch == own_branch else ""
+        buttons.append([InlineKeyboardButton(text=f"{mark}{branch} ({count})", callback_data=f"browse_branch_{i}")])
+    buttons.append([InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")])
+    
+    text = "🏢 **Люди по филиалам**\n\nВыберите филиал:"
+    try:
+        await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+    except Exception:
+        # Предыдущее сообщение могло быть карточкой с фото
+        await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+    await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("browse_branch_"))
+async def select_branch(callback: CallbackQuery, state: FSMContext):
+    """Начало просмотра анкет выбранного филиала"""
+    data = await state.get_data()
+    branches = data.get('browse_branches', [])
+    index = int(callback.data.split("_")[2])
+    
+    if index >= len(branches):
+        await callback.answer("Список филиалов устарел, откройте его заново", show_alert=True)
+        return
+    
+    await state.update_data(browse_branch=branches[index], browse_cursor=0)
+    await show_next_in_branch(callback, state)
+
+
+@dp.callback_query(F.data == "branch_next")
+async def process_branch_next(callback: CallbackQuery, state: FSMContext):
+    """Обработка кнопки 'Дальше' при просмотре филиала"""
+    user_id = callback.from_user.id
+    
+    # Добавляем текущего пользователя в список просмотренных
+    if user_id in current_viewing:
+        await db.add_view(user_id, current_viewing[user_id]['telegram_id'])
+        del current_viewing[user_id]
+    
+    await show_next_in_branch(callback, state)
+
+
+async def show_next_in_branch(callback: CallbackQuery, state: FSMContext):
+    """Показ следующей непросмотренной анкеты выбранного филиала"""
+    user_id = callback.from_user.id
+    data = await state.get_data()
+    branch = data.get('browse_branch')
+    
+    if not branch:
+        await callback.answer("Выберите филиал заново", show_alert=True)
+        return
+    
+    next_user = await db.get_next_user_in_branch(user_id, branch, data.get('browse_cursor', 0))
+    if not next_user:
+        text = (
+            f"🎉 **Все анкеты филиала «{branch}» просмотрены!**\n\n"
+            "Выберите другой филиал или вернитесь позже."
+        )
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🏢 Другой филиал", callback_data="browse_branches")],
+            [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
+        ])
+        try:
+            await callback.message.edit_text(text, reply_markup=keyboard)
+        except Exception as e:
+            logger.error("Ошибка редактирования сообщения в show_next_in_branch: %s", e)
+            await callback.message.answer(text, reply_markup=keyboard)
+        await callback.answer()
+        return
+    
+    # Сдвигаем курсор и отмечаем анкету просмотренной
+    await state.update_data(browse_cursor=next_user['id'])
+    await db.add_view(user_id, next_user['telegram_id'])
+    current_viewing[user_id] = next_user
+    
+    await show_profile_card(callback.message, next_user, keyboard=get_branch_card_keyboard())
     await callback.answer()
 
 
@@ -833,9 +1139,7 @@ async def back_to_main_menu(callback: CallbackQuery, state: FSMContext):
     if user_id in current_viewing:
         del current_viewing[user_id]
     
-    # НЕ сбрасываем список просмотренных пользователей - он должен сохраняться
-    # if user_id in viewed_users:
-    #     del viewed_users[user_id]
+    # НЕ сбрасываем список просмотренных пользователей - он хранится в базе
     
     try:
         # Пытаемся отредактировать сообщение
@@ -843,7 +1147,8 @@ async def back_to_main_menu(callback: CallbackQuery, state: FSMContext):
             "🏠 **Главное меню**\n\n"
             "**🔍 Поиск людей:**\n"
             "• Случайный поиск\n"
-            "• Поиск по ключевым словам\n\n"
+            "• Поиск по ключевым словам\n"
+            "• Просмотр по филиалам\n\n"
             "**👤 Управление профилем:**\n"
             "• Просмотр и редактирование\n"
             "• История просмотров\n"
@@ -858,7 +1163,8 @@ async def back_to_main_menu(callback: CallbackQuery, state: FSMContext):
             "🏠 **Главное меню**\n\n"
             "**🔍 Поиск людей:**\n"
             "• Случайный поиск\n"
-            "• Поиск по ключевым словам\n\n"
+            "• Поиск по ключевым словам\n"
+            "• Просмотр по филиалам\n\n"
             "**👤 Управление профилем:**\n"
             "• Просмотр и редактирование\n"
             "• История просмотров\n"
@@ -927,7 +1233,7 @@ async def process_keywords_search(message: types.Message, state: FSMContext):
     
     # Ищем пользователей по ключевым словам
     search_results = await db.search_users_by_keywords(keywords, message.from_user.id)
-    logger.info(f"Поиск по ключевым словам '{keywords}': найдено {len(search_results)} результатов")
+    logger.info("Поиск по ключевым словам '%s': найдено %s результатов", keywords, len(search_results))
     
     if not search_results:
         await message.answer(
@@ -986,17 +1292,16 @@ async def respond_to_like(callback: CallbackQuery, state: FSMContext):
         user_id = callback.from_user.id
         from_user_id = int(callback.data.split("_")[2])
         
-        logger.info(f"Пользователь {user_id} отвечает на лайк от {from_user_id}")
+        logger.info("Пользователь %s отвечает на лайк от %s", user_id, from_user_id)
         
-        # Добавляем лайк в ответ
-        await db.add_like(user_id, from_user_id)
+        # Добавляем лайк в ответ и в той же транзакции проверяем взаимность.
+        # Повторное нажатие вернет is_match = False, и уведомление не уйдет второй раз
+        result = await db.like(user_id, from_user_id)
+        discard_prefetch(user_id, from_user_id)
         
-        # Проверяем, есть ли теперь взаимный лайк
-        is_match = await db.check_match(user_id, from_user_id)
-        
-        if is_match:
+        if result.is_match:
             # Получаем контактную информацию
-            contact_info = await db.get_user_contact_info(from_user_id)
+            contact_info = await get_contact_info(from_user_id)
             
             try:
                 await callback.message.edit_text(
@@ -1008,7 +1313,7 @@ async def respond_to_like(callback: CallbackQuery, state: FSMContext):
                     reply_markup=get_contact_keyboard(from_user_id)
                 )
             except Exception as e:
-                logger.error(f"Ошибка редактирования сообщения: {e}")
+                logger.error("Ошибка редактирования сообщения: %s", e)
                 await callback.message.answer(
                     f"🎉 **Взаимный интерес!**\n\n"
                     f"Вы и {contact_info['name']} хотите познакомиться!\n\n"
@@ -1020,47 +1325,38 @@ async def respond_to_like(callback: CallbackQuery, state: FSMContext):
             
             # Уведомляем другого пользователя о совпадении (только если это реальный пользователь)
             if from_user_id != user_id and from_user_id > 100000000 and from_user_id not in [123456789, 4001, 5001, 6001, 7001, 8001]:
-                other_contact_info = await db.get_user_contact_info(user_id)
-                try:
-                    await bot.send_message(
-                        from_user_id,
-                        f"🎉 **Взаимный интерес!**\n\n"
-                        f"Вы и {other_contact_info['name']} хотите познакомиться!\n\n"
-                        f"💬 **Контакты для связи:**\n"
-                        f"{format_contact_info(other_contact_info, user_id)}\n"
-                        f"Теперь вы можете связаться и общаться!",
-                        reply_markup=get_contact_keyboard(user_id)
-                    )
-                    logger.info(f"Уведомление о совпадении отправлено пользователю {from_user_id}")
-                except Exception as e:
-                    logger.error(f"Не удалось отправить уведомление пользователю {from_user_id}: {e}")
+                other_contact_info = await get_contact_info(user_id)
+                notifier.send_message(
+                    from_user_id,
+                    f"🎉 **Взаимный интерес!**\n\n"
+                    f"Вы и {other_contact_info['name']} хотите познакомиться!\n\n"
+                    f"💬 **Контакты для связи:**\n"
+                    f"{format_contact_info(other_contact_info, user_id)}\n"
+                    f"Теперь вы можете связаться и общаться!",
+                    reply_markup=get_contact_keyboard(user_id)
+                )
+                logger.info("Уведомление о совпадении поставлено в очередь для %s", from_user_id)
         else:
             try:
                 await callback.message.edit_text(
                     f"✅ **Интерес отправлен!**\n\n"
                     f"Вы выразили желание познакомиться с пользователем!\n\n"
                     f"Если он тоже захочет познакомиться, вы получите уведомление о взаимном интересе.",
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text="🔍 Найти еще", callback_data="search")],
-                        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-                    ])
+                    reply_markup=get_search_more_keyboard()
                 )
             except Exception as e:
-                logger.error(f"Ошибка редактирования сообщения: {e}")
+                logger.error("Ошибка редактирования сообщения: %s", e)
                 await callback.message.answer(
                     f"✅ **Интерес отправлен!**\n\n"
                     f"Вы выразили желание познакомиться с пользователем!\n\n"
                     f"Если он тоже захочет познакомиться, вы получите уведомление о взаимном интересе.",
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text="🔍 Найти еще", callback_data="search")],
-                        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-                    ])
+                    reply_markup=get_search_more_keyboard()
                 )
         
         await callback.answer()
         
     except Exception as e:
-        logger.error(f"Ошибка в respond_to_like: {e}")
+        logger.error("Ошибка в respond_to_like: %s", e)
         await callback.answer("Произошла ошибка. Попробуйте еще раз.", show_alert=True)
 
 @dp.callback_query(F.data.startswith("skip_like_"))
@@ -1068,11 +1364,15 @@ async def skip_like(callback: CallbackQuery, state: FSMContext):
     """Обработка пропуска лайка"""
     from_user_id = int(callback.data.split("_")[2])
     
+    # Убираем интерес из входящих, чтобы он не показывался снова
+    await db.skip_like(callback.from_user.id, from_user_id)
+    
     await callback.message.edit_text(
         f"➡️ **Запрос пропущен**\n\n"
         f"Вы пропустили этот запрос на знакомство.\n\n"
         f"Можете продолжить поиск других людей!",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="💌 Входящие интересы", callback_data="inbox")],
             [InlineKeyboardButton(text="🔍 Найти людей", callback_data="search")],
             [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
         ])
@@ -1080,6 +1380,77 @@ async def skip_like(callback: CallbackQuery, state: FSMContext):
     
     await callback.answer()
 
+
+# Количество входящих интересов на одной странице
+INBOX_PAGE_SIZE = 5
+
+
+@dp.callback_query(F.data == "inbox")
+async def show_inbox(callback: CallbackQuery, state: FSMContext):
+    """Показ первой страницы входящих интересов"""
+    await show_inbox_page(callback, state, cursor=None)
+
+
+@dp.callback_query(F.data == "inbox_more")
+async def show_inbox_more(callback: CallbackQuery, state: FSMContext):
+    """Показ следующей страницы входящих интересов"""
+    data = await state.get_data()
+    cursor = data.get('inbox_next_cursor')
+    await show_inbox_page(callback, state, cursor=tuple(cursor) if cursor else None)
+
+
+async def show_inbox_page(callback: CallbackQuery, state: FSMContext, cursor: Optional[tuple]):
+    """Показ страницы входящих интересов с кнопками ответа"""
+    user_id = callback.from_user.id
+    
+    unread_count = await db.get_pending_likes_count(user_id)
+    likes, next_cursor = await db.get_pending_likes_page(user_id, cursor, limit=INBOX_PAGE_SIZE)
+    
+    # Курсор следующей страницы храним в FSM: в callback_data он не помещается
+    await state.update_data(inbox_next_cursor=list(next_cursor) if next_cursor else None)
+    
+    # Имена и должности пишут сами участники: разметка передается entities,
+    # а не Markdown, чтобы * _ ` [ в них не ломали сообщение
+    if not likes:
+        content = Text(
+            "💌 ", Bold("Входящие интересы"), "\n\n"
+            "Новых запросов на знакомство пока нет.\n\n"
+            "Когда кто-то захочет познакомиться с вами, он появится здесь."
+        )
+        buttons = []
+    else:
+        parts = ["💌 ", Bold("Входящие интересы"), f" ({unread_count} без ответа):\n\n"]
+        buttons = []
+        for i, like in enumerate(likes, 1):
+            parts += [f"{i}. ", Bold(like['name']), "\n"]
+            if like.get('branch'):
+                parts.append(f"   🏢 {like['branch']}")
+            if like.get('job_title'):
+                parts.append(f" | 💼 {like['job_title']}")
+            parts.append("\n\n")
+            buttons.append([
+                InlineKeyboardButton(text=f"🤝 {i}. {like['name']}", callback_data=f"respond_like_{like['from_user_id']}"),
+                InlineKeyboardButton(text="➡️ Пропустить", callback_data=f"skip_like_{like['from_user_id']}")
+            ])
+        parts.append("💡 Нажмите на имя, чтобы познакомиться")
+        content = Text(*parts)
+    
+    navigation = []
+    if cursor:
+        navigation.append(InlineKeyboardButton(text="⏮ В начало", callback_data="inbox"))
+    if next_cursor:
+        navigation.append(InlineKeyboardButton(text="Ещё ➡️", callback_data="inbox_more"))
+    if navigation:
+        buttons.append(navigation)
+    buttons.append([InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")])
+    
+    try:
+        await callback.message.edit_text(**content.as_kwargs(), reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+    except Exception:
+        # Если не получается отредактировать (например, сообщение с фото), отправляем новое
+        await callback.message.answer(**content.as_kwargs(), reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+    await callback.answer()
+
 @dp.callback_query(F.data == "viewed_list")
 async def show_viewed_list(callback: CallbackQuery, state: FSMContext):
     """Показ списка просмотренных пользователей"""
@@ -1097,10 +1468,11 @@ async def show_viewed_list(callback: CallbackQuery, state: FSMContext):
         await callback.answer()
         return
     
-    user_viewed = viewed_users.get(user_id, [])
-    logger.info(f"Просмотренные пользователи для {user_id}: {user_viewed}")
+    # Получаем информацию о просмотренных пользователях
+    viewed_users_info = await db.get_viewed_users(user_id)
+    logger.info("Просмотренные пользователи для %s: %s", user_id, len(viewed_users_info))
     
-    if not user_viewed:
+    if not viewed_users_info:
         await callback.message.edit_text(
             "👀 **Просмотренные профили**\n\n"
             "Вы еще никого не просматривали.\n\n"
@@ -1113,14 +1485,6 @@ async def show_viewed_list(callback: CallbackQuery, state: FSMContext):
         await callback.answer()
         return
     
-    # Получаем информацию о просмотренных пользователях
-    viewed_users_info = await db.get_users_by_ids(user_viewed)
-    
-    if not viewed_users_info:
-        await callback.message.edit_text("❌ Ошибка при загрузке списка просмотренных.")
-        await callback.answer()
-        return
-    
     # Формируем список
     text = f"👀 **Просмотренные профили** ({len(viewed_users_info)}):\n\n"
     
@@ -1152,8 +1516,7 @@ async def clear_viewed_list(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     
     # Очищаем список просмотренных
-    if user_id in viewed_users:
-        del viewed_users[user_id]
+    await db.clear_views(user_id)
     
     await callback.message.edit_text(
         "✅ **Список просмотренных профилей очищен!**\n\n"
@@ -1171,12 +1534,8 @@ async def show_my_profile(callback: CallbackQuery, state: FSMContext):
     """Показ профиля пользователя"""
     user_id = callback.from_user.id
     
-    # Проверяем кэш
-    user = get_cached_user(user_id)
-    if not user:
-        user = await db.get_user(user_id)
-        if user:
-            set_cached_user(user_id, user)
+    # Анкета из кэша или базы
+    user = await get_user_profile(user_id)
     
     if not user:
         await callback.message.edit_text(
@@ -1219,7 +1578,7 @@ async def show_my_profile(callback: CallbackQuery, state: FSMContext):
                 reply_markup=keyboard
             )
     except Exception as e:
-        logger.error(f"Ошибка при показе профиля: {e}")
+        logger.error("Ошибка при показе профиля: %s", e)
         await callback.message.answer(
             text,
             parse_mode="Markdown",
@@ -1270,7 +1629,7 @@ async def edit_profile(callback: CallbackQuery, state: FSMContext):
 async def edit_name(callback: CallbackQuery, state: FSMContext):
     """Редактирование имени"""
     # Получаем текущие данные профиля
-    user_data = await db.get_user(callback.from_user.id)
+    user_data = await get_user_profile(callback.from_user.id)
     if user_data:
         await state.update_data(
             name=user_data['name'],
@@ -1296,7 +1655,7 @@ async def edit_name(callback: CallbackQuery, state: FSMContext):
 async def edit_branch(callback: CallbackQuery, state: FSMContext):
     """Редактирование филиала"""
     # Получаем текущие данные профиля
-    user_data = await db.get_user(callback.from_user.id)
+    user_data = await get_user_profile(callback.from_user.id)
     if user_data:
         await state.update_data(
             name=user_data['name'],
@@ -1322,7 +1681,7 @@ async def edit_branch(callback: CallbackQuery, state: FSMContext):
 async def edit_job_title(callback: CallbackQuery, state: FSMContext):
     """Редактирование должности"""
     # Получаем текущие данные профиля
-    user_data = await db.get_user(callback.from_user.id)
+    user_data = await get_user_profile(callback.from_user.id)
     if user_data:
         await state.update_data(
             name=user_data['name'],
@@ -1348,7 +1707,7 @@ async def edit_job_title(callback: CallbackQuery, state: FSMContext):
 async def edit_about(callback: CallbackQuery, state: FSMContext):
     """Редактирование информации о себе"""
     # Получаем текущие данные профиля
-    user_data = await db.get_user(callback.from_user.id)
+    user_data = await get_user_profile(callback.from_user.id)
     if user_data:
         await state.update_data(
             name=user_data['name'],
@@ -1374,7 +1733,7 @@ async def edit_about(callback: CallbackQuery, state: FSMContext):
 async def edit_photo(callback: CallbackQuery, state: FSMContext):
     """Редактирование фото"""
     # Получаем текущие данные профиля
-    user_data = await db.get_user(callback.from_user.id)
+    user_data = await get_user_profile(callback.from_user.id)
     if user_data:
         await state.update_data(
             name=user_data['name'],
@@ -1438,10 +1797,10 @@ async def show_statistics(callback: CallbackQuery, state: FSMContext):
     
     # Получаем статистику
     total_users = await db.get_users_count()
-    viewed_count = len(viewed_users.get(user_id, []))
+    viewed_count = await db.get_viewed_count(user_id)
     
     # Получаем информацию о пользователе
-    user = await db.get_user(user_id)
+    user = await get_user_profile(user_id)
     
     # Формируем статистику
     text = f"📊 **Ваша статистика**\n\n"
@@ -1483,6 +1842,8 @@ async def show_statistics(callback: CallbackQuery, state: FSMContext):
 async def confirm_reset(callback: CallbackQuery, state: FSMContext):
     """Подтверждение сброса профиля"""
     success = await db.delete_user(callback.from_user.id)
+    invalidate_cached_user(callback.from_user.id)
+    discard_prefetch(callback.from_user.id)
     
     if success:
         await callback.message.edit_text(
@@ -1503,6 +1864,8 @@ async def confirm_reset(callback: CallbackQuery, state: FSMContext):
 async def cmd_reset(message: types.Message, state: FSMContext):
     """Команда /reset"""
     success = await db.delete_user(message.from_user.id)
+    invalidate_cached_user(message.from_user.id)
+    discard_prefetch(message.from_user.id)
     
     if success:
         await message.answer(MESSAGES['profile_reset'])
@@ -1515,7 +1878,7 @@ async def cmd_reset(message: types.Message, state: FSMContext):
 @dp.message(Command("profile"))
 async def cmd_profile(message: types.Message, state: FSMContext):
     """Команда /profile"""
-    user = await db.get_user(message.from_user.id)
+    user = await get_user_profile(message.from_user.id)
     if not user:
         await message.answer(MESSAGES['profile_not_found'])
         return
@@ -1536,10 +1899,192 @@ async def cmd_profile(message: types.Message, state: FSMContext):
         await message.answer(text, parse_mode="Markdown")
 
 
+def is_admin(user_id: int) -> bool:
+    """Является ли пользователь организатором"""
+    return user_id in ADMIN_IDS
+
+
+def format_broadcast_status(broadcast: Dict[str, Any]) -> str:
+    """Строка о состоянии рассылки"""
+    statuses = {
+        'draft': '📝 черновик',
+        'running': '⏳ идет',
+        'done': '✅ завершена',
+        'cancelled': '⏹ остановлена',
+        'failed': '❌ прервана ошибкой',
+    }
+    preview = broadcast['text'] if len(broadcast['text']) <= 40 else broadcast['text'][:40] + '…'
+    text = (
+        f"#{broadcast['id']} {statuses.get(broadcast['status'], broadcast['status'])}: {preview}\n"
+        f"   доставлено {broadcast['delivered']}, заблокировали {broadcast['blocked']}, "
+        f"ошибки {broadcast['failed']}"
+    )
+    if broadcast['status'] == 'failed':
+        text += f"\n   отправлено до telegram_id {broadcast['last_telegram_id']} включительно"
+    return text
+
+
+async def notify_broadcast_finished(broadcast: Dict[str, Any]):
+    """Сообщить автору рассылки об итогах"""
+    title = "📣 Рассылка прервана ошибкой" if broadcast['status'] == 'failed' else "📣 Рассылка завершена"
+    notifier.send_message(broadcast['created_by'], f"{title}\n\n{format_broadcast_status(broadcast)}")
+
+
+@dp.message(Command("broadcast"))
+async def cmd_broadcast(message: types.Message, command: CommandObject):
+    """Команда /broadcast <текст> - рассылка всем участникам (только для организаторов)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Команда доступна только организаторам.")
+        return
+    
+    text = (command.args or '').strip()
+    if not text:
+        await message.answer(
+            "📣 Рассылка всем участникам\n\n"
+            "Использование: /broadcast <текст объявления>\n"
+            "Состояние рассылок: /broadcast_status"
+        )
+        return
+    
+    broadcast_id = await db.create_broadcast(text, message.from_user.id)
+    if broadcast_id is None:
+        await message.answer("❌ Не удалось создать рассылку.")
+        return
+    
+    users_count = await db.get_users_count()
+    await message.answer(
+        f"📣 Рассылка #{broadcast_id} получат {users_count} участников:\n\n{text}",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Отправить всем", callback_data=f"broadcast_send_{broadcast_id}")],
+            [InlineKeyboardButton(text="❌ Отмена", callback_data=f"broadcast_cancel_{broadcast_id}")]
+        ])
+    )
+
+
+@dp.callback_query(F.data.startswith("broadcast_send_"))
+async def confirm_broadcast(callback: CallbackQuery):
+    """Запуск рассылки после подтверждения"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Команда доступна только организаторам", show_alert=True)
+        return
+    
+    broadcast_id = int(callback.data.split("_")[2])
+    # Переводим черновик в работу ровно один раз, даже при двойном нажатии
+    if not await db.set_broadcast_status(broadcast_id, 'running', expected_status='draft'):
+        await callback.answer("Рассылка уже запущена или отменена", show_alert=True)
+        return
+    
+    broadcaster.start(broadcast_id, on_finish=notify_broadcast_finished)
+    logger.info("Организатор %s запустил рассылку #%s", callback.from_user.id, broadcast_id)
+    await callback.message.edit_text(
+        f"⏳ Рассылка #{broadcast_id} запущена. Когда она закончится, придет отчет.\n"
+        f"Состояние: /broadcast_status"
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("broadcast_cancel_"))
+async def cancel_broadcast(callback: CallbackQuery):
+    """Отмена черновика или остановка идущей рассылки"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Команда доступна только организаторам", show_alert=True)
+        return
+    
+    broadcast_id = int(callback.data.split("_")[2])
+    if await db.set_broadcast_status(broadcast_id, 'cancelled', expected_status='draft'):
+        await callback.message.edit_text(f"❌ Рассылка #{broadcast_id} отменена.")
+    elif await broadcaster.cancel(broadcast_id):
+        broadcast = await db.get_broadcast(broadcast_id)
+        await callback.message.edit_text(f"⏹ Рассылка остановлена\n\n{format_broadcast_status(broadcast)}")
+    else:
+        await callback.answer("Рассылка уже завершена", show_alert=True)
+        return
+    await callback.answer()
+
+
+@dp.message(Command("broadcast_status"))
+async def cmd_broadcast_status(message: types.Message):
+    """Команда /broadcast_status - последние рассылки и их прогресс"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Команда доступна только организаторам.")
+        return
+    
+    broadcasts = await db.get_broadcasts(limit=5)
+    if not broadcasts:
+        await message.answer("📣 Рассылок пока не было.")
+        return
+    
+    buttons = [
+        [InlineKeyboardButton(text=f"⏹ Остановить #{b['id']}", callback_data=f"broadcast_cancel_{b['id']}")]
+        for b in broadcasts if b['status'] == 'running'
+    ]
+    await message.answer(
+        "📣 Последние рассылки:\n\n" + "\n".join(format_broadcast_status(b) for b in broadcasts),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
+    )
+
+
+def collect_bot_gauges():
+    """Мгновенные значения для /metrics: очереди, кэши, групповая запись"""
+    notifier_stats = notifier.get_stats()
+    yield 'bot_notifications_pending', 'Сообщения в очереди отправки', {}, notifier_stats['pending']
+    for outcome in ('sent', 'blocked', 'failed', 'retries', 'rate_limited'):
+        yield 'bot_notifications', 'Счетчики очереди уведомлений', {'outcome': outcome}, notifier_stats[outcome]
+    
+    write_stats = db.get_write_stats()
+    yield 'bot_db_write_queue_depth', 'Операции в очереди групповой записи', {}, write_stats['queue_depth']
+    yield 'bot_db_write_avg_batch_size', 'Средний размер пачки записи', {}, write_stats['avg_batch_size']
+    
+    for cache_name, cache in (('profiles', user_cache), ('cards', card_cache)):
+        cache_stats = cache.stats()
+        yield 'bot_cache_size', 'Записей в кэше', {'cache': cache_name}, cache_stats['size']
+        yield 'bot_cache_hit_rate', 'Доля попаданий в кэш', {'cache': cache_name}, cache_stats['hit_rate']
+    
+    yield 'bot_prefetch_hit_rate', 'Доля нажатий, обслуженных предвыбранной анкетой', {}, get_prefetch_stats()['hit_rate']
+
+
+register_collector(collect_bot_gauges)
+
+
+@dp.message(Command("metrics"))
+async def cmd_metrics(message: types.Message):
+    """Команда /metrics - сводка по обработчикам и полная выгрузка Prometheus (только для организаторов)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Команда доступна только организаторам.")
+        return
+    
+    summary = handler_summary() or "Пока нет данных."
+    await message.answer(f"📈 Обработчики (по суммарному времени):\n\n{summary}"[:4000])
+    await message.answer_document(
+        BufferedInputFile(render_prometheus().encode('utf-8'), filename="metrics.txt")
+    )
+
+
+@dp.message(Command("sqlprofile"))
+async def cmd_sqlprofile(message: types.Message, command: CommandObject):
+    """Команда /sqlprofile [reset] - самые затратные запросы к базе (только для организаторов)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Команда доступна только организаторам.")
+        return
+    if db.profiler is None:
+        await message.answer("Профилирование запросов выключено. Запустите бота с DATABASE_PROFILE=1.")
+        return
+    
+    if (command.args or '').strip() == 'reset':
+        db.profiler.reset()
+        await message.answer("🧹 Статистика запросов обнулена.")
+        return
+    
+    await message.answer_document(
+        BufferedInputFile(db.profiler.report(limit=50).encode('utf-8'), filename="sql_profile.txt"),
+        caption="🗄 Запросы к базе по суммарному времени"
+    )
+
+
 @dp.message()
 async def handle_unknown_message(message: types.Message, state: FSMContext):
     """Обработчик для всех необработанных сообщений"""
-    logger.info(f"Необработанное сообщение от {message.from_user.id}: {message.text}")
+    logger.info("Необработанное сообщение от %s: %s", message.from_user.id, message.text)
     
     # Если пользователь в процессе создания профиля, предлагаем продолжить
     current_state = await state.get_state()
@@ -1552,8 +2097,7 @@ async def handle_unknown_message(message: types.Message, state: FSMContext):
         )
     else:
         # Если пользователь не в процессе создания профиля, показываем главное меню
-        user = await db.get_user(message.from_user.id)
-        if user:
+        if db.profile_exists(message.from_user.id):
             await message.answer(
                 "❓ Не понимаю эту команду.\n\n"
                 "Используйте кнопки меню для навигации:",
@@ -1577,36 +2121,122 @@ async def main():
     try:
         bot_info = await bot.get_me()
         BOT_ID = bot_info.id
-        logger.info(f"ID бота: {BOT_ID}")
+        logger.info("ID бота: %s", BOT_ID)
     except Exception as e:
-        logger.error(f"Не удалось получить ID бота: {e}")
+        logger.error("Не удалось получить ID бота: %s", e)
         BOT_ID = None
     
-    # Инициализируем базу данных
-    await db.init_db()
+    # Открываем пул соединений и инициализируем базу данных
+    await db.open()
     logger.info("База данных инициализирована")
     
-    # Запускаем бота
-    logger.info("Запуск бота...")
-    await dp.start_polling(bot)
+    # Рассылки, прерванные перезапуском, продолжаются с последней контрольной точки
+    resumed = await broadcaster.resume_unfinished(on_finish=notify_broadcast_finished)
+    if resumed:
+        logger.info("Продолжено рассылок: %s", resumed)
+    
+    # Локальный эндпоинт /metrics для Prometheus
+    try:
+        metrics_runner = await start_metrics_server()
+    except OSError as e:
+        logger.error("Не удалось запустить сервер метрик: %s", e)
+        metrics_runner = None
+    
+    try:
+        # Запускаем бота
+        if RUN_MODE == 'webhook':
+            logger.info("Запуск бота в режиме webhook...")
+            await run_webhook()
+        else:
+            logger.info("Запуск бота...")
+            await dp.start_polling(bot)
+    finally:
+        # Останавливаем рассылки (прогресс сохранен) и досылаем уведомления, пока база еще открыта
+        await broadcaster.close()
+        await notifier.close()
+        if recorder is not None:
+            await recorder.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await db.close()
+        if db.profiler is not None:
+            logger.info("Профиль запросов к базе:\n%s", db.profiler.report())
+        logger.info("Соединения с базой данных закрыты")
+
+
+async def health_check(request: web.Request) -> web.Response:
+    """Проверка работоспособности для балансировщика хостинга"""
+    return web.json_response({
+        'status': 'ok',
+        'mode': RUN_MODE,
+        'users': await db.get_users_count(),
+        'prefetch': get_prefetch_stats(),
+    })
+
+
+def create_webhook_app() -> web.Application:
+    """aiohttp-приложение: прием обновлений от Telegram и /health"""
+    app = web.Application()
+    app.router.add_get('/health', health_check)
+    
+    # Обновления с неверным секретом отклоняются с 401
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET_TOKEN or None,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook():
+    """Запуск встроенного aiohttp-сервера для приема вебхуков"""
+    runner = web.AppRunner(create_webhook_app())
+    await runner.setup()
+    site = web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT)
+    await site.start()
+    logger.info("Вебхук-сервер слушает %s:%s%s", WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH)
+    if not WEBHOOK_SECRET_TOKEN:
+        logger.warning("WEBHOOK_SECRET не задан: %s принимает обновления от кого угодно", WEBHOOK_PATH)
+    
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET_TOKEN or None,
+            max_connections=min(MAX_CONCURRENT_UPDATES, 100),
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info("Вебхук зарегистрирован: %s%s", WEBHOOK_URL, WEBHOOK_PATH)
+    else:
+        logger.warning("WEBHOOK_URL не задан: setWebhook не вызывается, обновления можно присылать вручную")
+    
+    try:
+        # Работаем, пока процесс не остановят
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 
 async def send_like_notification_with_buttons(to_user_id: int, from_user_id: int):
-    """Отправка уведомления о новом лайке с кнопками ответа"""
+    """Отправка уведомления о новом лайке с кнопками ответа
+    
+    Сообщение ставится в очередь notifier и доставляется в фоне;
+    True означает, что уведомление поставлено в очередь.
+    """
     try:
         # Проверяем, что получатель - не бот
         if BOT_ID and to_user_id == BOT_ID:
-            logger.warning(f"Попытка отправить уведомление боту (ID: {to_user_id})")
+            logger.warning("Попытка отправить уведомление боту (ID: %s)", to_user_id)
             return False
             
         # Получаем информацию о пользователе, который поставил лайк
-        contact_info = await db.get_user_contact_info(from_user_id)
+        contact_info = await get_contact_info(from_user_id)
         
         if not contact_info:
-            logger.error(f"Не удалось получить информацию о пользователе {from_user_id}")
+            logger.error("Не удалось получить информацию о пользователе %s", from_user_id)
             return False
         
-        await bot.send_message(
+        notifier.send_message(
             to_user_id,
             f"💖 **Новый интерес!**\n\n"
             f"👤 {contact_info['name']} выразил желание познакомиться с вами!\n\n"
@@ -1616,10 +2246,9 @@ async def send_like_notification_with_buttons(to_user_id: int, from_user_id: int
             f"💡 Выберите действие:",
             reply_markup=get_response_keyboard(from_user_id)
         )
-        logger.info(f"✅ Уведомление о лайке отправлено пользователю {to_user_id}")
         return True
     except Exception as e:
-        logger.error(f"Не удалось отправить уведомление о лайке: {e}")
+        logger.error("Не удалось поставить уведомление о лайке в очередь: %s", e)
         return False
 
 if __name__ == "__main__":
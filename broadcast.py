@@ -0,0 +1,145 @@
+"""
+Рассылка объявлений организаторов всем участникам
+"""
+import asyncio
+import contextvars
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from database import Database
+from notifications import NotificationScheduler, PRIORITY_BROADCAST, SENT, BLOCKED, FAILED
+
+logger = logging.getLogger(__name__)
+
+# Сколько получателей обрабатывается за раз; после каждой пачки сохраняется прогресс
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', '50'))
+
+# Вызывается по окончании рассылки с её итоговой записью из базы
+FinishCallback = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class BroadcastRunner:
+    """Выполняет рассылки в фоне
+
+    Получатели читаются из users пачками по возрастанию telegram_id.
+    Сообщения пачки отправляются через общую очередь NotificationScheduler
+    с низким приоритетом, так что рассылка соблюдает лимиты Telegram и не
+    задерживает личные уведомления. Одновременно в очереди не больше
+    batch_size сообщений одной рассылки.
+
+    После каждой пачки в broadcasts сохраняются последний telegram_id и
+    счетчики доставлено/заблокировали/ошибки. Рассылка в статусе
+    'running' после перезапуска продолжается с этой точки, поэтому
+    повторно может прийти не больше одной пачки. Рассылка, прерванная
+    ошибкой, получает статус 'failed' (прогресс остается на последней
+    сохраненной пачке) и сама не продолжается; автор узнает об этом
+    через on_finish.
+    """
+
+    def __init__(self, db: Database, notifier: NotificationScheduler,
+                 batch_size: int = BROADCAST_BATCH_SIZE):
+        self.db = db
+        self.notifier = notifier
+        self.batch_size = max(1, batch_size)
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def is_running(self, broadcast_id: int) -> bool:
+        return broadcast_id in self._tasks
+
+    def start(self, broadcast_id: int, on_finish: Optional[FinishCallback] = None) -> bool:
+        """Запустить рассылку в фоне; False, если она уже идет"""
+        if broadcast_id in self._tasks:
+            return False
+        # Рассылка живет дольше обновления, которое её запустило, - запускаем в чистом контексте
+        task = contextvars.Context().run(asyncio.create_task, self._run(broadcast_id, on_finish))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+        return True
+
+    async def resume_unfinished(self, on_finish: Optional[FinishCallback] = None) -> int:
+        """Продолжить рассылки, прерванные перезапуском"""
+        broadcasts = await self.db.get_broadcasts(status='running', limit=100)
+        for broadcast in broadcasts:
+            logger.info(
+                "Продолжаем рассылку #%s после telegram_id %s", broadcast['id'], broadcast['last_telegram_id']
+            )
+            self.start(broadcast['id'], on_finish)
+        return len(broadcasts)
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        """Остановить рассылку; уже отправленное не отзывается"""
+        task = self._tasks.get(broadcast_id)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        return await self.db.set_broadcast_status(broadcast_id, 'cancelled', expected_status='running')
+
+    async def _run(self, broadcast_id: int, on_finish: Optional[FinishCallback]):
+        broadcast = await self.db.get_broadcast(broadcast_id)
+        if broadcast is None or broadcast['status'] != 'running':
+            return
+
+        counts = {
+            SENT: broadcast['delivered'],
+            BLOCKED: broadcast['blocked'],
+            FAILED: broadcast['failed'],
+        }
+        try:
+            async for ids in self.db.iter_user_ids(broadcast['last_telegram_id'], self.batch_size):
+                futures = [
+                    self.notifier.submit(telegram_id, broadcast['text'], priority=PRIORITY_BROADCAST)
+                    for telegram_id in ids
+                ]
+                try:
+                    outcomes = await asyncio.gather(*futures)
+                except asyncio.CancelledError:
+                    # Еще не отправленные сообщения пачки очередь пропустит, а
+                    # отправленное начало пачки сохраняем, чтобы не повторить его
+                    done = 0
+                    for future in futures:
+                        if not future.done() or future.cancelled():
+                            break
+                        counts[future.result()] += 1
+                        done += 1
+                    for future in futures[done:]:
+                        future.cancel()
+                    if done:
+                        await self.db.save_broadcast_progress(
+                            broadcast_id, ids[done - 1], counts[SENT], counts[BLOCKED], counts[FAILED]
+                        )
+                    raise
+                for outcome in outcomes:
+                    counts[outcome] += 1
+                await self.db.save_broadcast_progress(
+                    broadcast_id, ids[-1], counts[SENT], counts[BLOCKED], counts[FAILED]
+                )
+
+            await self.db.set_broadcast_status(broadcast_id, 'done', expected_status='running')
+            logger.info(
+                "Рассылка #%s завершена: доставлено %s, заблокировали %s, ошибки %s",
+                broadcast_id, counts[SENT], counts[BLOCKED], counts[FAILED]
+            )
+        except asyncio.CancelledError:
+            logger.info("Рассылка #%s остановлена", broadcast_id)
+            raise
+        except Exception:
+            logger.exception("Ошибка рассылки #%s", broadcast_id)
+            # Иначе рассылка осталась бы 'running' и молча перезапустилась бы при старте бота
+            await self.db.set_broadcast_status(broadcast_id, 'failed', expected_status='running')
+
+        if on_finish is not None:
+            try:
+                await on_finish(await self.db.get_broadcast(broadcast_id))
+            except Exception as e:
+                logger.error("Не удалось сообщить об окончании рассылки #%s: %s", broadcast_id, e)
+
+    async def close(self):
+        """Остановить фоновые рассылки, не меняя их статус
+
+        Прогресс уже сохранен, и при следующем запуске они продолжатся.
+        """
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -5,6 +5,11 @@
 import sqlite3
 import os
 
+def table_exists(cursor, name):
+    """Есть ли таблица в базе (в старых базах новых таблиц может не быть)"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,))
+    return cursor.fetchone() is not None
+
 def clear_database():
     """Очистка базы данных"""
     db_path = 'bot_database.db'
@@ -20,10 +25,23 @@ def clear_database():
         # Очищаем таблицы
         cursor.execute("DELETE FROM users")
         cursor.execute("DELETE FROM likes")
+        # История просмотров (в базах, созданных до ее появления, таблицы нет)
+        if table_exists(cursor, 'views'):
+            cursor.execute("DELETE FROM views")
+        # Иначе оставшиеся совпадения не дадут записать новые и уведомление о них не придет
+        if table_exists(cursor, 'matches'):
+            cursor.execute("DELETE FROM matches")
+        # Незавершенные анкеты и шаги поиска (хранилище FSM)
+        if table_exists(cursor, 'fsm_states'):
+            cursor.execute("DELETE FROM fsm_states")
+        # Рассылки: иначе после перезапуска бот продолжит незавершенную
+        if table_exists(cursor, 'broadcasts'):
+            cursor.execute("DELETE FROM broadcasts")
         
         # Сбрасываем автоинкремент
         cursor.execute("DELETE FROM sqlite_sequence WHERE name='users'")
         cursor.execute("DELETE FROM sqlite_sequence WHERE name='likes'")
+        cursor.execute("DELETE FROM sqlite_sequence WHERE name='broadcasts'")
         
         conn.commit()
         conn.close()
@@ -1,7 +1,9 @@
 """
 Конфигурация бота
 """
+import hashlib
 import os
+import re
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения из .env файла
@@ -16,6 +18,46 @@ if not BOT_TOKEN:
 # Путь к базе данных
 DATABASE_PATH = 'bot_database.db'
 
+# Режим работы: 'polling' (long polling) или 'webhook' (встроенный aiohttp-сервер)
+RUN_MODE = os.getenv('RUN_MODE', 'polling').lower()
+
+# Публичный адрес сервиса для регистрации вебхука в Telegram.
+# Если пусто - сервер поднимается без setWebhook (удобно для локальной проверки)
+WEBHOOK_URL = (os.getenv('WEBHOOK_URL') or os.getenv('RENDER_EXTERNAL_URL') or '').rstrip('/')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+
+# Секрет, который Telegram передает в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+
+# Telegram принимает в secret_token только A-Z, a-z, 0-9, _ и - (до 256 символов),
+# а Render генерирует WEBHOOK_SECRET в base64 (+, / и =). Такой секрет
+# заменяется его SHA-256 в hex; один и тот же токен уходит в setWebhook и
+# сверяется с заголовком. Пусто - заголовок не проверяется
+WEBHOOK_SECRET_ALPHABET = re.compile(r'[A-Za-z0-9_-]{1,256}')
+if not WEBHOOK_SECRET or WEBHOOK_SECRET_ALPHABET.fullmatch(WEBHOOK_SECRET):
+    WEBHOOK_SECRET_TOKEN = WEBHOOK_SECRET
+else:
+    WEBHOOK_SECRET_TOKEN = hashlib.sha256(WEBHOOK_SECRET.encode('utf-8')).hexdigest()
+
+if WEBHOOK_SECRET_TOKEN and not WEBHOOK_SECRET_ALPHABET.fullmatch(WEBHOOK_SECRET_TOKEN):
+    raise ValueError("Секрет вебхука должен состоять из A-Z, a-z, 0-9, _ и - (до 256 символов)")
+
+# Адрес, на котором слушает aiohttp-сервер
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('PORT', '8080'))
+
+# Адрес сервера Bot API вместо api.telegram.org (локальный telegram-bot-api или
+# заглушка нагрузочного теста load_test.py). Пусто - стандартный сервер Telegram
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '').rstrip('/')
+
+# Сколько обновлений обрабатывается одновременно
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '64'))
+
+# Организаторы: telegram_id через запятую, им доступны рассылки и служебные команды
+ADMIN_IDS = {
+    int(admin_id) for admin_id in os.getenv('ADMIN_IDS', '').replace(' ', '').split(',') if admin_id
+}
+
 # Сообщения бота
 MESSAGES = {
     'welcome': """🤝 Добро пожаловать в бот знакомств "Формула молодежи"!
@@ -1,23 +1,342 @@
 """
 Модуль для работы с базой данных SQLite
 """
+import asyncio
 import aiosqlite
+import logging
 import os
-from typing import Optional, List, Dict, Any
+import random
+import sqlite3
+import time
+from array import array
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Optional, List, Dict, Any, AsyncIterator, Awaitable, Callable, NamedTuple, Tuple
+
+from cache import TTLCache
+from query_profiler import DATABASE_PROFILE, QueryProfiler
+
+logger = logging.getLogger(__name__)
 
 # Путь к базе данных
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'bot_database.db')
 
+# Количество соединений только для чтения в пуле
+DATABASE_READERS = int(os.getenv('DATABASE_READERS', '4'))
+
+# Сколько миллисекунд ждать снятия блокировки, прежде чем вернуть "database is locked"
+DATABASE_BUSY_TIMEOUT_MS = int(os.getenv('DATABASE_BUSY_TIMEOUT_MS', '5000'))
+
+# Групповая запись: сколько миллисекунд копить операции и сколько максимум класть в одну транзакцию
+WRITE_FLUSH_INTERVAL_MS = int(os.getenv('WRITE_FLUSH_INTERVAL_MS', '5'))
+WRITE_BATCH_MAX_OPS = int(os.getenv('WRITE_BATCH_MAX_OPS', '100'))
+
+# Колоды случайного поиска: сколько кандидатов в одной колоде, для скольких
+# пользователей их держать и через сколько секунд колода собирается заново
+DECK_SIZE = int(os.getenv('DECK_SIZE', '1000'))
+DECK_CACHE_SIZE = int(os.getenv('DECK_CACHE_SIZE', '10000'))
+DECK_TTL = int(os.getenv('DECK_TTL', '600'))
+
+# Операция записи: получает соединение-писатель внутри общей транзакции
+WriteOp = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+class LikeResult(NamedTuple):
+    """Результат Database.like()"""
+    is_new: bool    # лайк записан впервые (повторное нажатие даст False)
+    is_match: bool  # именно этот лайк сделал интерес взаимным
+
+
+# Условие "анкету u еще не смотрели и не лайкали": анти-join по PRIMARY KEY
+# таблицы views и индексу idx_likes_pair. Параметры: telegram_id зрителя два раза
+UNSEEN_CONDITION = """
+    NOT EXISTS (
+        SELECT 1 FROM views v
+        WHERE v.viewer_id = ? AND v.viewed_id = u.telegram_id
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM likes l
+        WHERE l.from_user_id = ? AND l.to_user_id = u.telegram_id
+    )
+"""
+
+
+def profile_version(current: Optional[int]) -> int:
+    """Следующая версия анкеты: больше текущей и не меньше времени в миллисекундах
+
+    Версия не повторяется, даже если анкету удалили и создали заново:
+    иначе новая анкета получила бы карточку старой из кэша по
+    (telegram_id, version).
+    """
+    return max((current or 0) + 1, time.time_ns() // 1_000_000)
+
 
 class Database:
-    """Класс для работы с базой данных"""
+    """Класс для работы с базой данных
+    
+    Держит долгоживущий пул соединений: одно соединение-писатель и
+    несколько соединений только для чтения (WAL позволяет им читать
+    параллельно с записью). Пул открывается методом open() и
+    закрывается методом close().
+    
+    Изменения профилей и лайков не коммитятся по одному: они попадают в
+    очередь, и фоновая задача объединяет их в одну транзакцию раз в
+    несколько миллисекунд (или по достижении лимита операций).
     
-    def __init__(self, db_path: str = DATABASE_PATH):
+    Для случайного поиска у каждого пользователя есть своя "колода" —
+    случайная выборка из не более чем deck_size telegram_id кандидатов;
+    каждый показ снимает одну карту с конца за O(1). Колоды хранятся в
+    TTLCache, так что память ограничена deck_cache_size * deck_size.
+    
+    Справочные данные (список филиалов с количеством анкет и общее число
+    пользователей) кэшируются и привязаны к счетчику версии данных,
+    который увеличивает каждая запись в таблицу users.
+    
+    Множество telegram_id зарегистрированных пользователей загружается при
+    открытии и дальше поддерживается add_user и delete_user, поэтому
+    profile_exists() отвечает без обращения к базе.
+    
+    Если передан profiler (или задано DATABASE_PROFILE=1), все соединения
+    пула оборачиваются QueryProfiler: каждый запрос учитывается с формой,
+    временем, числом строк и вызвавшим методом.
+    """
+    
+    def __init__(self, db_path: str = DATABASE_PATH, readers: int = DATABASE_READERS,
+                 busy_timeout_ms: int = DATABASE_BUSY_TIMEOUT_MS,
+                 flush_interval_ms: int = WRITE_FLUSH_INTERVAL_MS,
+                 batch_max_ops: int = WRITE_BATCH_MAX_OPS,
+                 deck_size: int = DECK_SIZE,
+                 deck_cache_size: int = DECK_CACHE_SIZE,
+                 deck_ttl: float = DECK_TTL,
+                 profiler: Optional[QueryProfiler] = None):
         self.db_path = db_path
+        self.readers = max(1, readers)
+        self.busy_timeout_ms = busy_timeout_ms
+        self.flush_interval = max(0, flush_interval_ms) / 1000
+        self.batch_max_ops = max(1, batch_max_ops)
+        self.deck_size = max(1, deck_size)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._reader_pool: Optional[asyncio.Queue] = None
+        self._reader_connections: List[aiosqlite.Connection] = []
+        self._write_queue: Optional[asyncio.Queue] = None
+        self._write_task: Optional[asyncio.Task] = None
+        self._write_stats = {
+            'batches': 0,
+            'ops': 0,
+            'failed_ops': 0,
+            'max_batch_size': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+            'started_at': time.monotonic(),
+        }
+        # Колоды кандидатов для случайного поиска: {telegram_id: array('q', [...])}
+        self._decks = TTLCache(maxsize=deck_cache_size, ttl=deck_ttl)
+        # Поддерживает ли SQLite токенизатор trigram (выясняется в init_db)
+        self._trigram_available = False
+        # Версия данных таблицы users и построенный по ней справочник
+        self._data_version = 0
+        self._directory: Optional[Dict[str, Any]] = None
+        # telegram_id всех зарегистрированных пользователей
+        self._registered_ids: set = set()
+        # Необязательный обработчик времени операций: timing_hook('read' | 'write', секунды)
+        self.timing_hook: Optional[Callable[[str, float], None]] = None
+        # Профилировщик запросов; None - запросы не замеряются
+        self.profiler = profiler if profiler is not None else (QueryProfiler() if DATABASE_PROFILE else None)
+    
+    async def open(self):
+        """Открыть пул соединений и подготовить схему"""
+        if self._writer is not None:
+            return
+        
+        self._writer = await self._connect(self.db_path)
+        await self._writer.execute("PRAGMA journal_mode=WAL")
+        # INSERT OR REPLACE вызывает DELETE-триггеры (синхронизация users_fts) только так
+        await self._writer.execute("PRAGMA recursive_triggers=ON")
+        await self.init_db()
+        
+        cursor = await self._writer.execute("SELECT telegram_id FROM users")
+        self._registered_ids = {row[0] for row in await cursor.fetchall()}
+        
+        # Читатели открываются после писателя: файл и WAL уже существуют
+        reader_uri = Path(self.db_path).absolute().as_uri() + "?mode=ro"
+        self._reader_pool = asyncio.Queue()
+        for _ in range(self.readers):
+            conn = await self._connect(reader_uri, uri=True)
+            await conn.execute("PRAGMA query_only=ON")
+            self._reader_connections.append(conn)
+            self._reader_pool.put_nowait(conn)
+        
+        self._write_queue = asyncio.Queue()
+        self._write_task = asyncio.create_task(self._write_loop())
+    
+    async def close(self):
+        """Закрыть все соединения пула"""
+        # Сначала дописываем всё, что уже стоит в очереди
+        if self._write_task is not None:
+            self._write_queue.put_nowait(None)
+            await self._write_task
+            self._write_task = None
+            self._write_queue = None
+        
+        for conn in self._reader_connections:
+            await conn.close()
+        self._reader_connections = []
+        self._reader_pool = None
+        
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+    
+    async def _connect(self, database: str, **kwargs) -> aiosqlite.Connection:
+        """Открыть соединение и один раз выставить его PRAGMA"""
+        conn = await aiosqlite.connect(database, **kwargs)
+        conn.row_factory = aiosqlite.Row
+        await conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute("PRAGMA cache_size=10000")
+        await conn.execute("PRAGMA temp_store=MEMORY")
+        if self.profiler is not None:
+            return self.profiler.wrap(conn)
+        return conn
+    
+    @asynccontextmanager
+    async def _read(self):
+        """Взять соединение для чтения из пула"""
+        if self._reader_pool is None:
+            raise RuntimeError("База данных не открыта: вызовите Database.open()")
+        started = time.perf_counter()
+        conn = await self._reader_pool.get()
+        try:
+            yield conn
+        finally:
+            self._reader_pool.put_nowait(conn)
+            if self.timing_hook is not None:
+                self.timing_hook('read', time.perf_counter() - started)
+    
+    @asynccontextmanager
+    async def _write(self):
+        """Эксклюзивный доступ к соединению-писателю на время транзакции"""
+        if self._writer is None:
+            raise RuntimeError("База данных не открыта: вызовите Database.open()")
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+    
+    async def _submit_write(self, op: WriteOp) -> Any:
+        """Поставить операцию в очередь групповой записи и дождаться её результата
+        
+        Результат (или исключение) операции возвращается только после
+        коммита транзакции, в которую она попала.
+        """
+        if self._write_queue is None:
+            raise RuntimeError("База данных не открыта: вызовите Database.open()")
+        future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((op, future))
+        if self.timing_hook is None:
+            return await future
+        started = time.perf_counter()
+        try:
+            return await future
+        finally:
+            self.timing_hook('write', time.perf_counter() - started)
+    
+    async def _write_loop(self):
+        """Фоновая задача: собирает операции из очереди в пачки и коммитит их"""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._write_queue.get()
+            if item is None:
+                break
+            
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_max_ops:
+                if self._write_queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._write_queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._write_queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            await self._flush_writes(batch)
+    
+    async def _flush_writes(self, batch: list):
+        """Выполнить пачку операций одной транзакцией
+        
+        Каждая операция идет в своей точке сохранения, так что ошибка
+        одной не откатывает остальные.
+        """
+        started = time.perf_counter()
+        outcomes = []
+        try:
+            async with self._write() as db:
+                # Блокировку записи берем сразу: операции читают перед записью, и при
+                # отложенном BEGIN повышение блокировки падает с "database is locked"
+                # без ожидания busy_timeout, если другое соединение (хранилище FSM)
+                # успело закоммитить между чтением и записью
+                await db.execute("BEGIN IMMEDIATE")
+                for op, future in batch:
+                    await db.execute("SAVEPOINT write_op")
+                    try:
+                        result = await op(db)
+                    except Exception as e:
+                        await db.execute("ROLLBACK TO write_op")
+                        outcomes.append((future, None, e))
+                    else:
+                        outcomes.append((future, result, None))
+                    await db.execute("RELEASE write_op")
+                await db.commit()
+        except Exception as e:
+            # Транзакция целиком не прошла: ошибку получают все участники пачки
+            outcomes = [(future, None, e) for _, future in batch]
+        
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        stats = self._write_stats
+        stats['batches'] += 1
+        stats['ops'] += len(batch)
+        stats['max_batch_size'] = max(stats['max_batch_size'], len(batch))
+        stats['last_flush_ms'] = elapsed_ms
+        stats['max_flush_ms'] = max(stats['max_flush_ms'], elapsed_ms)
+        stats['total_flush_ms'] += elapsed_ms
+        
+        for future, result, error in outcomes:
+            if error is not None:
+                stats['failed_ops'] += 1
+            if future.done():
+                # Вызывающая сторона уже отменила ожидание
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+    
+    def get_write_stats(self) -> Dict[str, Any]:
+        """Статистика групповой записи: пропускная способность и задержка коммита"""
+        stats = dict(self._write_stats)
+        uptime = max(time.monotonic() - stats.pop('started_at'), 1e-9)
+        batches = stats['batches']
+        stats['queue_depth'] = self._write_queue.qsize() if self._write_queue is not None else 0
+        stats['avg_batch_size'] = stats['ops'] / batches if batches else 0.0
+        stats['avg_flush_ms'] = stats['total_flush_ms'] / batches if batches else 0.0
+        stats['ops_per_sec'] = stats['ops'] / uptime
+        return stats
     
     async def init_db(self):
         """Инициализация базы данных и создание таблиц"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             # Создаем таблицу пользователей
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -28,10 +347,16 @@ class Database:
                     job_title TEXT NOT NULL,
                     about TEXT NOT NULL,
                     photo_file_id TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    version INTEGER NOT NULL DEFAULT 1
                 )
             """)
             
+            # Версия анкеты растет при каждом изменении (см. profile_version); в старых базах столбца нет
+            cursor = await db.execute("PRAGMA table_info(users)")
+            if 'version' not in [row['name'] for row in await cursor.fetchall()]:
+                await db.execute("ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+            
             # Создаем таблицу лайков
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS likes (
@@ -39,102 +364,364 @@ class Database:
                     from_user_id INTEGER NOT NULL,
                     to_user_id INTEGER NOT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    skipped INTEGER NOT NULL DEFAULT 0,
                     FOREIGN KEY (from_user_id) REFERENCES users (telegram_id),
                     FOREIGN KEY (to_user_id) REFERENCES users (telegram_id),
                     UNIQUE(from_user_id, to_user_id)
                 )
             """)
             
+            # В старых базах нет отметки о пропущенных входящих интересах
+            cursor = await db.execute("PRAGMA table_info(likes)")
+            if 'skipped' not in [row['name'] for row in await cursor.fetchall()]:
+                await db.execute("ALTER TABLE likes ADD COLUMN skipped INTEGER NOT NULL DEFAULT 0")
+            
+            # Создаем таблицу просмотров: кто чью анкету уже видел
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS views (
+                    viewer_id INTEGER NOT NULL,
+                    viewed_id INTEGER NOT NULL,
+                    viewed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (viewer_id, viewed_id)
+                ) WITHOUT ROWID
+            """)
+            
             # Создаем индексы для улучшения производительности
             await db.execute("CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id)")
             await db.execute("CREATE INDEX IF NOT EXISTS idx_users_branch ON users(branch)")
+            # Создаем таблицу взаимных интересов: пара хранится упорядоченной (user_low < user_high)
+            cursor = await db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'matches'"
+            )
+            matches_exists = await cursor.fetchone() is not None
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS matches (
+                    user_low INTEGER NOT NULL,
+                    user_high INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_low, user_high)
+                ) WITHOUT ROWID
+            """)
+            if not matches_exists:
+                # Однократно переносим уже существующие взаимные лайки
+                await db.execute("""
+                    INSERT OR IGNORE INTO matches (user_low, user_high)
+                    SELECT l.from_user_id, l.to_user_id FROM likes l
+                    WHERE l.from_user_id < l.to_user_id
+                    AND EXISTS (
+                        SELECT 1 FROM likes r
+                        WHERE r.from_user_id = l.to_user_id AND r.to_user_id = l.from_user_id
+                    )
+                """)
+            
+            # Создаем таблицу рассылок: текст, статус и прогресс для продолжения после перезапуска
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    text TEXT NOT NULL,
+                    created_by INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'draft',
+                    last_telegram_id INTEGER NOT NULL DEFAULT 0,
+                    delivered INTEGER NOT NULL DEFAULT 0,
+                    blocked INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            """)
+            
             await db.execute("CREATE INDEX IF NOT EXISTS idx_likes_from_user ON likes(from_user_id)")
             await db.execute("CREATE INDEX IF NOT EXISTS idx_likes_to_user ON likes(to_user_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_likes_to_created ON likes(to_user_id, created_at)")
             await db.execute("CREATE INDEX IF NOT EXISTS idx_likes_pair ON likes(from_user_id, to_user_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_views_viewed ON views(viewed_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_matches_high ON matches(user_high)")
             
-            # Включаем WAL режим для лучшей производительности
-            await db.execute("PRAGMA journal_mode=WAL")
-            await db.execute("PRAGMA synchronous=NORMAL")
-            await db.execute("PRAGMA cache_size=10000")
-            await db.execute("PRAGMA temp_store=MEMORY")
+            await self._init_fts(db)
             
             await db.commit()
     
+    async def _init_fts(self, db: aiosqlite.Connection):
+        """Создать полнотекстовые индексы по анкетам"""
+        # users_fts — поиск по ключевым словам во всех текстовых полях
+        await self._create_fts_index(db, 'users_fts', ['name', 'branch', 'job_title', 'about'])
+        
+        # users_trigram — поиск подстроки в имени и филиале; без поддержки trigram
+        # (SQLite старше 3.34) поиск по подстроке работает без индекса
+        try:
+            await self._create_fts_index(db, 'users_trigram', ['name', 'branch'], tokenize='trigram')
+            self._trigram_available = True
+        except sqlite3.OperationalError as e:
+            logger.warning("Индекс trigram недоступен, поиск по подстроке будет без индекса: %s", e)
+            self._trigram_available = False
+    
+    async def _create_fts_index(self, db: aiosqlite.Connection, table: str,
+                                columns: List[str], tokenize: Optional[str] = None):
+        """Создать FTS5-таблицу над users и триггеры, которые держат её в актуальном состоянии
+        
+        Индекс заполняется один раз при создании; дальше его обновляют триггеры.
+        """
+        cursor = await db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?", (f"{table}_ai",)
+        )
+        if await cursor.fetchone():
+            return
+        
+        cols = ', '.join(columns)
+        new_values = ', '.join(f"new.{col}" for col in columns)
+        old_values = ', '.join(f"old.{col}" for col in columns)
+        tokenize_option = f", tokenize='{tokenize}'" if tokenize else ""
+        
+        # Таблица могла остаться от старой версии, которая наполняла её при каждом поиске
+        await db.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(
+                {cols},
+                content='users',
+                content_rowid='id'{tokenize_option}
+            )
+        """)
+        await db.execute(f"""
+            CREATE TRIGGER {table}_ai AFTER INSERT ON users BEGIN
+                INSERT INTO {table}(rowid, {cols})
+                VALUES (new.id, {new_values});
+            END
+        """)
+        await db.execute(f"""
+            CREATE TRIGGER {table}_ad AFTER DELETE ON users BEGIN
+                INSERT INTO {table}({table}, rowid, {cols})
+                VALUES ('delete', old.id, {old_values});
+            END
+        """)
+        await db.execute(f"""
+            CREATE TRIGGER {table}_au AFTER UPDATE OF {cols} ON users BEGIN
+                INSERT INTO {table}({table}, rowid, {cols})
+                VALUES ('delete', old.id, {old_values});
+                INSERT INTO {table}(rowid, {cols})
+                VALUES (new.id, {new_values});
+            END
+        """)
+        # Однократно заполняем индекс по уже существующим анкетам
+        await db.execute(f"INSERT INTO {table}({table}) VALUES ('rebuild')")
+    
     async def add_user(self, telegram_id: int, name: str, branch: str, 
                       job_title: str, about: str, photo_file_id: Optional[str] = None) -> bool:
         """Добавить или обновить пользователя"""
+        async def op(db: aiosqlite.Connection) -> bool:
+            cursor = await db.execute(
+                "SELECT version FROM users WHERE telegram_id = ?", (telegram_id,)
+            )
+            row = await cursor.fetchone()
+            is_new = row is None
+            version = profile_version(None if is_new else row['version'])
+            await db.execute("""
+                INSERT OR REPLACE INTO users 
+                (telegram_id, name, branch, job_title, about, photo_file_id, version)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (telegram_id, name, branch, job_title, about, photo_file_id, version))
+            return is_new
+        
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute("""
-                    INSERT OR REPLACE INTO users 
-                    (telegram_id, name, branch, job_title, about, photo_file_id)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (telegram_id, name, branch, job_title, about, photo_file_id))
-                await db.commit()
-                return True
+            is_new = await self._submit_write(op)
+            self._registered_ids.add(telegram_id)
+            self._bump_data_version()
+            return True
         except Exception as e:
-            print(f"Ошибка при добавлении пользователя: {e}")
+            logger.error("Ошибка при добавлении пользователя: %s", e)
             return False
     
     async def get_user(self, telegram_id: int) -> Optional[Dict[str, Any]]:
         """Получить пользователя по telegram_id"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._read() as db:
             cursor = await db.execute(
                 "SELECT * FROM users WHERE telegram_id = ?", (telegram_id,)
             )
             row = await cursor.fetchone()
             return dict(row) if row else None
     
-    async def get_random_user(self, exclude_telegram_id: int, viewed_users: list = None) -> Optional[Dict[str, Any]]:
-        """Получить случайного пользователя, исключая указанного и уже просмотренных"""
-        if viewed_users is None:
-            viewed_users = []
+    def profile_exists(self, telegram_id: int) -> bool:
+        """Есть ли у пользователя анкета (без запроса к базе)"""
+        return telegram_id in self._registered_ids
+    
+    async def get_random_user(self, exclude_telegram_id: int) -> Optional[Dict[str, Any]]:
+        """Получить случайного пользователя, исключая указанного, уже просмотренных и уже лайкнутых
         
-        # Добавляем текущего пользователя в список исключений
-        exclude_list = [exclude_telegram_id] + viewed_users
+        Кандидаты берутся из колоды пользователя. Колода строится заново,
+        когда закончилась или вытеснена из кэша; новые анкеты попадают в
+        колоды при пересборке.
+        """
+        deck = self._decks.get(exclude_telegram_id)
+        fresh = not deck
+        if fresh:
+            deck = await self._build_deck(exclude_telegram_id)
         
-        # Удаляем дубликаты и None значения
-        exclude_list = list(set([x for x in exclude_list if x is not None]))
+        while True:
+            async with self._read() as db:
+                while deck:
+                    # Анкеты, удаленные, просмотренные или лайкнутые после построения колоды, пропускаем
+                    cursor = await db.execute(f"""
+                        SELECT u.* FROM users u
+                        WHERE u.telegram_id = ? AND {UNSEEN_CONDITION}
+                    """, (deck.pop(), exclude_telegram_id, exclude_telegram_id))
+                    row = await cursor.fetchone()
+                    if row:
+                        return dict(row)
+            if fresh:
+                return None
+            # Колода - лишь выборка кандидатов, и она кончилась на уже неподходящих
+            # анкетах: собираем новую, в нее попадут и анкеты, созданные с тех пор
+            deck = await self._build_deck(exclude_telegram_id)
+            fresh = True
+    
+    async def _build_deck(self, telegram_id: int) -> array:
+        """Новая колода: не больше deck_size случайных доступных кандидатов"""
+        async with self._read() as db:
+            cursor = await db.execute(f"""
+                SELECT u.telegram_id FROM users u
+                WHERE u.telegram_id != ? AND {UNSEEN_CONDITION}
+            """, (telegram_id, telegram_id, telegram_id))
+            candidates = [row[0] for row in await cursor.fetchall()]
         
-        # Создаем плейсхолдеры для SQL запроса
-        placeholders = ','.join(['?' for _ in exclude_list])
+        if len(candidates) > self.deck_size:
+            candidates = random.sample(candidates, self.deck_size)
+        else:
+            random.shuffle(candidates)
+        deck = array('q', candidates)
+        self._decks.set(telegram_id, deck)
+        return deck
+    
+    async def is_unseen(self, viewer_id: int, telegram_id: int) -> bool:
+        """Анкету telegram_id зритель еще не смотрел и не лайкал (любым способом поиска)"""
+        async with self._read() as db:
+            cursor = await db.execute(f"""
+                SELECT 1 FROM users u
+                WHERE u.telegram_id = ? AND {UNSEEN_CONDITION}
+            """, (telegram_id, viewer_id, viewer_id))
+            return await cursor.fetchone() is not None
+    
+    def return_to_deck(self, owner_id: int, telegram_id: int):
+        """Вернуть снятую, но не показанную анкету наверх колоды: она выпадет следующей
         
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        Если колоды уже нет, ничего не делаем: анкета попадет в новую колоду,
+        раз она не просмотрена.
+        """
+        deck = self._decks.get(owner_id)
+        if deck is not None:
+            deck.append(telegram_id)
+    
+    async def add_like(self, from_user_id: int, to_user_id: int) -> bool:
+        """Добавить лайк. Возвращает True, только если лайк действительно новый"""
+        result = await self.like(from_user_id, to_user_id)
+        return result.is_new
+    
+    async def get_next_user_in_branch(self, viewer_id: int, branch: str,
+                                      after_id: int = 0) -> Optional[Dict[str, Any]]:
+        """Следующая непросмотренная анкета филиала после анкеты с id = after_id
+        
+        Постраничный обход по ключу (branch, id) идет по индексу
+        idx_users_branch без OFFSET и RANDOM(). Поле id результата служит
+        курсором для следующего вызова.
+        """
+        async with self._read() as db:
             cursor = await db.execute(f"""
-                SELECT * FROM users 
-                WHERE telegram_id NOT IN ({placeholders})
-                ORDER BY RANDOM() 
+                SELECT u.* FROM users u
+                WHERE u.branch = ? AND u.id > ? AND u.telegram_id != ?
+                AND {UNSEEN_CONDITION}
+                ORDER BY u.id
                 LIMIT 1
-            """, exclude_list)
+            """, (branch, after_id, viewer_id, viewer_id, viewer_id))
             row = await cursor.fetchone()
             return dict(row) if row else None
     
-    async def add_like(self, from_user_id: int, to_user_id: int) -> bool:
-        """Добавить лайк"""
+    async def add_view(self, viewer_id: int, viewed_id: int) -> bool:
+        """Отметить анкету как просмотренную. Возвращает True, если просмотр новый"""
+        async def op(db: aiosqlite.Connection) -> bool:
+            cursor = await db.execute("""
+                INSERT OR IGNORE INTO views (viewer_id, viewed_id)
+                VALUES (?, ?)
+            """, (viewer_id, viewed_id))
+            return cursor.rowcount > 0
+        
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute("""
-                    INSERT OR IGNORE INTO likes (from_user_id, to_user_id)
-                    VALUES (?, ?)
-                """, (from_user_id, to_user_id))
-                await db.commit()
-                return True
+            return await self._submit_write(op)
+        except Exception as e:
+            logger.error("Ошибка при добавлении просмотра: %s", e)
+            return False
+    
+    async def get_viewed_users(self, viewer_id: int) -> List[Dict[str, Any]]:
+        """Получить анкеты, которые пользователь уже просмотрел"""
+        async with self._read() as db:
+            cursor = await db.execute("""
+                SELECT u.* FROM views v
+                JOIN users u ON u.telegram_id = v.viewed_id
+                WHERE v.viewer_id = ?
+                ORDER BY u.name
+            """, (viewer_id,))
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+    
+    async def get_viewed_count(self, viewer_id: int) -> int:
+        """Получить количество просмотренных пользователем анкет"""
+        async with self._read() as db:
+            cursor = await db.execute(
+                "SELECT COUNT(*) FROM views WHERE viewer_id = ?", (viewer_id,)
+            )
+            count = await cursor.fetchone()
+            return count[0] if count else 0
+    
+    async def clear_views(self, viewer_id: int) -> bool:
+        """Очистить историю просмотров пользователя"""
+        async def op(db: aiosqlite.Connection) -> bool:
+            await db.execute("DELETE FROM views WHERE viewer_id = ?", (viewer_id,))
+            return True
+        
+        try:
+            result = await self._submit_write(op)
+            # Колода строилась без просмотренных — пересобираем её при следующем поиске
+            self._decks.invalidate(viewer_id)
+            return result
         except Exception as e:
-            print(f"Ошибка при добавлении лайка: {e}")
+            logger.error("Ошибка при очистке просмотров: %s", e)
             return False
     
+    async def like(self, from_user_id: int, to_user_id: int) -> LikeResult:
+        """Поставить лайк и одной транзакцией проверить взаимность
+        
+        Если встречный лайк уже есть, пара записывается в таблицу matches.
+        Повторный лайк ничего не меняет и возвращает LikeResult(False, False).
+        """
+        async def op(db: aiosqlite.Connection) -> LikeResult:
+            cursor = await db.execute("""
+                INSERT OR IGNORE INTO likes (from_user_id, to_user_id)
+                VALUES (?, ?)
+            """, (from_user_id, to_user_id))
+            if cursor.rowcount == 0:
+                return LikeResult(is_new=False, is_match=False)
+            
+            cursor = await db.execute("""
+                SELECT 1 FROM likes WHERE from_user_id = ? AND to_user_id = ?
+            """, (to_user_id, from_user_id))
+            if await cursor.fetchone() is None:
+                return LikeResult(is_new=True, is_match=False)
+            
+            cursor = await db.execute("""
+                INSERT OR IGNORE INTO matches (user_low, user_high)
+                VALUES (?, ?)
+            """, (min(from_user_id, to_user_id), max(from_user_id, to_user_id)))
+            return LikeResult(is_new=True, is_match=cursor.rowcount > 0)
+        
+        try:
+            return await self._submit_write(op)
+        except Exception as e:
+            logger.error("Ошибка при добавлении лайка: %s", e)
+            return LikeResult(is_new=False, is_match=False)
+    
     async def check_match(self, user1_id: int, user2_id: int) -> bool:
         """Проверить, есть ли взаимный лайк между пользователями"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._read() as db:
             cursor = await db.execute("""
-                SELECT COUNT(*) FROM likes 
-                WHERE (from_user_id = ? AND to_user_id = ?) 
-                OR (from_user_id = ? AND to_user_id = ?)
-            """, (user1_id, user2_id, user2_id, user1_id))
-            count = await cursor.fetchone()
-            return count[0] >= 2
+                SELECT 1 FROM matches WHERE user_low = ? AND user_high = ?
+            """, (min(user1_id, user2_id), max(user1_id, user2_id)))
+            return await cursor.fetchone() is not None
     
     async def get_user_username(self, telegram_id: int) -> Optional[str]:
         """Получить username пользователя (для уведомлений о совпадениях)"""
@@ -144,8 +731,7 @@ class Database:
     
     async def get_user_contact_info(self, telegram_id: int) -> Dict[str, Any]:
         """Получить полную контактную информацию пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._read() as db:
             cursor = await db.execute(
                 "SELECT name, branch, job_title, about FROM users WHERE telegram_id = ?",
                 (telegram_id,)
@@ -155,13 +741,12 @@ class Database:
     
     async def get_pending_likes(self, to_user_id: int) -> List[Dict[str, Any]]:
         """Получить список лайков, на которые пользователь еще не ответил"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._read() as db:
             cursor = await db.execute("""
                 SELECT l.from_user_id, u.name, u.branch, u.job_title, u.about
                 FROM likes l
                 JOIN users u ON l.from_user_id = u.telegram_id
-                WHERE l.to_user_id = ? 
+                WHERE l.to_user_id = ? AND l.skipped = 0
                 AND NOT EXISTS (
                     SELECT 1 FROM likes l2 
                     WHERE l2.from_user_id = ? AND l2.to_user_id = l.from_user_id
@@ -170,27 +755,164 @@ class Database:
             rows = await cursor.fetchall()
             return [dict(row) for row in rows]
     
+    async def get_pending_likes_page(self, to_user_id: int, cursor: Optional[Tuple[str, int]] = None,
+                                     limit: int = 10) -> Tuple[List[Dict[str, Any]], Optional[Tuple[str, int]]]:
+        """Страница входящих интересов, от новых к старым
+        
+        Постраничный обход по ключу (created_at, id) идет по индексу
+        idx_likes_to_created. Возвращает строки страницы и курсор для
+        следующей страницы (None, если страница последняя).
+        """
+        cursor_condition = "AND (l.created_at, l.id) < (?, ?)" if cursor else ""
+        params = [to_user_id] + (list(cursor) if cursor else []) + [to_user_id, limit + 1]
+        
+        async with self._read() as db:
+            db_cursor = await db.execute(f"""
+                SELECT l.id AS like_id, l.created_at, l.from_user_id,
+                       u.name, u.branch, u.job_title, u.about
+                FROM likes l
+                JOIN users u ON l.from_user_id = u.telegram_id
+                WHERE l.to_user_id = ? AND l.skipped = 0 {cursor_condition}
+                AND NOT EXISTS (
+                    SELECT 1 FROM likes l2
+                    WHERE l2.from_user_id = ? AND l2.to_user_id = l.from_user_id
+                )
+                ORDER BY l.created_at DESC, l.id DESC
+                LIMIT ?
+            """, params)
+            rows = [dict(row) for row in await db_cursor.fetchall()]
+        
+        # Лишняя строка означает, что есть следующая страница
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, (rows[-1]['created_at'], rows[-1]['like_id'])
+        return rows, None
+    
+    async def get_pending_likes_count(self, to_user_id: int) -> int:
+        """Количество входящих интересов без ответа"""
+        async with self._read() as db:
+            cursor = await db.execute("""
+                SELECT COUNT(*) FROM likes l
+                WHERE l.to_user_id = ? AND l.skipped = 0
+                AND NOT EXISTS (
+                    SELECT 1 FROM likes l2
+                    WHERE l2.from_user_id = ? AND l2.to_user_id = l.from_user_id
+                )
+            """, (to_user_id, to_user_id))
+            count = await cursor.fetchone()
+            return count[0] if count else 0
+    
+    async def skip_like(self, to_user_id: int, from_user_id: int) -> bool:
+        """Убрать входящий интерес из списка без ответа"""
+        async def op(db: aiosqlite.Connection) -> bool:
+            cursor = await db.execute("""
+                UPDATE likes SET skipped = 1
+                WHERE from_user_id = ? AND to_user_id = ?
+            """, (from_user_id, to_user_id))
+            return cursor.rowcount > 0
+        
+        try:
+            return await self._submit_write(op)
+        except Exception as e:
+            logger.error("Ошибка при пропуске лайка: %s", e)
+            return False
+    
     async def delete_user(self, telegram_id: int) -> bool:
         """Удалить пользователя и все его лайки"""
+        async def op(db: aiosqlite.Connection) -> bool:
+            # Удаляем лайки пользователя
+            await db.execute("DELETE FROM likes WHERE from_user_id = ? OR to_user_id = ?", 
+                           (telegram_id, telegram_id))
+            # Удаляем взаимные интересы пользователя
+            await db.execute("DELETE FROM matches WHERE user_low = ? OR user_high = ?",
+                           (telegram_id, telegram_id))
+            # Удаляем просмотры пользователя
+            await db.execute("DELETE FROM views WHERE viewer_id = ? OR viewed_id = ?",
+                           (telegram_id, telegram_id))
+            # Удаляем пользователя
+            await db.execute("DELETE FROM users WHERE telegram_id = ?", (telegram_id,))
+            return True
+        
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                # Удаляем лайки пользователя
-                await db.execute("DELETE FROM likes WHERE from_user_id = ? OR to_user_id = ?", 
-                               (telegram_id, telegram_id))
-                # Удаляем пользователя
-                await db.execute("DELETE FROM users WHERE telegram_id = ?", (telegram_id,))
-                await db.commit()
-                return True
+            result = await self._submit_write(op)
+            self._registered_ids.discard(telegram_id)
+            self._bump_data_version()
+            # Из чужих колод удаленная анкета уйдет сама при выдаче
+            self._decks.invalidate(telegram_id)
+            return result
         except Exception as e:
-            print(f"Ошибка при удалении пользователя: {e}")
+            logger.error("Ошибка при удалении пользователя: %s", e)
             return False
     
-    async def get_users_count(self) -> int:
-        """Получить количество пользователей в базе"""
-        async with aiosqlite.connect(self.db_path) as db:
+    @property
+    def data_version(self) -> int:
+        """Текущая версия данных таблицы users"""
+        return self._data_version
+    
+    def _bump_data_version(self):
+        """Отметить, что таблица users изменилась (вызывается после коммита)"""
+        self._data_version += 1
+    
+    async def _get_directory(self) -> Dict[str, Any]:
+        """Справочник по анкетам; перестраивается, только если изменилась версия данных"""
+        directory = self._directory
+        if directory is not None and directory['version'] == self._data_version:
+            return directory
+        
+        # Версию запоминаем до запроса: если запись успеет пройти во время
+        # чтения, справочник останется устаревшим и перестроится в следующий раз
+        version = self._data_version
+        async with self._read() as db:
+            cursor = await db.execute("""
+                SELECT branch, COUNT(*) FROM users
+                WHERE branch IS NOT NULL AND branch != ''
+                GROUP BY branch
+                ORDER BY branch
+            """)
+            branch_counts = {row[0]: row[1] for row in await cursor.fetchall()}
             cursor = await db.execute("SELECT COUNT(*) FROM users")
             count = await cursor.fetchone()
-            return count[0] if count else 0
+        
+        directory = {
+            'version': version,
+            'branch_counts': branch_counts,
+            'total': count[0] if count else 0,
+            # Филиалы отдельных пользователей, нужные для exclude_telegram_id
+            'user_branches': {},
+        }
+        self._directory = directory
+        return directory
+    
+    async def get_users_count(self) -> int:
+        """Получить количество пользователей в базе"""
+        directory = await self._get_directory()
+        return directory['total']
+    
+    async def get_branch_counts(self, exclude_telegram_id: int = None) -> List[Tuple[str, int]]:
+        """Получить список отраслей с количеством анкет в каждой"""
+        directory = await self._get_directory()
+        branch_counts = directory['branch_counts']
+        if not exclude_telegram_id:
+            return list(branch_counts.items())
+        
+        user_branches = directory['user_branches']
+        if exclude_telegram_id not in user_branches:
+            async with self._read() as db:
+                cursor = await db.execute(
+                    "SELECT branch FROM users WHERE telegram_id = ?", (exclude_telegram_id,)
+                )
+                row = await cursor.fetchone()
+            user_branches[exclude_telegram_id] = row[0] if row else None
+        own_branch = user_branches[exclude_telegram_id]
+        
+        # Анкету самого пользователя не считаем
+        result = []
+        for branch, count in branch_counts.items():
+            if branch == own_branch:
+                count -= 1
+            if count > 0:
+                result.append((branch, count))
+        return result
     
     async def get_users_by_ids(self, user_ids: list) -> List[Dict[str, Any]]:
         """Получить пользователей по списку ID"""
@@ -198,8 +920,7 @@ class Database:
             return []
         
         placeholders = ','.join(['?' for _ in user_ids])
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._read() as db:
             cursor = await db.execute(f"""
                 SELECT * FROM users 
                 WHERE telegram_id IN ({placeholders})
@@ -208,89 +929,71 @@ class Database:
             rows = await cursor.fetchall()
             return [dict(row) for row in rows]
     
-    async def search_users_by_name(self, search_query: str, exclude_telegram_id: int = None) -> List[Dict[str, Any]]:
+    async def search_users_by_name(self, search_query: str, exclude_telegram_id: int = None,
+                                   limit: int = 50) -> List[Dict[str, Any]]:
         """Поиск пользователей по имени (частичное совпадение)"""
-        search_query_lower = search_query.lower().strip()
-        
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            if exclude_telegram_id:
-                cursor = await db.execute("""
-                    SELECT * FROM users
-                    WHERE telegram_id != ?
-                    ORDER BY name
-                """, (exclude_telegram_id,))
-            else:
-                cursor = await db.execute("""
-                    SELECT * FROM users
-                    ORDER BY name
-                """)
-            rows = await cursor.fetchall()
-            
-            # Фильтрация по регистру и частичному совпадению на уровне Python
-            results = []
-            for row in rows:
-                name_lower = row['name'].lower()
-                
-                # Проверяем различные варианты поиска
-                if (search_query_lower in name_lower or  # Частичное совпадение
-                    any(word.startswith(search_query_lower) for word in name_lower.split()) or  # Начинается с поискового запроса
-                    any(search_query_lower in word for word in name_lower.split())):  # Содержится в любом слове
-                    results.append(dict(row))
-            
-            return results
+        return await self._search_users_by_substring('name', search_query, exclude_telegram_id, limit)
 
-    async def search_users_by_branch(self, search_query: str, exclude_telegram_id: int = None) -> List[Dict[str, Any]]:
+    async def search_users_by_branch(self, search_query: str, exclude_telegram_id: int = None,
+                                     limit: int = 50) -> List[Dict[str, Any]]:
         """Поиск пользователей по отрасли (частичное совпадение)"""
+        return await self._search_users_by_substring('branch', search_query, exclude_telegram_id, limit)
+
+    async def _search_users_by_substring(self, column: str, search_query: str,
+                                         exclude_telegram_id: Optional[int], limit: int) -> List[Dict[str, Any]]:
+        """Найти анкеты, у которых search_query без учета регистра входит в column
+        
+        Поиск идет по индексу users_trigram. Запросы короче трех символов
+        индекс trigram не покрывает — для них анкеты перебираются как раньше.
+        """
         search_query_lower = search_query.lower().strip()
+        order_by = "u.branch, u.name" if column == 'branch' else "u.name"
+        branch_condition = "AND u.branch IS NOT NULL AND u.branch != ''" if column == 'branch' else ""
+        exclude_condition = "AND u.telegram_id != ?" if exclude_telegram_id else ""
+        exclude_params = [exclude_telegram_id] if exclude_telegram_id else []
         
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            if exclude_telegram_id:
-                cursor = await db.execute("""
-                    SELECT * FROM users
-                    WHERE telegram_id != ? AND branch IS NOT NULL AND branch != ''
-                    ORDER BY branch, name
-                """, (exclude_telegram_id,))
-            else:
-                cursor = await db.execute("""
-                    SELECT * FROM users
-                    WHERE branch IS NOT NULL AND branch != ''
-                    ORDER BY branch, name
-                """)
+        if not self._trigram_available or len(search_query_lower) < 3:
+            return await self._scan_users_by_substring(
+                column, search_query_lower, order_by, branch_condition,
+                exclude_condition, exclude_params, limit
+            )
+        
+        # Фраза из триграмм совпадает ровно тогда, когда запрос — подстрока значения
+        match_query = f'{column} : "' + search_query_lower.replace('"', '""') + '"'
+        async with self._read() as db:
+            cursor = await db.execute(f"""
+                SELECT u.* FROM users_trigram t
+                JOIN users u ON u.id = t.rowid
+                WHERE users_trigram MATCH ? {branch_condition} {exclude_condition}
+                ORDER BY {order_by}
+                LIMIT ?
+            """, [match_query] + exclude_params + [limit])
             rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+
+    async def _scan_users_by_substring(self, column: str, search_query_lower: str, order_by: str,
+                                       branch_condition: str, exclude_condition: str,
+                                       exclude_params: list, limit: int) -> List[Dict[str, Any]]:
+        """Перебор анкет для поиска подстроки без индекса trigram"""
+        async with self._read() as db:
+            cursor = await db.execute(f"""
+                SELECT * FROM users u
+                WHERE 1 = 1 {branch_condition} {exclude_condition}
+                ORDER BY {order_by}
+            """, exclude_params)
             
-            # Фильтрация по регистру и частичному совпадению на уровне Python
+            # Фильтрация по регистру на уровне Python: LOWER() в SQLite не знает кириллицу
             results = []
-            for row in rows:
-                branch_lower = row['branch'].lower()
-                
-                # Проверяем различные варианты поиска
-                if (search_query_lower in branch_lower or  # Частичное совпадение
-                    any(word.startswith(search_query_lower) for word in branch_lower.split()) or  # Начинается с поискового запроса
-                    any(search_query_lower in word for word in branch_lower.split())):  # Содержится в любом слове
+            async for row in cursor:
+                if search_query_lower in row[column].lower():
                     results.append(dict(row))
-            
+                    if len(results) >= limit:
+                        break
             return results
 
     async def get_branches_list(self, exclude_telegram_id: int = None) -> List[str]:
         """Получает список всех отраслей"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            if exclude_telegram_id:
-                cursor = await db.execute("""
-                    SELECT DISTINCT branch FROM users
-                    WHERE telegram_id != ? AND branch IS NOT NULL AND branch != ''
-                    ORDER BY branch
-                """, (exclude_telegram_id,))
-            else:
-                cursor = await db.execute("""
-                    SELECT DISTINCT branch FROM users
-                    WHERE branch IS NOT NULL AND branch != ''
-                    ORDER BY branch
-                """)
-            rows = await cursor.fetchall()
-            return [row['branch'] for row in rows]
+        return [branch for branch, _ in await self.get_branch_counts(exclude_telegram_id)]
 
     async def search_users_by_keywords(self, keywords: str, exclude_telegram_id: int = None) -> List[Dict[str, Any]]:
         """Поиск пользователей по ключевым словам в имени, филиале, должности и интересах"""
@@ -302,27 +1005,10 @@ class Database:
         if not search_terms:
             return []
         
-        # Используем FTS (Full Text Search) для более быстрого поиска
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            
-            # Создаем временную таблицу FTS для поиска
-            await db.execute("""
-                CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
-                    name, branch, job_title, about,
-                    content='users',
-                    content_rowid='id'
-                )
-            """)
-            
-            # Заполняем FTS таблицу, если она пустая
-            await db.execute("""
-                INSERT OR IGNORE INTO users_fts(rowid, name, branch, job_title, about)
-                SELECT id, name, branch, job_title, about FROM users
-            """)
-            
-            # Выполняем поиск через FTS
-            search_query = " ".join([f'"{term}"' for term in search_terms])
+        # Используем FTS (Full Text Search): индекс users_fts поддерживается триггерами
+        async with self._read() as db:
+            # Выполняем поиск через FTS; кавычки внутри слова удваиваем по правилам FTS5
+            search_query = " ".join(['"' + term.replace('"', '""') + '"' for term in search_terms])
             exclude_condition = "AND u.telegram_id != ?" if exclude_telegram_id else ""
             params = [exclude_telegram_id] if exclude_telegram_id else []
             
@@ -340,50 +1026,151 @@ class Database:
     async def update_user(self, telegram_id: int, name: str = None, branch: str = None, 
                          job_title: str = None, about: str = None, photo_file_id: str = None, update_photo: bool = False) -> bool:
         """Обновление данных пользователя"""
+        # Строим запрос динамически на основе переданных параметров
+        update_fields = []
+        params = []
+        
+        if name is not None:
+            update_fields.append("name = ?")
+            params.append(name)
+        
+        if branch is not None:
+            update_fields.append("branch = ?")
+            params.append(branch)
+        
+        if job_title is not None:
+            update_fields.append("job_title = ?")
+            params.append(job_title)
+        
+        if about is not None:
+            update_fields.append("about = ?")
+            params.append(about)
+        
+        if update_photo:
+            # photo_file_id может быть None для удаления фото
+            update_fields.append("photo_file_id = ?")
+            params.append(photo_file_id)
+        
+        if not update_fields:
+            return False  # Нет полей для обновления
+        
+        # Новая версия анкеты: закэшированные по версии карточки устаревают
+        update_fields.append("version = MAX(version + 1, ?)")
+        params.append(profile_version(None))
+        
+        # Добавляем telegram_id в параметры
+        params.append(telegram_id)
+        
+        query = f"""
+            UPDATE users 
+            SET {', '.join(update_fields)}
+            WHERE telegram_id = ?
+        """
+        
+        async def op(db: aiosqlite.Connection) -> bool:
+            cursor = await db.execute(query, params)
+            return cursor.rowcount > 0
+        
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                # Строим запрос динамически на основе переданных параметров
-                update_fields = []
-                params = []
-                
-                if name is not None:
-                    update_fields.append("name = ?")
-                    params.append(name)
-                
-                if branch is not None:
-                    update_fields.append("branch = ?")
-                    params.append(branch)
-                
-                if job_title is not None:
-                    update_fields.append("job_title = ?")
-                    params.append(job_title)
-                
-                if about is not None:
-                    update_fields.append("about = ?")
-                    params.append(about)
-                
-                if update_photo:
-                    # photo_file_id может быть None для удаления фото
-                    update_fields.append("photo_file_id = ?")
-                    params.append(photo_file_id)
-                
-                if not update_fields:
-                    return False  # Нет полей для обновления
-                
-                # Добавляем telegram_id в параметры
-                params.append(telegram_id)
-                
-                query = f"""
-                    UPDATE users 
-                    SET {', '.join(update_fields)}
-                    WHERE telegram_id = ?
-                """
-                
-                cursor = await db.execute(query, params)
-                await db.commit()
-                
-                return cursor.rowcount > 0
-                
+            updated = await self._submit_write(op)
+            if updated:
+                self._bump_data_version()
+            return updated
+        except Exception as e:
+            logger.error("Ошибка при обновлении пользователя %s: %s", telegram_id, e)
+            return False
+    
+    async def iter_user_ids(self, after_id: int = 0, batch_size: int = 500) -> AsyncIterator[List[int]]:
+        """Перебрать telegram_id всех пользователей по возрастанию, пачками
+        
+        Каждая пачка - отдельный запрос по ключу (telegram_id > последнего),
+        поэтому перебор не держит соединение и снимок базы на всё время
+        рассылки, а пользователи, зарегистрированные по ходу, тоже попадут в неё.
+        """
+        while True:
+            async with self._read() as db:
+                cursor = await db.execute("""
+                    SELECT telegram_id FROM users
+                    WHERE telegram_id > ?
+                    ORDER BY telegram_id
+                    LIMIT ?
+                """, (after_id, batch_size))
+                ids = [row[0] for row in await cursor.fetchall()]
+            if not ids:
+                return
+            yield ids
+            after_id = ids[-1]
+    
+    async def create_broadcast(self, text: str, created_by: int) -> Optional[int]:
+        """Создать черновик рассылки и вернуть его id"""
+        async def op(db: aiosqlite.Connection) -> int:
+            cursor = await db.execute(
+                "INSERT INTO broadcasts (text, created_by) VALUES (?, ?)", (text, created_by)
+            )
+            return cursor.lastrowid
+        
+        try:
+            return await self._submit_write(op)
+        except Exception as e:
+            logger.error("Ошибка при создании рассылки: %s", e)
+            return None
+    
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        """Получить рассылку по id"""
+        async with self._read() as db:
+            cursor = await db.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+    
+    async def get_broadcasts(self, status: str = None, limit: int = 5) -> List[Dict[str, Any]]:
+        """Последние рассылки (при необходимости только с данным статусом)"""
+        async with self._read() as db:
+            if status:
+                cursor = await db.execute(
+                    "SELECT * FROM broadcasts WHERE status = ? ORDER BY id DESC LIMIT ?",
+                    (status, limit)
+                )
+            else:
+                cursor = await db.execute(
+                    "SELECT * FROM broadcasts ORDER BY id DESC LIMIT ?", (limit,)
+                )
+            return [dict(row) for row in await cursor.fetchall()]
+    
+    async def set_broadcast_status(self, broadcast_id: int, status: str, expected_status: str = None) -> bool:
+        """Сменить статус рассылки; с expected_status - только если текущий статус совпадает"""
+        async def op(db: aiosqlite.Connection) -> bool:
+            finished = ", finished_at = CURRENT_TIMESTAMP" if status in ('done', 'cancelled', 'failed') else ""
+            if expected_status is None:
+                cursor = await db.execute(
+                    f"UPDATE broadcasts SET status = ?{finished} WHERE id = ?",
+                    (status, broadcast_id)
+                )
+            else:
+                cursor = await db.execute(
+                    f"UPDATE broadcasts SET status = ?{finished} WHERE id = ? AND status = ?",
+                    (status, broadcast_id, expected_status)
+                )
+            return cursor.rowcount > 0
+        
+        try:
+            return await self._submit_write(op)
+        except Exception as e:
+            logger.error("Ошибка при смене статуса рассылки %s: %s", broadcast_id, e)
+            return False
+    
+    async def save_broadcast_progress(self, broadcast_id: int, last_telegram_id: int,
+                                      delivered: int, blocked: int, failed: int) -> bool:
+        """Сохранить контрольную точку: всем до last_telegram_id включительно уже отправлено"""
+        async def op(db: aiosqlite.Connection) -> bool:
+            cursor = await db.execute("""
+                UPDATE broadcasts
+                SET last_telegram_id = ?, delivered = ?, blocked = ?, failed = ?
+                WHERE id = ?
+            """, (last_telegram_id, delivered, blocked, failed, broadcast_id))
+            return cursor.rowcount > 0
+        
+        try:
+            return await self._submit_write(op)
         except Exception as e:
-            print(f"Ошибка при обновлении пользователя {telegram_id}: {e}")
+            logger.error("Ошибка при сохранении прогресса рассылки %s: %s", broadcast_id, e)
             return False
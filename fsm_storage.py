@@ -0,0 +1,338 @@
+"""
+Хранилище состояний FSM в SQLite
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from database import DATABASE_PATH, DATABASE_BUSY_TIMEOUT_MS
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд без изменений состояние пользователя считается брошенным и удаляется
+FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', '86400'))
+
+# Как часто (в миллисекундах) накопленные изменения состояний и данных сбрасываются в базу
+FSM_FLUSH_INTERVAL_MS = int(os.getenv('FSM_FLUSH_INTERVAL_MS', '1000'))
+
+# Сколько записей держать в памяти после сброса в базу
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', '10000'))
+
+# Данные длиннее этого порога (в байтах JSON) сжимаются zlib
+FSM_COMPRESS_MIN_BYTES = 256
+
+# Как часто (в секундах) удалять просроченные состояния из базы
+FSM_EXPIRE_EVERY = 60
+
+# Ключ строки: (bot_id, chat_id, user_id, thread_id, destiny)
+RowKey = Tuple[int, int, int, int, str]
+
+
+class _Record:
+    """Состояние одного ключа в памяти; stored - есть ли строка в базе"""
+    __slots__ = ('state', 'data', 'updated_at', 'stored')
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None,
+                 updated_at: Optional[float] = None, stored: bool = False):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.updated_at = updated_at if updated_at is not None else time.time()
+        self.stored = stored
+
+
+def pack_data(data: Dict[str, Any]) -> Tuple[Optional[bytes], int]:
+    """Сериализовать данные FSM: компактный JSON, при выгоде — сжатый zlib"""
+    if not data:
+        return None, 0
+    raw = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if len(raw) >= FSM_COMPRESS_MIN_BYTES:
+        packed = zlib.compress(raw)
+        if len(packed) < len(raw):
+            return packed, 1
+    return raw, 0
+
+
+def unpack_data(blob: Optional[bytes], compressed: int) -> Dict[str, Any]:
+    """Обратная операция к pack_data"""
+    if not blob:
+        return {}
+    if compressed:
+        blob = zlib.decompress(blob)
+    return json.loads(blob)
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище FSM в SQLite вместо MemoryStorage
+
+    Недозаполненные анкеты и состояния поиска переживают перезапуск бота.
+
+    Изменения состояния и данных (set_state, set_data, update_data)
+    применяются в памяти и сбрасываются фоновой задачей раз в
+    FSM_FLUSH_INTERVAL_MS одной транзакцией, так что шаг анкеты не ждет
+    коммита, а несколько шагов подряд дают одну запись. Изменение, которое
+    ничего не меняет (например, state.clear() у пользователя без
+    состояния), в базу не пишется вовсе. При close() несохраненные
+    изменения дописываются; при аварийной остановке теряется не больше
+    FSM_FLUSH_INTERVAL_MS изменений.
+
+    Состояние, которое не менялось дольше ttl секунд, считается брошенным:
+    при чтении оно пустое, а фоновая задача удаляет его из базы. Пустые
+    состояния (state=None и нет данных) в базе не хранятся.
+
+    Соединение открывается при первом обращении, поэтому объект можно
+    создать на уровне модуля, как MemoryStorage.
+    """
+
+    def __init__(self, db_path: str = DATABASE_PATH, ttl: float = FSM_STATE_TTL,
+                 flush_interval_ms: int = FSM_FLUSH_INTERVAL_MS,
+                 cache_size: int = FSM_CACHE_SIZE,
+                 busy_timeout_ms: int = DATABASE_BUSY_TIMEOUT_MS):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.flush_interval = max(1, flush_interval_ms) / 1000
+        self.cache_size = max(1, cache_size)
+        self.busy_timeout_ms = busy_timeout_ms
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._open_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._closed = False
+        # Записи в порядке последнего обращения (для вытеснения) и ключи с несохраненными изменениями
+        self._records: "OrderedDict[RowKey, _Record]" = OrderedDict()
+        self._dirty: set = set()
+        self._stats = {
+            'flushes': 0,
+            'rows_written': 0,
+            'rows_deleted': 0,
+            'expired': 0,
+        }
+
+    @staticmethod
+    def _row_key(key: StorageKey) -> RowKey:
+        return (key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.destiny)
+
+    async def _ensure_open(self) -> aiosqlite.Connection:
+        """Открыть соединение и создать таблицу при первом обращении"""
+        if self._conn is not None:
+            return self._conn
+        async with self._open_lock:
+            if self._conn is None:
+                if self._closed:
+                    raise RuntimeError("Хранилище FSM уже закрыто")
+                conn = await aiosqlite.connect(self.db_path)
+                await conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+                await conn.execute("PRAGMA journal_mode=WAL")
+                await conn.execute("PRAGMA synchronous=NORMAL")
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS fsm_states (
+                        bot_id INTEGER NOT NULL,
+                        chat_id INTEGER NOT NULL,
+                        user_id INTEGER NOT NULL,
+                        thread_id INTEGER NOT NULL DEFAULT 0,
+                        destiny TEXT NOT NULL DEFAULT 'default',
+                        state TEXT,
+                        data BLOB,
+                        compressed INTEGER NOT NULL DEFAULT 0,
+                        updated_at REAL NOT NULL,
+                        PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+                    ) WITHOUT ROWID
+                """)
+                await conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states(updated_at)"
+                )
+                await conn.commit()
+                self._conn = conn
+                # Фоновая задача не должна унаследовать контекст обновления (логи, метрики)
+                self._flush_task = contextvars.Context().run(asyncio.create_task, self._flush_loop())
+        return self._conn
+
+    async def _get_record(self, key: StorageKey) -> _Record:
+        """Запись ключа из памяти или из базы; просроченная запись сбрасывается"""
+        row_key = self._row_key(key)
+        record = self._records.get(row_key)
+        if record is None:
+            record = await self._load(row_key)
+            # Пока шло чтение, запись могла появиться из параллельного обработчика
+            record = self._records.setdefault(row_key, record)
+        elif record.updated_at < time.time() - self.ttl:
+            record = _Record(stored=record.stored)
+            self._records[row_key] = record
+            self._dirty.add(row_key)
+        self._records.move_to_end(row_key)
+        return record
+
+    async def _load(self, row_key: RowKey) -> _Record:
+        conn = await self._ensure_open()
+        cursor = await conn.execute("""
+            SELECT state, data, compressed, updated_at FROM fsm_states
+            WHERE bot_id = ? AND chat_id = ? AND user_id = ? AND thread_id = ? AND destiny = ?
+              AND updated_at >= ?
+        """, (*row_key, time.time() - self.ttl))
+        row = await cursor.fetchone()
+        if row is None:
+            return _Record()
+        state, blob, compressed, updated_at = row
+        return _Record(state, unpack_data(blob, compressed), updated_at, stored=True)
+
+    def _touch(self, row_key: RowKey, record: _Record):
+        record.updated_at = time.time()
+        self._dirty.add(row_key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get_record(key)
+        state = state.state if isinstance(state, State) else state
+        if record.state == state:
+            return
+        record.state = state
+        self._touch(self._row_key(key), record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get_record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._get_record(key)
+        if record.data == data:
+            return
+        record.data = data.copy()
+        self._touch(self._row_key(key), record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._get_record(key)).data.copy()
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        record = await self._get_record(key)
+        record.data.update(data)
+        self._touch(self._row_key(key), record)
+        return record.data.copy()
+
+    async def _flush(self, keys: Optional[Iterable[RowKey]] = None):
+        """Записать несохраненные изменения одной транзакцией"""
+        keys = list(self._dirty if keys is None else keys)
+        if not keys:
+            return
+
+        # Снимок берется до первого await: изменения, сделанные во время
+        # записи, снова пометят ключ и попадут в следующий сброс
+        upserts = []
+        deletes = []
+        written = []
+        for row_key in keys:
+            self._dirty.discard(row_key)
+            record = self._records.get(row_key)
+            if record is None:
+                continue
+            if record.state is None and not record.data:
+                # Пустое состояние, которого нет в базе, удалять незачем
+                if record.stored:
+                    deletes.append(row_key)
+                    written.append((record, False))
+            else:
+                blob, compressed = pack_data(record.data)
+                upserts.append((*row_key, record.state, blob, compressed, record.updated_at))
+                written.append((record, True))
+        if not upserts and not deletes:
+            return
+
+        conn = await self._ensure_open()
+        try:
+            async with self._write_lock:
+                if upserts:
+                    await conn.executemany("""
+                        INSERT OR REPLACE INTO fsm_states
+                            (bot_id, chat_id, user_id, thread_id, destiny,
+                             state, data, compressed, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, upserts)
+                if deletes:
+                    await conn.executemany("""
+                        DELETE FROM fsm_states
+                        WHERE bot_id = ? AND chat_id = ? AND user_id = ? AND thread_id = ? AND destiny = ?
+                    """, deletes)
+                await conn.commit()
+        except BaseException:
+            self._dirty.update(keys)
+            raise
+
+        for record, stored in written:
+            record.stored = stored
+        self._stats['flushes'] += 1
+        self._stats['rows_written'] += len(upserts)
+        self._stats['rows_deleted'] += len(deletes)
+        self._trim()
+
+    def _trim(self):
+        """Вытеснить из памяти самые давние сохраненные записи сверх cache_size"""
+        excess = len(self._records) - self.cache_size
+        if excess <= 0:
+            return
+        for row_key in list(self._records):
+            if excess <= 0:
+                break
+            if row_key not in self._dirty:
+                del self._records[row_key]
+                excess -= 1
+
+    async def _expire(self):
+        """Удалить состояния, которые не менялись дольше ttl"""
+        cutoff = time.time() - self.ttl
+        for row_key, record in list(self._records.items()):
+            if record.updated_at < cutoff and row_key not in self._dirty:
+                del self._records[row_key]
+
+        conn = await self._ensure_open()
+        async with self._write_lock:
+            cursor = await conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (cutoff,))
+            await conn.commit()
+        self._stats['expired'] += cursor.rowcount
+
+    async def _flush_loop(self):
+        """Фоновая задача: периодический сброс изменений и удаление просроченных состояний"""
+        loop = asyncio.get_running_loop()
+        next_expire = loop.time()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self._flush()
+                if loop.time() >= next_expire:
+                    next_expire = loop.time() + FSM_EXPIRE_EVERY
+                    await self._expire()
+            except Exception as e:
+                logger.error("Ошибка при сохранении состояний FSM: %s", e)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Счетчики хранилища"""
+        return {
+            **self._stats,
+            'cached': len(self._records),
+            'dirty': len(self._dirty),
+        }
+
+    async def close(self) -> None:
+        """Дописать несохраненные изменения и закрыть соединение"""
+        self._closed = True
+        if self._conn is None:
+            return
+
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+
+        try:
+            await self._flush()
+        finally:
+            await self._conn.close()
+            self._conn = None
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетической базы участников форума
+
+Создает файл базы, совместимый с Database.init_db: анкеты с русскими
+именами, неравномерным распределением по филиалам, должностями и текстами
+"о себе" разной длины, а также граф лайков со степенным распределением
+популярности и заданной долей взаимных интересов. Генерация
+детерминирована (--seed), загрузка идет через executemany большими
+транзакциями, полнотекстовые индексы строятся один раз в конце.
+
+Примеры:
+    python generate_dataset.py forum.db --users 100000 --likes 1000000
+    python generate_dataset.py small.db --users 2000 --likes 20000 --mutual-ratio 0.2 --force
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from database import Database
+
+# telegram_id синтетических анкет начинаются отсюда
+USER_ID_BASE = 1_000_000
+
+# Начало форума: анкеты и лайки датируются первыми днями после него
+FORUM_START = datetime(2025, 6, 2, 9, 0, 0, tzinfo=timezone.utc)
+FORUM_DAYS = 3
+
+# Сколько строк вставлять одним вызовом executemany
+CHUNK_SIZE = 50_000
+
+MALE_NAMES = ['Александр', 'Алексей', 'Андрей', 'Артем', 'Владимир', 'Дмитрий', 'Евгений', 'Иван',
+              'Игорь', 'Илья', 'Кирилл', 'Максим', 'Михаил', 'Никита', 'Николай', 'Павел', 'Роман',
+              'Сергей', 'Степан', 'Тимур', 'Федор', 'Юрий', 'Ярослав', 'Денис', 'Егор']
+FEMALE_NAMES = ['Александра', 'Алина', 'Анастасия', 'Анна', 'Валерия', 'Виктория', 'Дарья', 'Екатерина',
+                'Елена', 'Ирина', 'Ксения', 'Мария', 'Марина', 'Наталья', 'Ольга', 'Полина', 'Светлана',
+                'София', 'Татьяна', 'Юлия', 'Вероника', 'Алиса', 'Ульяна', 'Кристина', 'Диана']
+# Фамилии в мужской форме; женская получается окончанием -а
+SURNAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов',
+            'Новиков', 'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семенов', 'Егоров',
+            'Павлов', 'Козлов', 'Степанов', 'Николаев', 'Орлов', 'Андреев', 'Макаров', 'Никитин',
+            'Захаров', 'Зайцев', 'Соловьев', 'Борисов', 'Яковлев', 'Григорьев', 'Романов', 'Воробьев']
+
+# Филиалы в порядке убывания численности (веса по закону Ципфа)
+BRANCHES = ['Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Казань', 'Нижний Новгород',
+            'Самара', 'Ростов-на-Дону', 'Краснодар', 'Уфа', 'Пермь', 'Воронеж', 'Красноярск',
+            'Тюмень', 'Томск', 'Иркутск', 'Калининград', 'Владивосток', 'Мурманск', 'Сочи']
+
+JOB_TITLES = ['Инженер', 'Ведущий инженер', 'Аналитик', 'Бизнес-аналитик', 'Аналитик данных',
+              'Разработчик', 'Тестировщик', 'Менеджер проектов', 'Продакт-менеджер', 'Дизайнер',
+              'Юрист', 'Экономист', 'Бухгалтер', 'HR-специалист', 'Рекрутер', 'Маркетолог',
+              'Специалист по закупкам', 'Руководитель отдела', 'Технолог', 'Специалист поддержки']
+
+ABOUT_SENTENCES = [
+    'Люблю походы и настольные игры.',
+    'Занимаюсь аналитикой данных, пишу на python.',
+    'Увлекаюсь фотографией и путешествиями по России.',
+    'Ищу единомышленников для проектов в сфере образования.',
+    'Играю в волейбол и бегаю по утрам.',
+    'Интересуюсь стартапами и венчурными инвестициями.',
+    'Читаю нон-фикшн и обсуждаю книги в клубе.',
+    'Хожу в горы, был на Эльбрусе.',
+    'Волонтер, помогаю приютам для животных.',
+    'Играю на гитаре, люблю джаз и рок.',
+    'Работаю с клиентами, умею договариваться.',
+    'Развиваю внутренние сервисы компании.',
+    'Готовлю, коллекционирую рецепты со всего мира.',
+    'Изучаю машинное обучение и нейросети.',
+    'Занимаюсь наставничеством молодых специалистов.',
+    'Учу испанский и мечтаю о поездке в Латинскую Америку.',
+    'Люблю шахматы, кино и хороший кофе.',
+    'Организую корпоративные мероприятия.',
+    'Интересуюсь урбанистикой и архитектурой.',
+    'Катаюсь на сноуборде и велосипеде.',
+    'Пишу статьи о технологиях и управлении.',
+    'Готов поделиться опытом в продажах и переговорах.',
+    'Хочу найти партнера для совместного пет-проекта.',
+    'Танцую сальсу, хожу на мастер-классы.',
+]
+
+# Сколько предложений в тексте "о себе": чаще одно-два, изредка длинный рассказ
+ABOUT_LENGTH_WEIGHTS = [(1, 30), (2, 30), (3, 18), (4, 10), (5, 6), (6, 3), (8, 2), (12, 1)]
+
+
+def zipf_cum_weights(n: int, alpha: float) -> List[float]:
+    """Накопленные веса 1 / rank^alpha для random.choices"""
+    return list(itertools.accumulate(1.0 / (rank ** alpha) for rank in range(1, n + 1)))
+
+
+def make_users(rng: random.Random, users: int, photo_ratio: float, id_base: int) -> List[tuple]:
+    """Строки таблицы users (created_at - unix-время, в текст его переводит SQLite)"""
+    branch_weights = zipf_cum_weights(len(BRANCHES), 1.1)
+    job_weights = zipf_cum_weights(len(JOB_TITLES), 0.7)
+    lengths, length_weights = zip(*ABOUT_LENGTH_WEIGHTS)
+    length_cum = list(itertools.accumulate(length_weights))
+
+    branches = rng.choices(BRANCHES, cum_weights=branch_weights, k=users)
+    jobs = rng.choices(JOB_TITLES, cum_weights=job_weights, k=users)
+    about_lengths = rng.choices(lengths, cum_weights=length_cum, k=users)
+    start = int(FORUM_START.timestamp())
+    span = FORUM_DAYS * 24 * 3600
+
+    rows = []
+    for i in range(users):
+        telegram_id = id_base + i
+        if rng.random() < 0.5:
+            name = f"{rng.choice(FEMALE_NAMES)} {rng.choice(SURNAMES)}а"
+        else:
+            name = f"{rng.choice(MALE_NAMES)} {rng.choice(SURNAMES)}"
+        about = ' '.join(rng.sample(ABOUT_SENTENCES, min(about_lengths[i], len(ABOUT_SENTENCES))))
+        photo_file_id = f"synthetic-photo-{telegram_id}" if rng.random() < photo_ratio else None
+        created_at = start + rng.randrange(span)
+        rows.append((telegram_id, name, branches[i], jobs[i], about, photo_file_id, created_at))
+    return rows
+
+
+def make_likes(rng: random.Random, users: int, likes: int, mutual_ratio: float) -> List[int]:
+    """Граф лайков: пары (from, to) в виде чисел from * users + to
+
+    Популярность анкет (входящие лайки) и активность участников (исходящие)
+    распределены по степенному закону, причем самые популярные и самые
+    активные - разные люди. Сначала набираются односторонние лайки: пара,
+    обратная уже выбранной, отбрасывается, иначе случайные совпадения
+    добавили бы взаимных сверх mutual_ratio. Затем часть лайков получает
+    ответный лайк, пока доля лайков во взаимных парах не достигнет mutual_ratio.
+    """
+    # Односторонних лайков не больше, чем неупорядоченных пар, а ответные
+    # составляют mutual_ratio / 2 от итога
+    max_one_way = users * (users - 1) // 2
+    max_likes = min(2 * max_one_way, int(max_one_way / (1 - mutual_ratio / 2)))
+    if likes > max_likes:
+        print(f"⚠️ {users} анкет вмещают не больше {max_likes} лайков при доле взаимных "
+              f"{mutual_ratio:.0%}: будет {max_likes} вместо {likes}")
+        likes = max_likes
+    popularity = list(range(users))
+    activity = list(range(users))
+    rng.shuffle(popularity)
+    rng.shuffle(activity)
+    in_weights = zipf_cum_weights(users, 0.9)
+    out_weights = zipf_cum_weights(users, 0.6)
+
+    one_way_target = min(max_one_way, int(likes * (1 - mutual_ratio / 2)))
+    pairs = set()
+    while len(pairs) < one_way_target:
+        batch = min(CHUNK_SIZE * 4, (one_way_target - len(pairs)) * 2 + 100)
+        senders = rng.choices(activity, cum_weights=out_weights, k=batch)
+        targets = rng.choices(popularity, cum_weights=in_weights, k=batch)
+        added = 0
+        for from_index, to_index in zip(senders, targets):
+            if from_index != to_index:
+                pair = from_index * users + to_index
+                if pair not in pairs and to_index * users + from_index not in pairs:
+                    pairs.add(pair)
+                    added += 1
+                    if len(pairs) >= one_way_target:
+                        break
+        if added * 100 < batch and len(pairs) < one_way_target:
+            # Граф почти насыщен и выборка по весам почти не находит новых пар:
+            # добираем остаток из свободных пар равномерно
+            free = [
+                a * users + b
+                for a in range(users) for b in range(a + 1, users)
+                if a * users + b not in pairs and b * users + a not in pairs
+            ]
+            rng.shuffle(free)
+            for pair in free[:one_way_target - len(pairs)]:
+                if rng.random() < 0.5:
+                    pair = (pair % users) * users + pair // users
+                pairs.add(pair)
+
+    mutual = 0
+    candidates = list(pairs)
+    rng.shuffle(candidates)
+    for pair in candidates:
+        if len(pairs) >= likes or mutual >= mutual_ratio * len(pairs):
+            break
+        pairs.add((pair % users) * users + pair // users)
+        mutual += 2
+    return sorted(pairs)
+
+
+def _drop_fts(conn: sqlite3.Connection):
+    """Убрать полнотекстовые индексы: Database.open() построит их заново одним проходом"""
+    for table in ('users_fts', 'users_trigram'):
+        for suffix in ('ai', 'ad', 'au'):
+            conn.execute(f"DROP TRIGGER IF EXISTS {table}_{suffix}")
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+def _insert_chunks(conn: sqlite3.Connection, sql: str, rows):
+    iterator = iter(rows)
+    while True:
+        chunk = list(itertools.islice(iterator, CHUNK_SIZE))
+        if not chunk:
+            return
+        conn.executemany(sql, chunk)
+
+
+async def generate_dataset(db_path: str, users: int, likes: int, seed: int = 1,
+                           mutual_ratio: float = 0.15, photo_ratio: float = 0.6,
+                           skip_ratio: float = 0.1, id_base: int = USER_ID_BASE) -> Dict[str, Any]:
+    """Создать базу db_path и наполнить её синтетическими данными
+
+    Схема создается самим Database, так что файл совместим с текущей
+    версией бота. Каждый лайк сопровождается просмотром (как в боте), часть
+    безответных входящих интересов помечена пропущенными (skip_ratio).
+    """
+    started = time.perf_counter()
+    rng = random.Random(seed)
+
+    db = Database(db_path)
+    await db.open()
+    await db.close()
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-200000")
+    with conn:
+        _drop_fts(conn)
+        _insert_chunks(conn, """
+            INSERT INTO users (telegram_id, name, branch, job_title, about, photo_file_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, datetime(?, 'unixepoch'))
+        """, make_users(rng, users, photo_ratio, id_base))
+
+    pairs = make_likes(rng, users, likes, mutual_ratio)
+    pair_set = set(pairs)
+    start = int(FORUM_START.timestamp())
+    span = FORUM_DAYS * 24 * 3600
+
+    def like_rows():
+        for pair in pairs:
+            from_index, to_index = divmod(pair, users)
+            mutual = to_index * users + from_index in pair_set
+            skipped = 1 if not mutual and rng.random() < skip_ratio else 0
+            created_at = start + rng.randrange(span)
+            yield id_base + from_index, id_base + to_index, created_at, skipped
+
+    with conn:
+        _insert_chunks(conn, """
+            INSERT INTO likes (from_user_id, to_user_id, created_at, skipped)
+            VALUES (?, ?, datetime(?, 'unixepoch'), ?)
+        """, like_rows())
+        _insert_chunks(conn, "INSERT OR IGNORE INTO views (viewer_id, viewed_id) VALUES (?, ?)", (
+            (id_base + pair // users, id_base + pair % users) for pair in pairs
+        ))
+        _insert_chunks(conn, "INSERT OR IGNORE INTO matches (user_low, user_high) VALUES (?, ?)", (
+            (id_base + pair // users, id_base + pair % users)
+            for pair in pairs
+            if pair // users < pair % users and (pair % users) * users + pair // users in pair_set
+        ))
+
+    matches = conn.execute("SELECT COUNT(*) FROM matches").fetchone()[0]
+    conn.execute("ANALYZE")
+    conn.close()
+
+    # Повторное открытие создает полнотекстовые индексы и заполняет их по всем анкетам сразу
+    db = Database(db_path)
+    await db.open()
+    await db.close()
+
+    return {
+        'users': users,
+        'likes': len(pairs),
+        'matches': matches,
+        'mutual_ratio': round(2 * matches / len(pairs), 4) if pairs else 0.0,
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Синтетическая база участников форума")
+    parser.add_argument('path', help="файл базы, который будет создан")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--likes', type=int, default=100000)
+    parser.add_argument('--mutual-ratio', type=float, default=0.15,
+                        help="доля лайков, входящих во взаимные пары")
+    parser.add_argument('--photo-ratio', type=float, default=0.6, help="доля анкет с фото")
+    parser.add_argument('--skip-ratio', type=float, default=0.1,
+                        help="доля безответных входящих интересов, которые пропустили")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--force', action='store_true', help="перезаписать существующий файл")
+    return parser.parse_args()
+
+
+def main():
+    options = parse_args()
+    if os.path.exists(options.path):
+        if not options.force:
+            print(f"❌ Файл {options.path} уже существует (--force, чтобы перезаписать)")
+            return
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(options.path + suffix):
+                os.remove(options.path + suffix)
+
+    stats = asyncio.run(generate_dataset(
+        options.path, options.users, options.likes, seed=options.seed,
+        mutual_ratio=options.mutual_ratio, photo_ratio=options.photo_ratio,
+        skip_ratio=options.skip_ratio,
+    ))
+    print(f"✅ {options.path}: {stats['users']} анкет, {stats['likes']} лайков, "
+          f"{stats['matches']} совпадений (доля взаимных {stats['mutual_ratio']:.1%}) "
+          f"за {stats['seconds']} с")
+
+
+if __name__ == "__main__":
+    main()
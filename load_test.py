@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест бота без Telegram
+
+Поднимает локальную заглушку Bot API (getUpdates, sendMessage, sendPhoto,
+editMessageText, editMessageMedia, getChat, answerCallbackQuery и др.), направляет на
+нее бота через TELEGRAM_API_URL и прогоняет тысячи виртуальных участников по
+сценарию: /start -> анкета -> поиск -> лайки -> ответ на входящие интересы.
+В конце печатает p50/p95/p99 времени от отправки обновления до ответа бота
+и число обработанных обновлений в секунду, а также проверяет результат:
+сколько анкет участников оказалось в базе и какие ошибки записал бот в лог.
+Если анкет меньше, чем участников, код выхода 1.
+
+Примеры:
+    python load_test.py --users 2000 --swipes 10
+    python load_test.py --users 500 --api-latency-ms 40 --json result.json
+    python load_test.py --external-bot --port 8081   # бот запущен отдельно с TELEGRAM_API_URL
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+# Токен и профиль бота, которые отдает заглушка
+LOAD_TEST_TOKEN = '123456789:LOADTESTTOKEN'
+BOT_USER = {'id': 123456789, 'is_bot': True, 'first_name': 'Load test', 'username': 'load_test_bot'}
+
+# telegram_id виртуальных участников начинаются отсюда (уведомления о совпадении
+# бот отправляет только "реальным" id больше 100000000)
+USER_ID_BASE = 200_000_000
+
+FIRST_NAMES = ['Анна', 'Мария', 'Елена', 'Ольга', 'Дарья', 'Иван', 'Алексей', 'Дмитрий',
+               'Сергей', 'Никита', 'Екатерина', 'Павел', 'Татьяна', 'Михаил', 'Юлия']
+BRANCHES = ['Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', 'Екатеринбург', 'Самара']
+JOB_TITLES = ['Инженер', 'Аналитик', 'Менеджер проектов', 'Дизайнер', 'Юрист', 'Экономист']
+ABOUT_TEXTS = [
+    'Люблю походы и настольные игры, ищу единомышленников',
+    'Занимаюсь аналитикой данных, интересуюсь python и машинным обучением',
+    'Работаю с клиентами, увлекаюсь фотографией и путешествиями',
+]
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Квантиль по отсортированной выборке (метод ближайшего ранга)"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(q * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def parse_markup(raw: Optional[str]) -> List[str]:
+    """callback_data всех кнопок из reply_markup запроса"""
+    if not raw:
+        return []
+    markup = json.loads(raw)
+    return [
+        button['callback_data']
+        for row in markup.get('inline_keyboard', [])
+        for button in row
+        if 'callback_data' in button
+    ]
+
+
+class LoadStats:
+    """Задержки по шагам сценария и счетчики прогона"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.timeouts: Counter = Counter()
+        self.users_finished = 0
+        self.users_aborted = 0
+
+    def record(self, step: str, seconds: float):
+        self.samples.setdefault(step, []).append(seconds)
+
+    def summary(self) -> Dict[str, Any]:
+        def describe(values: List[float]) -> Dict[str, Any]:
+            values = sorted(values)
+            return {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 0.50) * 1000, 2) if values else None,
+                'p95_ms': round(percentile(values, 0.95) * 1000, 2) if values else None,
+                'p99_ms': round(percentile(values, 0.99) * 1000, 2) if values else None,
+                'max_ms': round(values[-1] * 1000, 2) if values else None,
+            }
+
+        all_values = [value for values in self.samples.values() for value in values]
+        return {
+            'overall': describe(all_values),
+            'steps': {step: describe(values) for step, values in self.samples.items()},
+            'timeouts': dict(self.timeouts),
+            'users_finished': self.users_finished,
+            'users_aborted': self.users_aborted,
+        }
+
+
+class LogLevelCounter(logging.Handler):
+    """Считает записи лога бота по уровням (WARNING и выше) и частые тексты ошибок"""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.counts: Counter = Counter()
+        self.errors: Counter = Counter()
+
+    def emit(self, record: logging.LogRecord):
+        self.counts[record.levelname] += 1
+        if record.levelno >= logging.ERROR:
+            # Тексты обрезаются, чтобы ошибки с разными id сливались в одну строку
+            self.errors[record.getMessage()[:100]] += 1
+
+
+def count_profiles(db_path: str, users: int) -> Dict[str, int]:
+    """Сколько анкет виртуальных участников и анкет самого бота сохранено в базе"""
+    with sqlite3.connect(db_path) as conn:
+        saved = conn.execute(
+            "SELECT COUNT(*) FROM users WHERE telegram_id >= ? AND telegram_id < ?",
+            (USER_ID_BASE, USER_ID_BASE + users),
+        ).fetchone()[0]
+        bot_profiles = conn.execute(
+            "SELECT COUNT(*) FROM users WHERE telegram_id = ?", (BOT_USER['id'],)
+        ).fetchone()[0]
+    return {'profiles_saved': saved, 'bot_profiles': bot_profiles}
+
+
+class FakeTelegramServer:
+    """Заглушка Bot API: отдает обновления виртуальных участников и принимает ответы бота"""
+
+    def __init__(self, api_latency: float = 0.0):
+        self.api_latency = api_latency
+        self.users: Dict[int, 'VirtualUser'] = {}
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.updates_delivered = 0
+        self.polling_started = asyncio.Event()
+        self._updates: deque = deque()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        # Вид каждого отправленного сообщения ('text' или 'photo') - для правдоподобных ошибок
+        self._message_kinds: Dict[tuple, str] = {}
+        self._pending_callbacks: Dict[str, 'VirtualUser'] = {}
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/bot{token}/{method}', self.handle)
+        return app
+
+    def push_update(self, update: Dict[str, Any], callback_user: Optional['VirtualUser'] = None):
+        update['update_id'] = next(self._update_ids)
+        if callback_user is not None:
+            self._pending_callbacks[update['callback_query']['id']] = callback_user
+        self._updates.append(update)
+        self._new_updates.set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = dict(await request.post()) if request.can_read_body else {}
+        self.calls[method] += 1
+        if self.api_latency and method != 'getUpdates':
+            await asyncio.sleep(self.api_latency)
+
+        handler = getattr(self, f'_api_{method}', None)
+        if handler is None:
+            return web.json_response({'ok': True, 'result': True})
+        try:
+            result = await handler(params)
+        except _BadRequest as e:
+            self.errors[method] += 1
+            return web.json_response(
+                {'ok': False, 'error_code': 400, 'description': f'Bad Request: {e}'}, status=400
+            )
+        return web.json_response({'ok': True, 'result': result})
+
+    def _message(self, chat_id: int, message_id: int, kind: str, text: Optional[str]) -> Dict[str, Any]:
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+        }
+        if kind == 'photo':
+            message['photo'] = [{'file_id': 'photo', 'file_unique_id': 'photo', 'width': 640, 'height': 640}]
+            if text:
+                message['caption'] = text
+        else:
+            message['text'] = text or ''
+        return message
+
+    def _deliver(self, chat_id: int, method: str, message_id: int, kind: str, params: Dict[str, Any]):
+        self._message_kinds[(chat_id, message_id)] = kind
+        user = self.users.get(chat_id)
+        if user is not None:
+            text = params.get('text') or params.get('caption') or ''
+            user.on_bot_message(method, message_id, kind, text, parse_markup(params.get('reply_markup')))
+
+    async def _api_getMe(self, params):
+        return BOT_USER
+
+    async def _api_getUpdates(self, params):
+        self.polling_started.set()
+        offset = int(params.get('offset') or 0)
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.popleft()
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        batch = list(itertools.islice(self._updates, int(params.get('limit') or 100)))
+        self.updates_delivered += len(batch)
+        return batch
+
+    async def _api_sendMessage(self, params):
+        chat_id = int(params['chat_id'])
+        message_id = next(self._message_ids)
+        self._deliver(chat_id, 'sendMessage', message_id, 'text', params)
+        return self._message(chat_id, message_id, 'text', params.get('text'))
+
+    async def _api_sendPhoto(self, params):
+        chat_id = int(params['chat_id'])
+        message_id = next(self._message_ids)
+        self._deliver(chat_id, 'sendPhoto', message_id, 'photo', params)
+        return self._message(chat_id, message_id, 'photo', params.get('caption'))
+
+    async def _api_editMessageText(self, params):
+        chat_id, message_id = int(params['chat_id']), int(params['message_id'])
+        # Как и настоящий Telegram, текст сообщения с фото отредактировать нельзя
+        if self._message_kinds.get((chat_id, message_id)) == 'photo':
+            raise _BadRequest('there is no text in the message to edit')
+        self._deliver(chat_id, 'editMessageText', message_id, 'text', params)
+        return self._message(chat_id, message_id, 'text', params.get('text'))
+
+    async def _api_editMessageCaption(self, params):
+        chat_id, message_id = int(params['chat_id']), int(params['message_id'])
+        self._deliver(chat_id, 'editMessageCaption', message_id, 'photo', params)
+        return self._message(chat_id, message_id, 'photo', params.get('caption'))
+
+    async def _api_editMessageMedia(self, params):
+        chat_id, message_id = int(params['chat_id']), int(params['message_id'])
+        media = json.loads(params.get('media') or '{}')
+        kind = 'photo' if media.get('type') == 'photo' else 'text'
+        self._deliver(chat_id, 'editMessageMedia', message_id, kind,
+                      {'caption': media.get('caption'), 'reply_markup': params.get('reply_markup')})
+        return self._message(chat_id, message_id, kind, media.get('caption'))
+
+    async def _api_editMessageReplyMarkup(self, params):
+        chat_id, message_id = int(params['chat_id']), int(params['message_id'])
+        kind = self._message_kinds.get((chat_id, message_id), 'text')
+        self._deliver(chat_id, 'editMessageReplyMarkup', message_id, kind, params)
+        return self._message(chat_id, message_id, kind, None)
+
+    async def _api_getChat(self, params):
+        chat_id = int(params['chat_id'])
+        return {'id': chat_id, 'type': 'private', 'first_name': 'User', 'username': f'user{chat_id}'}
+
+    async def _api_answerCallbackQuery(self, params):
+        user = self._pending_callbacks.pop(params.get('callback_query_id'), None)
+        if user is not None:
+            user.on_callback_answer(params['callback_query_id'])
+        return True
+
+
+class _BadRequest(Exception):
+    """Ответ 400, который заглушка возвращает боту"""
+
+
+class VirtualUser:
+    """Участник форума, который проходит сценарий и ждет ответа бота на каждый шаг
+
+    Шаг с сообщением завершается первым ответом бота в чат. Шаг с кнопкой -
+    ответом на callback (answerCallbackQuery), так что запоздавшее
+    редактирование не засчитается следующему шагу. Задержка шага - время
+    до первого видимого ответа (или до answerCallbackQuery, если его не было).
+    Уведомления о входящих интересах откладываются, на них участник
+    отвечает в конце сценария.
+    """
+
+    def __init__(self, index: int, server: FakeTelegramServer, stats: LoadStats,
+                 options: argparse.Namespace, rng: random.Random):
+        self.telegram_id = USER_ID_BASE + index
+        self.server = server
+        self.stats = stats
+        self.options = options
+        self.rng = rng
+        self.profile = {'id': self.telegram_id, 'is_bot': False,
+                        'first_name': rng.choice(FIRST_NAMES), 'language_code': 'ru'}
+        self.last_message_id = 0
+        self.last_message_kind = 'text'
+        self.notifications: List[tuple] = []
+        self._ids = itertools.count(1)
+        self._output: Optional[asyncio.Future] = None
+        self._ack: Optional[asyncio.Future] = None
+        self._ack_id: Optional[str] = None
+        server.users[self.telegram_id] = self
+
+    # --- ответы бота ---
+
+    def on_bot_message(self, method: str, message_id: int, kind: str, text: str, callbacks: List[str]):
+        respond = next((data for data in callbacks if data.startswith('respond_like_')), None)
+        if method == 'sendMessage' and respond is not None:
+            self.notifications.append((message_id, respond))
+            return
+        self.last_message_id = message_id
+        self.last_message_kind = kind
+        if self._output is not None and not self._output.done():
+            self._output.set_result(time.perf_counter())
+
+    def on_callback_answer(self, callback_id: str):
+        if callback_id == self._ack_id and self._ack is not None and not self._ack.done():
+            self._ack.set_result(time.perf_counter())
+
+    # --- шаги сценария ---
+
+    def _chat(self) -> Dict[str, Any]:
+        return {'id': self.telegram_id, 'type': 'private', 'first_name': self.profile['first_name']}
+
+    async def _step(self, step: str, update: Dict[str, Any], wait_ack: bool) -> bool:
+        loop = asyncio.get_running_loop()
+        self._output = loop.create_future()
+        waiter = self._output
+        callback_user = None
+        if wait_ack:
+            self._ack = waiter = loop.create_future()
+            self._ack_id = update['callback_query']['id']
+            callback_user = self
+        started = time.perf_counter()
+        self.server.push_update(update, callback_user)
+        try:
+            finished = await asyncio.wait_for(asyncio.shield(waiter), self.options.timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts[step] += 1
+            return False
+        if self._output.done():
+            finished = min(finished, self._output.result())
+        self.stats.record(step, finished - started)
+
+        if self.options.think_ms:
+            await asyncio.sleep(self.rng.uniform(0, 2 * self.options.think_ms) / 1000)
+        return True
+
+    async def send_text(self, step: str, text: str) -> bool:
+        message = {'message_id': next(self._ids), 'date': int(time.time()),
+                   'chat': self._chat(), 'from': self.profile, 'text': text}
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return await self._step(step, {'message': message}, wait_ack=False)
+
+    async def send_photo(self, step: str) -> bool:
+        file_id = f'loadtest-photo-{self.telegram_id}'
+        message = {'message_id': next(self._ids), 'date': int(time.time()),
+                   'chat': self._chat(), 'from': self.profile,
+                   'photo': [{'file_id': file_id, 'file_unique_id': file_id, 'width': 640, 'height': 640}]}
+        return await self._step(step, {'message': message}, wait_ack=False)
+
+    async def press(self, step: str, data: str, message_id: Optional[int] = None,
+                    wait_ack: bool = True) -> bool:
+        message_id = message_id or self.last_message_id
+        kind = self.last_message_kind if message_id == self.last_message_id else 'text'
+        message = {'message_id': message_id, 'date': int(time.time()),
+                   'chat': self._chat(), 'from': BOT_USER}
+        if kind == 'photo':
+            message['photo'] = [{'file_id': 'photo', 'file_unique_id': 'photo', 'width': 640, 'height': 640}]
+        else:
+            message['text'] = '…'
+        callback = {'id': f'{self.telegram_id}-{next(self._ids)}', 'from': self.profile,
+                    'chat_instance': str(self.telegram_id), 'data': data, 'message': message}
+        return await self._step(step, {'callback_query': callback}, wait_ack=wait_ack)
+
+    async def run(self):
+        rng = self.rng
+        name = f"{self.profile['first_name']} {self.telegram_id - USER_ID_BASE}"
+        steps = [
+            lambda: self.send_text('start', '/start'),
+            lambda: self.press('create_profile', 'create_profile'),
+            lambda: self.send_text('name', name),
+            lambda: self.send_text('branch', rng.choice(BRANCHES)),
+            lambda: self.send_text('job_title', rng.choice(JOB_TITLES)),
+            lambda: self.send_text('about', rng.choice(ABOUT_TEXTS)),
+        ]
+        if rng.random() < self.options.photo_ratio:
+            # process_add_photo не отвечает на callback - ждем первого ответа в чат
+            steps.append(lambda: self.press('add_photo', 'add_photo', wait_ack=False))
+            steps.append(lambda: self.send_photo('photo'))
+        else:
+            steps.append(lambda: self.press('skip_photo', 'skip_photo'))
+        steps.append(lambda: self.press('search', 'search'))
+        for _ in range(self.options.swipes):
+            if rng.random() < self.options.like_ratio:
+                steps.append(lambda: self.press('like', 'like'))
+                steps.append(lambda: self.press('search', 'search'))
+            else:
+                steps.append(lambda: self.press('next', 'next'))
+
+        for make_step in steps:
+            if not await make_step():
+                self.stats.users_aborted += 1
+                return
+
+        # Отвечаем на интересы, пришедшие за время сценария
+        for message_id, data in self.notifications[:self.options.responses]:
+            if not await self.press('respond', data, message_id):
+                self.stats.users_aborted += 1
+                return
+        self.stats.users_finished += 1
+
+
+async def start_bot(api_url: str, database: Optional[str], workdir: str):
+    """Импортировать bot.py, направив его на заглушку, и запустить polling"""
+    db_path = os.path.join(workdir, 'load_test.db')
+    if database:
+        shutil.copyfile(database, db_path)
+    os.environ['BOT_TOKEN'] = LOAD_TEST_TOKEN
+    os.environ['TELEGRAM_API_URL'] = api_url
+    os.environ['DATABASE_PATH'] = db_path
+    os.environ['RUN_MODE'] = 'polling'
+    os.environ['METRICS_PORT'] = '0'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    import bot as bot_app
+    task = asyncio.create_task(bot_app.main())
+    return bot_app, task, db_path
+
+
+async def run_load_test(options: argparse.Namespace) -> Dict[str, Any]:
+    server = FakeTelegramServer(api_latency=options.api_latency_ms / 1000)
+    runner = web.AppRunner(server.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, options.host, options.port).start()
+    api_url = f'http://{options.host}:{options.port}'
+    print(f"Заглушка Bot API: {api_url}")
+
+    workdir = tempfile.mkdtemp(prefix='load_test_')
+    bot_app = bot_task = None
+    # Ошибки в логе считаются только у бота, запущенного в этом процессе
+    log_counter = LogLevelCounter()
+    try:
+        if options.external_bot:
+            print(f"Ожидаем бота: запустите его с TELEGRAM_API_URL={api_url} BOT_TOKEN={LOAD_TEST_TOKEN}")
+        else:
+            bot_app, bot_task, db_path = await start_bot(api_url, options.database, workdir)
+            # bot.py настраивает корневой логгер при импорте - добавляем счетчик после
+            logging.getLogger().addHandler(log_counter)
+        await server.polling_started.wait()
+
+        stats = LoadStats()
+        rng = random.Random(options.seed)
+        users = [
+            VirtualUser(i, server, stats, options, random.Random(rng.random()))
+            for i in range(options.users)
+        ]
+
+        async def start_user(user: VirtualUser, delay: float):
+            await asyncio.sleep(delay)
+            await user.run()
+
+        print(f"Участников: {options.users}, разгон {options.ramp_up} с, свайпов на участника: {options.swipes}")
+        started = time.perf_counter()
+        updates_before = server.updates_delivered
+        await asyncio.gather(*(
+            start_user(user, options.ramp_up * i / max(1, options.users))
+            for i, user in enumerate(users)
+        ))
+        elapsed = time.perf_counter() - started
+        updates = server.updates_delivered - updates_before
+
+        result = {
+            'users': options.users,
+            'elapsed_s': round(elapsed, 3),
+            'updates': updates,
+            'updates_per_sec': round(updates / elapsed, 1) if elapsed else None,
+            'api_calls': dict(server.calls),
+            'api_errors': dict(server.errors),
+            **stats.summary(),
+        }
+        if bot_app is not None:
+            from metrics import handler_summary
+            result['handlers'] = handler_summary(limit=30)
+            # Участник мог дойти до конца сценария, хотя анкета не сохранилась:
+            # сверяем базу с числом участников
+            result.update(count_profiles(db_path, options.users))
+            result['log_levels'] = dict(log_counter.counts)
+            result['log_errors'] = dict(log_counter.errors.most_common(5))
+        return result
+    finally:
+        logging.getLogger().removeHandler(log_counter)
+        if bot_app is not None:
+            try:
+                await bot_app.dp.stop_polling()
+            except RuntimeError:
+                pass
+            await asyncio.gather(bot_task, return_exceptions=True)
+        await runner.cleanup()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_report(result: Dict[str, Any]):
+    def row(name: str, entry: Dict[str, Any]) -> str:
+        if not entry['count']:
+            return f"{name:<16} {0:>8}"
+        return (f"{name:<16} {entry['count']:>8} {entry['p50_ms']:>9.1f} {entry['p95_ms']:>9.1f} "
+                f"{entry['p99_ms']:>9.1f} {entry['max_ms']:>9.1f}")
+
+    print()
+    print(f"Обновлений: {result['updates']} за {result['elapsed_s']} с "
+          f"({result['updates_per_sec']} в секунду)")
+    print(f"Участников прошли сценарий: {result['users_finished']}, прервано по таймауту: {result['users_aborted']}")
+    print()
+    print(f"{'шаг':<16} {'ответов':>8} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'макс, мс':>9}")
+    for step, entry in result['steps'].items():
+        print(row(step, entry))
+    print(row('всего', result['overall']))
+    if result['timeouts']:
+        print(f"\nТаймауты: {result['timeouts']}")
+    if result['api_errors']:
+        print(f"Ошибки API (400): {result['api_errors']}")
+    print(f"Вызовы API: {result['api_calls']}")
+    if result.get('handlers'):
+        print(f"\nОбработчики (метрики бота):\n{result['handlers']}")
+    if 'profiles_saved' in result:
+        print(f"\nАнкет участников в базе: {result['profiles_saved']} из {result['users']}")
+        if result['bot_profiles']:
+            print(f"Анкет с id самого бота: {result['bot_profiles']}")
+        levels = result['log_levels']
+        print(f"Записей лога бота: ошибок {levels.get('ERROR', 0) + levels.get('CRITICAL', 0)}, "
+              f"предупреждений {levels.get('WARNING', 0)}")
+        for text, count in result['log_errors'].items():
+            print(f"  {count:>6}  {text}")
+
+
+def check_result(result: Dict[str, Any]) -> List[str]:
+    """Причины считать прогон неудачным; пустой список - сценарий отработал
+
+    Ошибки в логе только печатаются: часть из них бот обрабатывает сам
+    (например, отвечает новым сообщением, если не удалось отредактировать).
+    """
+    problems = []
+    if 'profiles_saved' not in result:
+        return problems
+    if result['profiles_saved'] != result['users']:
+        problems.append(f"сохранено анкет {result['profiles_saved']} из {result['users']}")
+    if result['bot_profiles']:
+        problems.append("в базе есть анкета с id бота")
+    return problems
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на заглушке Bot API")
+    parser.add_argument('--users', type=int, default=1000, help="число виртуальных участников")
+    parser.add_argument('--ramp-up', type=float, default=10.0, help="за сколько секунд подключаются все участники")
+    parser.add_argument('--swipes', type=int, default=10, help="сколько анкет смотрит каждый участник")
+    parser.add_argument('--like-ratio', type=float, default=0.3, help="доля анкет, на которые нажимают 'Познакомиться'")
+    parser.add_argument('--photo-ratio', type=float, default=0.5, help="доля участников, загружающих фото")
+    parser.add_argument('--responses', type=int, default=3, help="на сколько входящих интересов отвечает участник")
+    parser.add_argument('--think-ms', type=float, default=0.0, help="средняя пауза участника между шагами")
+    parser.add_argument('--api-latency-ms', type=float, default=0.0, help="задержка каждого ответа заглушки")
+    parser.add_argument('--timeout', type=float, default=30.0, help="сколько секунд ждать ответа бота на шаг")
+    parser.add_argument('--database', help="файл базы, с копии которого начинать, например "
+                                           "от generate_dataset.py (по умолчанию пустая база)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--external-bot', action='store_true', help="не запускать бота, ждать внешний процесс")
+    parser.add_argument('--json', help="записать результат в JSON-файл")
+    return parser.parse_args()
+
+
+def main():
+    options = parse_args()
+    result = asyncio.run(run_load_test(options))
+    print_report(result)
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультат записан в {options.json}")
+    problems = check_result(result)
+    if problems:
+        print(f"\nСценарий отработал с ошибками: {'; '.join(problems)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
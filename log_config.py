@@ -0,0 +1,145 @@
+"""
+Настройка логирования: очередь, структурированные записи и сэмплирование
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+# Уровень логирования и формат вывода: 'json' (по строке JSON на запись) или 'text'
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+
+# Из повторяющихся DEBUG-записей одного события выводится первая и затем каждая N-я
+LOG_DEBUG_SAMPLE_EVERY = int(os.getenv('LOG_DEBUG_SAMPLE_EVERY', '100'))
+
+# Контекст текущего обновления; заполняется LogContextMiddleware
+log_user_id: ContextVar[Optional[int]] = ContextVar('log_user_id', default=None)
+log_handler: ContextVar[Optional[str]] = ContextVar('log_handler', default=None)
+
+_listener: Optional[QueueListener] = None
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи user_id и имя обработчика текущего обновления
+
+    Стоит на QueueHandler, то есть выполняется в потоке event loop, где
+    контекст обновления еще доступен.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'user_id'):
+            record.user_id = log_user_id.get()
+        if not hasattr(record, 'handler'):
+            record.handler = log_handler.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только каждую N-ю DEBUG-запись одного события
+
+    Событие - это шаблон сообщения (record.msg) и место вызова, поэтому
+    частые отладочные строки горячих обработчиков не забивают вывод, а
+    редкие выводятся полностью. Записи INFO и выше не сэмплируются.
+    """
+
+    def __init__(self, every: int = LOG_DEBUG_SAMPLE_EVERY):
+        super().__init__()
+        self.every = max(1, every)
+        self._counts: Dict[tuple, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.every == 1:
+            return True
+        key = (record.pathname, record.lineno, record.msg)
+        count = self._counts.get(key, 0)
+        self._counts[key] = count + 1
+        if count % self.every:
+            return False
+        record.sample_every = self.every
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна строка JSON на запись"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))
+                  + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in ('user_id', 'handler', 'sample_every'):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    """QueueHandler, который не форматирует запись в потоке event loop
+
+    Здесь выполняется только подстановка аргументов (они могут измениться
+    к моменту записи); JSON и трассировки исключений строит поток QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT) -> QueueListener:
+    """Направить корневой логгер через очередь в поток-писатель
+
+    Обработчики на event loop только кладут запись в очередь; вывод в
+    stderr выполняет QueueListener в отдельном потоке. Повторный вызов
+    возвращает уже запущенного слушателя.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if log_format == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s:%(name)s:[%(handler)s user=%(user_id)s] %(message)s'
+        ))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Дописать оставшиеся в очереди записи и остановить поток-писатель"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
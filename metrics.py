@@ -0,0 +1,276 @@
+"""
+Метрики обработчиков, базы данных и Telegram API в формате Prometheus
+"""
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Где слушает локальный HTTP-сервер с метриками; порт 0 отключает его
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9090'))
+
+# Границы корзин гистограмм, в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Время, накопленное текущим обновлением: {'db': сек, 'api': сек, 'open': bool}
+_update_timings: ContextVar[Optional[Dict[str, Any]]] = ContextVar('update_timings', default=None)
+
+# Дополнительные метрики, которые собираются в момент выгрузки (размеры очередей, кэшей)
+GaugeCollector = Callable[[], Iterable[Tuple[str, str, Dict[str, str], float]]]
+
+
+class Histogram:
+    """Гистограмма с метками: счетчики по корзинам, сумма и количество"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List] = {}  # {labels: [bucket_counts, sum, count]}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def quantile(self, labels: Tuple[str, ...], q: float) -> Optional[float]:
+        """Оценка квантиля по корзинам (верхняя граница корзины)"""
+        series = self._series.get(labels)
+        if not series or not series[2]:
+            return None
+        rank = q * series[2]
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), series[0]):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def series(self) -> Dict[Tuple[str, ...], List]:
+        return self._series
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (bucket_counts, total, count) in sorted(self._series.items()):
+            base = _format_labels(dict(zip(self.label_names, labels)))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_with_le(base, repr(bound))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_with_le(base, "+Inf")} {count}')
+            lines.append(f"{self.name}_sum{base} {total:.6f}")
+            lines.append(f"{self.name}_count{base} {count}")
+        return lines
+
+
+class Counter:
+    """Счетчик с метками"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...], value: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, labels: Tuple[str, ...]) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(dict(zip(self.label_names, labels)))} {value:g}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _with_le(base: str, le: str) -> str:
+    if base:
+        return base[:-1] + f',le="{le}"}}'
+    return f'{{le="{le}"}}'
+
+
+handler_duration = Histogram(
+    'bot_handler_duration_seconds', 'Время обработки обновления обработчиком', ('handler',)
+)
+handler_db_time = Histogram(
+    'bot_handler_db_seconds', 'Время запросов к базе внутри одного обновления', ('handler',)
+)
+handler_api_time = Histogram(
+    'bot_handler_telegram_api_seconds', 'Время вызовов Telegram API внутри одного обновления', ('handler',)
+)
+handler_errors = Counter(
+    'bot_handler_errors_total', 'Обновления, завершившиеся исключением', ('handler',)
+)
+db_duration = Histogram(
+    'bot_db_operation_seconds', 'Время операций с базой (чтение из пула или групповая запись)', ('kind',)
+)
+api_duration = Histogram(
+    'bot_telegram_api_duration_seconds', 'Время вызовов Telegram API по методам', ('method',)
+)
+api_errors = Counter(
+    'bot_telegram_api_errors_total', 'Вызовы Telegram API, завершившиеся ошибкой', ('method',)
+)
+
+_collectors: List[GaugeCollector] = []
+
+
+def register_collector(collector: GaugeCollector):
+    """Добавить источник мгновенных значений (gauge) для выгрузки"""
+    _collectors.append(collector)
+
+
+def observe_db(kind: str, seconds: float):
+    """Учесть операцию с базой; вызывается из Database.timing_hook"""
+    db_duration.observe((kind,), seconds)
+    timings = _update_timings.get()
+    if timings is not None and timings['open']:
+        timings['db'] += seconds
+
+
+def observe_api(method: str, seconds: float, error: bool = False):
+    """Учесть вызов Telegram API"""
+    api_duration.observe((method,), seconds)
+    if error:
+        api_errors.inc((method,))
+    timings = _update_timings.get()
+    if timings is not None and timings['open']:
+        timings['api'] += seconds
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Измеряет время и ошибки каждого обработчика
+
+    Регистрируется как внутренняя middleware (dp.message.middleware(...)),
+    где обработчик уже выбран. Время запросов к базе и к Telegram API,
+    сделанных внутри обновления, считается отдельно. Фоновые задачи,
+    запущенные обработчиком, во время обновления не попадают.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get('handler')
+        name = getattr(handler_object.callback, '__name__', 'unknown') if handler_object else 'unknown'
+        timings = {'db': 0.0, 'api': 0.0, 'open': True}
+        token = _update_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc((name,))
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            timings['open'] = False
+            _update_timings.reset(token)
+            handler_duration.observe((name,), elapsed)
+            handler_db_time.observe((name,), timings['db'])
+            handler_api_time.observe((name,), timings['api'])
+
+
+class TelegramApiTimer(BaseRequestMiddleware):
+    """Middleware сессии бота: время каждого вызова Telegram API"""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        error = False
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            error = True
+            raise
+        finally:
+            observe_api(type(method).__name__, time.perf_counter() - started, error)
+
+
+def render_prometheus() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines: List[str] = []
+    for metric in (handler_duration, handler_db_time, handler_api_time, handler_errors,
+                   db_duration, api_duration, api_errors):
+        lines.extend(metric.render())
+
+    gauges: Dict[str, Tuple[str, List[str]]] = {}
+    for collector in _collectors:
+        try:
+            for name, help_text, labels, value in collector():
+                if value is None:
+                    continue
+                gauges.setdefault(name, (help_text, []))[1].append(
+                    f"{name}{_format_labels(labels)} {value:g}"
+                )
+        except Exception as e:
+            logger.error("Ошибка сборщика метрик: %s", e)
+    for name, (help_text, samples) in gauges.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+def handler_summary(limit: int = 15) -> str:
+    """Краткая сводка по обработчикам: вызовы, ошибки, p50/p95 и доля базы и API"""
+    rows = []
+    for labels, (_, total, count) in handler_duration.series().items():
+        db_total = handler_db_time.series().get(labels, [None, 0.0])[1]
+        api_total = handler_api_time.series().get(labels, [None, 0.0])[1]
+        rows.append((total, labels[0], count, handler_errors.get(labels),
+                     handler_duration.quantile(labels, 0.5), handler_duration.quantile(labels, 0.95),
+                     db_total, api_total))
+    rows.sort(reverse=True)
+
+    lines = []
+    for total, name, count, errors, p50, p95, db_total, api_total in rows[:limit]:
+        lines.append(
+            f"{name}: {count} выз., ошибок {errors:g}, p50 ≤{p50 * 1000:g} мс, p95 ≤{p95 * 1000:g} мс, "
+            f"база {db_total / total:.0%}, API {api_total / total:.0%}" if total else f"{name}: {count} выз."
+        )
+    return '\n'.join(lines)
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """GET /metrics"""
+    return web.Response(text=render_prometheus(), content_type='text/plain', charset='utf-8')
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    """Поднять локальный HTTP-сервер с /metrics; при port = 0 ничего не делает"""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
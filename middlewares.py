@@ -0,0 +1,57 @@
+"""
+Middleware для диспетчера бота
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from log_config import log_handler, log_user_id
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """Ограничивает число одновременно обрабатываемых обновлений
+
+    Обновления сверх лимита ждут своей очереди, а не запускаются все
+    разом при всплеске нагрузки.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        self.max_concurrent_updates = max(1, max_concurrent_updates)
+        self._semaphore = asyncio.Semaphore(self.max_concurrent_updates)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with self._semaphore:
+            return await handler(event, data)
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Передает в логи id пользователя и имя обработчика текущего обновления
+
+    Регистрируется как внутренняя middleware (dp.message.middleware(...)),
+    где обработчик уже выбран и лежит в data['handler'].
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        handler_object = data.get('handler')
+        user_token = log_user_id.set(user.id if user else None)
+        handler_token = log_handler.set(
+            getattr(handler_object.callback, '__name__', None) if handler_object else None
+        )
+        try:
+            return await handler(event, data)
+        finally:
+            log_handler.reset(handler_token)
+            log_user_id.reset(user_token)
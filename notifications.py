@@ -0,0 +1,275 @@
+"""
+Очередь исходящих сообщений с учетом лимитов Telegram
+"""
+import asyncio
+import contextvars
+import itertools
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько сообщений в секунду бот отправляет всем чатам вместе (лимит Telegram ~30)
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '25'))
+
+# Сколько сообщений в секунду можно отправить в один чат и какой всплеск допустим
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', '3'))
+
+# Число фоновых отправителей
+NOTIFY_WORKERS = int(os.getenv('NOTIFY_WORKERS', '4'))
+
+# Сколько раз повторять отправку при 429, сетевых ошибках и ошибках сервера Telegram
+NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', '5'))
+
+# Приоритеты: личные уведомления обгоняют рассылки
+PRIORITY_NOTIFICATION = 0
+PRIORITY_BROADCAST = 1
+
+# Итог отправки одного сообщения
+SENT = 'sent'
+BLOCKED = 'blocked'
+FAILED = 'failed'
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def reserve(self) -> float:
+        """Забрать токен и вернуть, сколько секунд подождать перед отправкой
+
+        Токен списывается сразу (баланс может уйти в минус), поэтому
+        параллельные отправители получают разные задержки и не
+        стартуют одновременно.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def is_full(self) -> bool:
+        elapsed = time.monotonic() - self.updated_at
+        return self.tokens + elapsed * self.rate >= self.capacity
+
+
+class NotificationScheduler:
+    """Фоновая отправка сообщений другим пользователям
+
+    Обработчик ставит сообщение в очередь и сразу отвечает нажавшему,
+    не дожидаясь доставки второму участнику. Несколько фоновых задач
+    разбирают очередь, соблюдая общий лимит бота и лимит на один чат
+    (ведра токенов). На 429 вся отправка приостанавливается на
+    retry_after секунд, сетевые ошибки и 5xx повторяются с
+    экспоненциальной задержкой. Заблокировавшие бота пользователи не
+    повторяются.
+
+    Задачи запускаются при первом сообщении; close() дожидается
+    отправки того, что уже в очереди, включая отложенные повторы.
+    """
+
+    def __init__(self, bot: Bot, workers: int = NOTIFY_WORKERS,
+                 global_rate: float = TELEGRAM_GLOBAL_RATE,
+                 chat_rate: float = TELEGRAM_CHAT_RATE,
+                 chat_burst: int = TELEGRAM_CHAT_BURST,
+                 max_attempts: int = NOTIFY_MAX_ATTEMPTS):
+        self.bot = bot
+        self.workers = max(1, workers)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max(1, max_attempts)
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks = []
+        self._seq = itertools.count()
+        # Повторы, ждущие своей задержки вне очереди: {seq: (таймер, приоритет, задание)}
+        self._delayed: Dict[int, Tuple[asyncio.TimerHandle, int, Dict[str, Any]]] = {}
+        # Момент (loop.time()), до которого Telegram попросил ничего не отправлять
+        self._paused_until = 0.0
+        self._stats = {
+            'queued': 0,
+            'sent': 0,
+            'blocked': 0,
+            'failed': 0,
+            'retries': 0,
+            'rate_limited': 0,
+        }
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            # Задачи запускаются в чистом контексте, а не в контексте обновления,
+            # которое их создало: иначе логи и метрики приписывались бы ему
+            self._tasks = [
+                contextvars.Context().run(asyncio.create_task, self._worker())
+                for _ in range(self.workers)
+            ]
+
+    def submit(self, chat_id: int, text: str, priority: int = PRIORITY_NOTIFICATION,
+               **kwargs: Any) -> asyncio.Future:
+        """Поставить sendMessage в очередь; future получит SENT, BLOCKED или FAILED"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        job = {'chat_id': chat_id, 'text': text, 'kwargs': kwargs, 'future': future, 'attempt': 0}
+        self._queue.put_nowait((priority, next(self._seq), job))
+        self._stats['queued'] += 1
+        return future
+
+    def send_message(self, chat_id: int, text: str, **kwargs: Any):
+        """Отправить сообщение в фоне, не дожидаясь результата"""
+        self.submit(chat_id, text, **kwargs)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Полные ведра ничем не отличаются от новых - выбрасываем их, чтобы словарь не рос
+            if len(self._chat_buckets) >= 10000:
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.is_full()
+                }
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _wait_for_slot(self, chat_id: int):
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(self._chat_bucket(chat_id).reserve())
+        while True:
+            pause = self._paused_until - loop.time()
+            if pause <= 0:
+                break
+            await asyncio.sleep(pause)
+        await asyncio.sleep(self._global_bucket.reserve())
+
+    async def _worker(self):
+        while True:
+            priority, seq, job = await self._queue.get()
+            if job['future'].cancelled():
+                # Отправитель передумал (например, рассылку остановили)
+                self._queue.task_done()
+                continue
+            try:
+                await self._wait_for_slot(job['chat_id'])
+                outcome = await self._deliver(job, priority)
+                if outcome is not None:
+                    self._stats[outcome] += 1
+                    if not job['future'].done():
+                        job['future'].set_result(outcome)
+            except asyncio.CancelledError:
+                if not job['future'].done():
+                    job['future'].cancel()
+                raise
+            except Exception as e:
+                logger.error("Ошибка очереди уведомлений: %s", e)
+                self._stats[FAILED] += 1
+                if not job['future'].done():
+                    job['future'].set_result(FAILED)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, job: Dict[str, Any], priority: int) -> Optional[str]:
+        """Одна попытка отправки; None означает, что сообщение снова в очереди"""
+        chat_id = job['chat_id']
+        job['attempt'] += 1
+        try:
+            await self.bot.send_message(chat_id, job['text'], **job['kwargs'])
+            return SENT
+        except TelegramRetryAfter as e:
+            self._stats['rate_limited'] += 1
+            loop = asyncio.get_running_loop()
+            self._paused_until = max(self._paused_until, loop.time() + e.retry_after)
+            logger.warning("Telegram просит подождать %s с (чат %s)", e.retry_after, chat_id)
+            delay = 0.0
+        except TelegramForbiddenError:
+            logger.info("Пользователь %s заблокировал бота, сообщение не доставлено", chat_id)
+            return BLOCKED
+        except (TelegramNetworkError, TelegramServerError) as e:
+            delay = min(60.0, 2.0 ** job['attempt'])
+            logger.warning("Не удалось отправить сообщение %s (попытка %s): %s", chat_id, job['attempt'], e)
+        except Exception as e:
+            logger.error("Не удалось отправить сообщение %s: %s", chat_id, e)
+            return FAILED
+
+        if job['attempt'] >= self.max_attempts:
+            logger.error("Сообщение %s не доставлено за %s попыток", chat_id, job['attempt'])
+            return FAILED
+
+        self._stats['retries'] += 1
+        if delay:
+            # Ждем вне воркера, чтобы он тем временем отправлял другим
+            seq = next(self._seq)
+            handle = asyncio.get_running_loop().call_later(delay, self._requeue_delayed, seq)
+            self._delayed[seq] = (handle, priority, job)
+        else:
+            self._requeue(priority, job)
+        return None
+
+    def _requeue_delayed(self, seq: int):
+        _, priority, job = self._delayed.pop(seq)
+        self._requeue(priority, job)
+
+    def _flush_delayed(self):
+        """Поставить все отложенные повторы в очередь сразу, отменив их таймеры"""
+        for handle, priority, job in self._delayed.values():
+            handle.cancel()
+            self._requeue(priority, job)
+        self._delayed.clear()
+
+    def _requeue(self, priority: int, job: Dict[str, Any]):
+        if self._queue is not None:
+            self._queue.put_nowait((priority, next(self._seq), job))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Счетчики очереди"""
+        return {
+            **self._stats,
+            'pending': (self._queue.qsize() if self._queue is not None else 0) + len(self._delayed),
+            'paused_for': max(0.0, self._paused_until - asyncio.get_running_loop().time()),
+        }
+
+    async def close(self, timeout: float = 10.0):
+        """Дождаться отправки очереди (не дольше timeout секунд) и остановить задачи"""
+        if self._queue is None:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            # queue.join() не ждет повторов, отложенных таймером: ставим их в очередь сейчас
+            self._flush_delayed()
+            try:
+                await asyncio.wait_for(self._queue.join(), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                self._flush_delayed()
+                logger.warning("Не отправлено при остановке: %s сообщений", self._queue.qsize())
+                # Отправители, ждущие результат, узнают, что сообщение не ушло
+                while not self._queue.empty():
+                    _, _, job = self._queue.get_nowait()
+                    if not job['future'].done():
+                        job['future'].cancel()
+                break
+            # Пока очередь разбиралась, новая попытка могла снова уйти в отложенные
+            if not self._delayed:
+                break
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
@@ -0,0 +1,283 @@
+"""
+Профилирование SQL-запросов базы данных
+"""
+import logging
+import os
+import re
+import sys
+import time
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# Включить профилирование запросов Database (0 - выключено)
+DATABASE_PROFILE = os.getenv('DATABASE_PROFILE', '0') not in ('', '0', 'false', 'no')
+
+# Запросы дольше этого порога (в миллисекундах) пишутся в лог вместе с планом выполнения
+DATABASE_SLOW_QUERY_MS = float(os.getenv('DATABASE_SLOW_QUERY_MS', '100'))
+
+# Для каких запросов можно получить EXPLAIN QUERY PLAN
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def normalize_sql(sql: str) -> str:
+    """Форма запроса: без лишних пробелов, литералы заменены на ?, списки ? свернуты
+
+    Запросы, собранные f-строкой с подставленными числами или списком
+    IN (...) разной длины, попадают в одну строку отчета.
+    """
+    shape = _WHITESPACE.sub(' ', sql).strip()
+    shape = _STRING_LITERAL.sub('?', shape)
+    shape = _NUMBER_LITERAL.sub('?', shape)
+    return _PLACEHOLDER_LIST.sub('?, ...', shape)
+
+
+def _caller() -> str:
+    """Метод, из которого выполнен запрос (например, Database.get_user)
+
+    Операции записи объявлены внутри методов (Database.add_user.<locals>.op)
+    и выполняются фоновой задачей, поэтому берется объемлющий метод.
+    """
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    if frame is None:
+        return 'unknown'
+    return frame.f_code.co_qualname.split('.<locals>', 1)[0]
+
+
+class _QueryStats:
+    """Накопленная статистика одной формы запроса из одного метода"""
+    __slots__ = ('calls', 'total', 'max', 'rows', 'slow')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.slow = 0
+
+
+class QueryProfiler:
+    """Статистика по каждому запросу Database
+
+    Соединения оборачиваются методом wrap(): execute, executemany и commit
+    замеряются, а курсор досчитывает время и число строк при выборке.
+    Статистика копится по паре (форма запроса, метод Database). Запрос
+    дольше slow_ms пишется в лог один раз за выполнение, с планом
+    EXPLAIN QUERY PLAN (план каждой формы запрашивается однажды).
+
+    Профилирование добавляет накладные расходы на каждый запрос, поэтому
+    включается явно: DATABASE_PROFILE=1.
+    """
+
+    def __init__(self, slow_ms: float = DATABASE_SLOW_QUERY_MS, explain: bool = True):
+        self.slow = slow_ms / 1000
+        self.explain = explain
+        self._stats: Dict[Tuple[str, str], _QueryStats] = {}
+        self._plans: Dict[str, str] = {}
+        self._started_at = time.monotonic()
+
+    def wrap(self, conn: aiosqlite.Connection) -> 'ProfiledConnection':
+        return ProfiledConnection(conn, self)
+
+    def _entry(self, shape: str, caller: str) -> _QueryStats:
+        entry = self._stats.get((shape, caller))
+        if entry is None:
+            entry = self._stats[(shape, caller)] = _QueryStats()
+        return entry
+
+    async def _report_slow(self, conn: aiosqlite.Connection, sql: str, params: Any,
+                           shape: str, caller: str, elapsed: float, rows: int):
+        plan = self._plans.get(shape)
+        if plan is None and self.explain and shape.lstrip('( ').upper().startswith(_EXPLAINABLE):
+            try:
+                cursor = await conn.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())
+                plan = '\n'.join(f"  {row[3]}" for row in await cursor.fetchall())
+            except Exception as e:
+                plan = f"  (план недоступен: {e})"
+            self._plans[shape] = plan
+        logger.warning(
+            "Медленный запрос: %.1f мс, строк %s, %s\n%s%s",
+            elapsed * 1000, rows, caller, shape, f"\n{plan}" if plan else ''
+        )
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Статистика по всем запросам, по убыванию суммарного времени"""
+        rows = [
+            {
+                'caller': caller,
+                'sql': shape,
+                'calls': entry.calls,
+                'total_ms': entry.total * 1000,
+                'avg_ms': entry.total * 1000 / entry.calls if entry.calls else 0.0,
+                'max_ms': entry.max * 1000,
+                'rows': entry.rows,
+                'slow': entry.slow,
+            }
+            for (shape, caller), entry in self._stats.items()
+        ]
+        rows.sort(key=lambda row: row['total_ms'], reverse=True)
+        return rows
+
+    def report(self, limit: int = 20, sql_width: int = 200) -> str:
+        """Текстовый отчет: top-N запросов по суммарному времени"""
+        stats = self.get_stats()
+        total_ms = sum(row['total_ms'] for row in stats) or 1.0
+        lines = [
+            f"Запросов: {sum(row['calls'] for row in stats)}, форм: {len(stats)}, "
+            f"время в базе: {total_ms:.0f} мс за {time.monotonic() - self._started_at:.0f} с",
+            "",
+        ]
+        for row in stats[:limit]:
+            sql = row['sql'] if len(row['sql']) <= sql_width else row['sql'][:sql_width] + '…'
+            lines.append(
+                f"{row['total_ms']:9.1f} мс {row['total_ms'] / total_ms:4.0%}  "
+                f"{row['calls']:6d} выз.  ср. {row['avg_ms']:.2f}  макс. {row['max_ms']:.1f}  "
+                f"строк {row['rows']}  медл. {row['slow']}  {row['caller']}"
+            )
+            lines.append(f"    {sql}")
+        return '\n'.join(lines)
+
+    def reset(self):
+        """Обнулить статистику (планы запросов остаются)"""
+        self._stats = {}
+        self._started_at = time.monotonic()
+
+
+class ProfiledCursor:
+    """Курсор, который досчитывает время и строки выборки к своему запросу"""
+
+    def __init__(self, cursor: aiosqlite.Cursor, conn: 'ProfiledConnection', sql: str,
+                 params: Any, shape: str, caller: str, entry: _QueryStats, elapsed: float):
+        self._cursor = cursor
+        self._conn = conn
+        self._sql = sql
+        self._params = params
+        self._shape = shape
+        self._caller = caller
+        self._entry = entry
+        self._elapsed = elapsed
+        self._rows = 0
+        self._reported = False
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    async def _account(self, seconds: float, rows: int, check: bool = True):
+        self._elapsed += seconds
+        self._rows += rows
+        entry = self._entry
+        entry.total += seconds
+        entry.max = max(entry.max, self._elapsed)
+        entry.rows += rows
+        if check:
+            await self._check_slow()
+
+    async def _check_slow(self):
+        profiler = self._conn.profiler
+        if self._reported or self._elapsed < profiler.slow:
+            return
+        self._reported = True
+        self._entry.slow += 1
+        await profiler._report_slow(self._conn.raw, self._sql, self._params, self._shape,
+                                    self._caller, self._elapsed, self._rows)
+
+    async def fetchone(self):
+        started = time.perf_counter()
+        row = await self._cursor.fetchone()
+        await self._account(time.perf_counter() - started, row is not None)
+        return row
+
+    async def fetchmany(self, size: Optional[int] = None):
+        started = time.perf_counter()
+        rows = await (self._cursor.fetchmany() if size is None else self._cursor.fetchmany(size))
+        await self._account(time.perf_counter() - started, len(rows))
+        return rows
+
+    async def fetchall(self):
+        started = time.perf_counter()
+        rows = await self._cursor.fetchall()
+        await self._account(time.perf_counter() - started, len(rows))
+        return rows
+
+    async def __aiter__(self):
+        iterator = self._cursor.__aiter__()
+        while True:
+            started = time.perf_counter()
+            try:
+                row = await iterator.__anext__()
+            except StopAsyncIteration:
+                await self._account(time.perf_counter() - started, 0)
+                return
+            await self._account(time.perf_counter() - started, 1)
+            yield row
+
+
+class ProfiledConnection:
+    """Обертка над aiosqlite.Connection, замеряющая каждый запрос
+
+    Все, кроме execute, executemany и commit, передается исходному
+    соединению без изменений.
+    """
+
+    def __init__(self, conn: aiosqlite.Connection, profiler: QueryProfiler):
+        self.raw = conn
+        self.profiler = profiler
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.raw, name)
+
+    async def execute(self, sql: str, parameters: Optional[Iterable[Any]] = None) -> ProfiledCursor:
+        caller = _caller()
+        shape = normalize_sql(sql)
+        started = time.perf_counter()
+        cursor = await self.raw.execute(sql, parameters)
+        elapsed = time.perf_counter() - started
+
+        entry = self.profiler._entry(shape, caller)
+        entry.calls += 1
+        profiled = ProfiledCursor(cursor, self, sql, parameters, shape, caller, entry, 0.0)
+        if cursor.description is None:
+            # Изменяющий запрос: строки - это затронутые строки, проверяем порог сразу
+            await profiled._account(elapsed, max(cursor.rowcount, 0))
+        else:
+            # SELECT: строки и время выборки досчитает курсор, порог проверим после нее
+            await profiled._account(elapsed, 0, check=False)
+        return profiled
+
+    async def executemany(self, sql: str, parameters: Iterable[Iterable[Any]]) -> ProfiledCursor:
+        caller = _caller()
+        # Префикс отличает пакетную форму в отчете; план для нее не запрашивается
+        shape = 'EXECUTEMANY ' + normalize_sql(sql)
+        started = time.perf_counter()
+        cursor = await self.raw.executemany(sql, parameters)
+        elapsed = time.perf_counter() - started
+
+        entry = self.profiler._entry(shape, caller)
+        entry.calls += 1
+        profiled = ProfiledCursor(cursor, self, sql, None, shape, caller, entry, 0.0)
+        await profiled._account(elapsed, max(cursor.rowcount, 0))
+        return profiled
+
+    async def commit(self):
+        caller = _caller()
+        started = time.perf_counter()
+        await self.raw.commit()
+        elapsed = time.perf_counter() - started
+        entry = self.profiler._entry('COMMIT', caller)
+        entry.calls += 1
+        entry.total += elapsed
+        entry.max = max(entry.max, elapsed)
+        if elapsed >= self.profiler.slow:
+            entry.slow += 1
+            logger.warning("Медленный коммит: %.1f мс, %s", elapsed * 1000, caller)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Воспроизведение записанных обновлений через настоящий Dispatcher
+
+Читает запись UpdateRecorderMiddleware (RECORD_UPDATES_PATH, gzip JSONL) и
+подает обновления в dp.feed_raw_update бота, запущенного в этом же
+процессе. Bot API заменен заглушкой из load_test.py, база - временная
+(пустая или копия --database). В записи id участников заменены, поэтому
+копия --database обезличивается тем же секретом (--salt, по умолчанию
+RECORD_UPDATES_SALT), что и запись; без секрета участники записи не
+найдут своих анкет, и верно воспроизводится только старт с пустой базы.
+Обновления идут с записанными интервалами,
+ускоренными в --speed раз, или так быстро, как бот успевает (--speed max);
+обновления одного участника обрабатываются строго по порядку. В конце
+печатаются задержки по видам обновлений и сводка по обработчикам.
+
+Примеры:
+    python replay.py opening.jsonl.gz                  # в реальном темпе
+    python replay.py opening.jsonl.gz --speed 10       # в 10 раз быстрее
+    RECORD_UPDATES_SALT=... python replay.py opening.jsonl.gz --speed max --database forum.db --json result.json
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from load_test import FakeTelegramServer, LoadStats, percentile, start_bot
+from update_recorder import RECORD_UPDATES_SALT, Anonymizer, anonymize_database
+
+# Паузы в записи длиннее этой (в секундах записи) сокращаются до нее
+DEFAULT_MAX_GAP = 10.0
+
+# Разделы обновления, в которых лежит его отправитель
+_EVENT_KEYS = ('message', 'edited_message', 'callback_query', 'inline_query', 'my_chat_member',
+               'chat_member', 'pre_checkout_query', 'shipping_query', 'poll_answer')
+
+
+def load_recording(path: str) -> List[Tuple[float, Dict[str, Any]]]:
+    """Пары (время получения, обновление) по возрастанию времени"""
+    records = []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records.append((record['t'], record['update']))
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+def update_kind(update: Dict[str, Any]) -> str:
+    """Вид обновления для отчета: команда, текст, фото или callback_data без id"""
+    if 'callback_query' in update:
+        data = update['callback_query'].get('data') or ''
+        return 'cb:' + re.sub(r'\d+$', '*', data)
+    message = update.get('message')
+    if message is not None:
+        text = message.get('text') or ''
+        if text.startswith('/'):
+            return text.split()[0].split('@')[0]
+        if 'photo' in message:
+            return 'photo'
+        return 'text' if text else 'message'
+    return next((key for key in update if key != 'update_id'), 'unknown')
+
+
+def update_sender(update: Dict[str, Any]) -> Optional[int]:
+    for key in _EVENT_KEYS:
+        event = update.get(key)
+        if event is not None:
+            sender = event.get('from') or event.get('user') or event.get('chat')
+            return sender.get('id') if sender else None
+    return None
+
+
+def schedule(records: List[Tuple[float, Dict[str, Any]]], speed: Optional[float],
+             max_gap: float) -> List[float]:
+    """Смещение каждого обновления от начала воспроизведения, в секундах
+
+    speed = None - без пауз. Долгие паузы (перезапуск бота, ночь) сокращаются
+    до max_gap, чтобы не ждать их впустую.
+    """
+    if speed is None:
+        return [0.0] * len(records)
+    offsets = []
+    offset = 0.0
+    previous = records[0][0] if records else 0.0
+    for t, _ in records:
+        offset += min(max(t - previous, 0.0), max_gap)
+        previous = t
+        offsets.append(offset / speed)
+    return offsets
+
+
+def parse_speed(value: str) -> Optional[float]:
+    if value == 'max':
+        return None
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("скорость должна быть больше нуля или 'max'")
+    return speed
+
+
+def prepare_database(source: str, salt: str, workdir: str) -> str:
+    """Копия базы, обезличенная так же, как запись"""
+    path = os.path.join(workdir, 'anonymized.db')
+    # backup, а не копирование файла: в копию попадает и то, что еще в WAL
+    with sqlite3.connect(source) as src, sqlite3.connect(path) as dst:
+        src.backup(dst)
+    anonymize_database(path, Anonymizer(salt.encode()))
+    return path
+
+
+async def run_replay(options: argparse.Namespace) -> Dict[str, Any]:
+    records = load_recording(options.recording)
+    if options.limit:
+        records = records[:options.limit]
+    if not records:
+        raise SystemExit(f"❌ В {options.recording} нет обновлений")
+    offsets = schedule(records, options.speed, options.max_gap)
+
+    server = FakeTelegramServer(api_latency=options.api_latency_ms / 1000)
+    runner = web.AppRunner(server.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, options.host, options.port).start()
+    api_url = f'http://{options.host}:{options.port}'
+
+    # Воспроизведение не должно записывать само себя
+    os.environ['RECORD_UPDATES_PATH'] = ''
+    workdir = tempfile.mkdtemp(prefix='replay_')
+    bot_app = bot_task = None
+    try:
+        database = options.database
+        if database and options.salt:
+            database = prepare_database(database, options.salt, workdir)
+        elif database:
+            print("⚠️ Секрет записи не задан (--salt или RECORD_UPDATES_SALT): участники записи не найдут "
+                  "своих анкет в копии базы, и обновления пойдут по пути регистрации")
+        bot_app, bot_task, _ = await start_bot(api_url, database, workdir)
+        await server.polling_started.wait()
+
+        stats = LoadStats()
+        errors: Counter = Counter()
+        lag: List[float] = []
+        locks: Dict[Optional[int], asyncio.Lock] = {}
+
+        async def feed(update: Dict[str, Any], due: float):
+            sender = update_sender(update)
+            lock = locks.setdefault(sender, asyncio.Lock()) if sender is not None else asyncio.Lock()
+            async with lock:
+                started = time.perf_counter()
+                lag.append(max(0.0, started - due))
+                kind = update_kind(update)
+                try:
+                    await bot_app.dp.feed_raw_update(bot_app.bot, update)
+                except Exception:
+                    errors[kind] += 1
+                stats.record(kind, time.perf_counter() - started)
+
+        speed_label = 'max' if options.speed is None else f"{options.speed:g}×"
+        span = records[-1][0] - records[0][0]
+        print(f"Обновлений: {len(records)}, длительность записи {span:.0f} с, скорость {speed_label}")
+
+        started = time.perf_counter()
+        tasks = []
+        for (_, update), offset in zip(records, offsets):
+            delay = started + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(feed(update, started + offset)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+        lag.sort()
+        from metrics import handler_summary
+        return {
+            'recording': options.recording,
+            'speed': speed_label,
+            'updates': len(records),
+            'recorded_span_s': round(span, 3),
+            'elapsed_s': round(elapsed, 3),
+            'updates_per_sec': round(len(records) / elapsed, 1) if elapsed else None,
+            'lag_p95_ms': round(percentile(lag, 0.95) * 1000, 2),
+            'lag_max_ms': round(lag[-1] * 1000, 2),
+            'errors': dict(errors),
+            'api_calls': dict(server.calls),
+            'api_errors': dict(server.errors),
+            **stats.summary(),
+            'handlers': handler_summary(limit=30),
+        }
+    finally:
+        if bot_app is not None:
+            try:
+                await bot_app.dp.stop_polling()
+            except RuntimeError:
+                pass
+            await asyncio.gather(bot_task, return_exceptions=True)
+        await runner.cleanup()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_report(result: Dict[str, Any]):
+    def row(name: str, entry: Dict[str, Any]) -> str:
+        return (f"{name:<24} {entry['count']:>8} {entry['p50_ms']:>9.1f} {entry['p95_ms']:>9.1f} "
+                f"{entry['p99_ms']:>9.1f} {entry['max_ms']:>9.1f}")
+
+    print()
+    print(f"Обработано {result['updates']} обновлений за {result['elapsed_s']} с "
+          f"({result['updates_per_sec']} в секунду), запись длилась {result['recorded_span_s']} с")
+    print(f"Ожидание начала обработки (после момента по графику): "
+          f"p95 {result['lag_p95_ms']} мс, макс. {result['lag_max_ms']} мс")
+    print()
+    print(f"{'обновление':<24} {'штук':>8} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'макс, мс':>9}")
+    steps = sorted(result['steps'].items(), key=lambda item: item[1]['count'], reverse=True)
+    for kind, entry in steps:
+        print(row(kind, entry))
+    print(row('всего', result['overall']))
+    if result['errors']:
+        print(f"\nОшибки обработки: {result['errors']}")
+    if result['api_errors']:
+        print(f"Ошибки API (400): {result['api_errors']}")
+    print(f"Вызовы API: {result['api_calls']}")
+    print(f"\nОбработчики (метрики бота):\n{result['handlers']}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных обновлений")
+    parser.add_argument('recording', help="файл записи (RECORD_UPDATES_PATH)")
+    parser.add_argument('--speed', type=parse_speed, default=1.0,
+                        help="во сколько раз быстрее записи, 'max' - без пауз")
+    parser.add_argument('--max-gap', type=float, default=DEFAULT_MAX_GAP,
+                        help="паузы длиннее (в секундах записи) сокращаются до этой")
+    parser.add_argument('--limit', type=int, default=0, help="воспроизвести только первые N обновлений")
+    parser.add_argument('--api-latency-ms', type=float, default=0.0, help="задержка каждого ответа заглушки")
+    parser.add_argument('--database', help="файл базы, с копии которого начинать (по умолчанию пустая база); "
+                                           "копия обезличивается секретом --salt, без него верно "
+                                           "воспроизводится только старт с пустой базы")
+    parser.add_argument('--salt', default=RECORD_UPDATES_SALT,
+                        help="секрет, с которым сделана запись (по умолчанию RECORD_UPDATES_SALT)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--json', help="записать результат в JSON-файл")
+    return parser.parse_args()
+
+
+def main():
+    options = parse_args()
+    result = asyncio.run(run_replay(options))
+    print_report(result)
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультат записан в {options.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Тесты рассылок организаторов
+"""
+import asyncio
+
+from broadcast import BroadcastRunner
+from database import Database
+from notifications import SENT
+
+
+class InstantNotifier:
+    """Очередь, которая доставляет сообщение сразу"""
+
+    def __init__(self):
+        self.sent = []
+
+    def submit(self, chat_id, text, **kwargs):
+        self.sent.append(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(SENT)
+        return future
+
+
+def test_broadcast_that_fails_is_marked_failed_and_reported(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'test.db'))
+        await db.open()
+        try:
+            for telegram_id in range(1, 6):
+                await db.add_user(telegram_id, f'Участник {telegram_id}', 'Москва', 'Инженер', '')
+            broadcast_id = await db.create_broadcast('Объявление', created_by=1)
+            await db.set_broadcast_status(broadcast_id, 'running', expected_status='draft')
+
+            # Вторая пачка не сохраняется: база недоступна
+            save_progress = db.save_broadcast_progress
+            calls = []
+            async def failing_save(*args):
+                calls.append(args)
+                if len(calls) > 1:
+                    raise RuntimeError("disk I/O error")
+                return await save_progress(*args)
+            db.save_broadcast_progress = failing_save
+
+            reports = []
+            async def on_finish(broadcast):
+                reports.append(broadcast)
+
+            runner = BroadcastRunner(db, InstantNotifier(), batch_size=2)
+            runner.start(broadcast_id, on_finish)
+            await asyncio.sleep(0.2)
+            return await db.get_broadcast(broadcast_id), reports, runner.is_running(broadcast_id)
+        finally:
+            await db.close()
+
+    broadcast, reports, running = asyncio.run(main())
+
+    assert not running
+    assert broadcast['status'] == 'failed'
+    assert broadcast['finished_at'] is not None
+    # Прогресс остался на последней сохраненной пачке
+    assert broadcast['last_telegram_id'] == 2 and broadcast['delivered'] == 2
+    assert [report['status'] for report in reports] == ['failed']
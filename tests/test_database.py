@@ -0,0 +1,186 @@
+"""
+Тесты Database на временной базе
+"""
+import asyncio
+
+import pytest
+
+from database import Database
+
+
+def run_with_db(tmp_path, scenario, **kwargs):
+    """Открыть Database во временном файле, выполнить scenario(db) и закрыть"""
+    async def main():
+        db = Database(str(tmp_path / 'test.db'), **kwargs)
+        await db.open()
+        try:
+            return await scenario(db)
+        finally:
+            await db.close()
+    return asyncio.run(main())
+
+
+async def add_users(db: Database, *users):
+    for telegram_id, name, branch, job_title, about in users:
+        assert await db.add_user(telegram_id, name, branch, job_title, about)
+
+
+def test_failed_write_rolls_back_only_its_savepoint(tmp_path):
+    async def scenario(db):
+        async def good(conn):
+            await conn.execute("""
+                INSERT INTO users (telegram_id, name, branch, job_title, about, version)
+                VALUES (1, 'Анна', 'Москва', 'Инженер', '', 1)
+            """)
+            return 'ok'
+
+        async def bad(conn):
+            # Запись до ошибки должна откатиться вместе с операцией
+            await conn.execute("""
+                INSERT INTO users (telegram_id, name, branch, job_title, about, version)
+                VALUES (2, 'Иван', 'Москва', 'Юрист', '', 1)
+            """)
+            raise ValueError("сбой операции")
+
+        async def also_good(conn):
+            await conn.execute("""
+                INSERT INTO users (telegram_id, name, branch, job_title, about, version)
+                VALUES (3, 'Олег', 'Казань', 'Аналитик', '', 1)
+            """)
+            return 'ok'
+
+        results = await asyncio.gather(
+            db._submit_write(good), db._submit_write(bad), db._submit_write(also_good),
+            return_exceptions=True,
+        )
+        stats = db.get_write_stats()
+        return results, stats, await db.get_user(1), await db.get_user(2), await db.get_user(3)
+
+    results, stats, first, second, third = run_with_db(tmp_path, scenario, flush_interval_ms=50)
+
+    # Все три операции попали в одну транзакцию
+    assert stats['batches'] == 1 and stats['max_batch_size'] == 3
+    assert results[0] == 'ok' and results[2] == 'ok'
+    assert isinstance(results[1], ValueError)
+    assert first is not None and third is not None
+    assert second is None
+    assert stats['failed_ops'] == 1
+
+
+def test_write_before_open_is_rejected(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'test.db'))
+        async def op(conn):
+            return None
+        with pytest.raises(RuntimeError):
+            await db._submit_write(op)
+    asyncio.run(main())
+
+
+def test_fts_index_follows_update_replace_and_delete(tmp_path):
+    async def scenario(db):
+        await add_users(db,
+                        (1, 'Анна', 'Москва', 'Инженер', 'люблю шахматы'),
+                        (2, 'Иван', 'Казань', 'Юрист', 'играю на гитаре'))
+        found = {}
+        found['initial'] = await db.search_users_by_keywords('шахматы')
+
+        await db.update_user(1, about='увлекаюсь скалолазанием')
+        found['old_after_update'] = await db.search_users_by_keywords('шахматы')
+        found['new_after_update'] = await db.search_users_by_keywords('скалолазанием')
+
+        # Повторная регистрация идет через INSERT OR REPLACE (DELETE-триггеры)
+        await db.add_user(2, 'Иван', 'Казань', 'Юрист', 'пишу стихи')
+        found['old_after_replace'] = await db.search_users_by_keywords('гитаре')
+        found['new_after_replace'] = await db.search_users_by_keywords('стихи')
+
+        await db.delete_user(1)
+        found['after_delete'] = await db.search_users_by_keywords('скалолазанием')
+        return {name: [user['telegram_id'] for user in users] for name, users in found.items()}
+
+    found = run_with_db(tmp_path, scenario)
+
+    assert found == {
+        'initial': [1],
+        'old_after_update': [],
+        'new_after_update': [1],
+        'old_after_replace': [],
+        'new_after_replace': [2],
+        'after_delete': [],
+    }
+
+
+def test_substring_search_follows_updates(tmp_path):
+    async def scenario(db):
+        await add_users(db,
+                        (1, 'Александра', 'Санкт-Петербург', 'Инженер', ''),
+                        (2, 'Алексей', 'Москва', 'Юрист', ''))
+        found = {}
+        found['name'] = await db.search_users_by_name('ЛЕКС')
+        found['branch'] = await db.search_users_by_branch('петер')
+        # Короткий запрос индекс trigram не покрывает - он ищется перебором
+        found['short'] = await db.search_users_by_name('ей')
+
+        await db.update_user(1, name='Мария')
+        found['after_update'] = await db.search_users_by_name('лекс')
+        await db.delete_user(2)
+        found['after_delete'] = await db.search_users_by_name('лекс')
+        return {name: [user['telegram_id'] for user in users] for name, users in found.items()}
+
+    # Без токенизатора trigram тот же результат дает перебор
+    found = run_with_db(tmp_path, scenario)
+
+    assert found == {
+        'name': [1, 2],
+        'branch': [1],
+        'short': [2],
+        'after_update': [2],
+        'after_delete': [],
+    }
+
+
+def test_pending_likes_pages_cover_every_like_once(tmp_path):
+    async def scenario(db):
+        await add_users(db, (1, 'Анна', 'Москва', 'Инженер', ''))
+        senders = list(range(100, 125))
+        for sender in senders:
+            await add_users(db, (sender, f'Участник {sender}', 'Казань', 'Юрист', ''))
+            await db.like(sender, 1)
+        # Отвеченный и пропущенный интересы в выдачу не попадают
+        await db.like(1, 100)
+        await db.skip_like(1, 101)
+
+        pages, cursor = [], None
+        while True:
+            page, cursor = await db.get_pending_likes_page(1, cursor, limit=10)
+            pages.append([like['from_user_id'] for like in page])
+            if cursor is None:
+                break
+        return pages, await db.get_pending_likes_count(1)
+
+    pages, count = run_with_db(tmp_path, scenario)
+
+    # Лайки одной секунды различаются по id: страницы не теряют и не повторяют строк
+    assert [len(page) for page in pages] == [10, 10, 3]
+    shown = [sender for page in pages for sender in page]
+    assert shown == list(range(124, 101, -1))
+    assert count == 23
+
+
+def test_is_unseen_tracks_views_and_likes(tmp_path):
+    async def scenario(db):
+        await add_users(db,
+                        (1, 'Анна', 'Москва', 'Инженер', ''),
+                        (2, 'Иван', 'Москва', 'Юрист', ''),
+                        (3, 'Олег', 'Казань', 'Аналитик', ''))
+        before = await db.is_unseen(1, 2), await db.is_unseen(1, 3)
+        await db.add_view(1, 2)
+        await db.like(1, 3)
+        after = await db.is_unseen(1, 2), await db.is_unseen(1, 3)
+        return before, after, await db.is_unseen(2, 1)
+
+    before, after, other_viewer = run_with_db(tmp_path, scenario)
+
+    assert before == (True, True)
+    assert after == (False, False)
+    assert other_viewer is True
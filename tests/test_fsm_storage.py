@@ -0,0 +1,97 @@
+"""
+Тесты хранилища FSM в SQLite
+"""
+import asyncio
+import sqlite3
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import SQLiteStorage, pack_data, unpack_data
+
+KEY = StorageKey(bot_id=1, chat_id=42, user_id=42)
+
+
+def stored_rows(db_path: str):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT user_id, state FROM fsm_states").fetchall()
+
+
+def test_state_and_data_survive_close_and_reopen(tmp_path):
+    db_path = str(tmp_path / 'fsm.db')
+    about = 'о себе ' * 100  # длинные данные сохраняются сжатыми
+
+    async def main():
+        storage = SQLiteStorage(db_path, flush_interval_ms=60_000)
+        await storage.set_state(KEY, 'ProfileStates:waiting_for_about')
+        await storage.update_data(KEY, {'name': 'Анна', 'about': about})
+        # До close() фоновый сброс еще не наступил
+        rows_before_close = stored_rows(db_path)
+        await storage.close()
+
+        reopened = SQLiteStorage(db_path)
+        try:
+            return rows_before_close, await reopened.get_state(KEY), await reopened.get_data(KEY)
+        finally:
+            await reopened.close()
+
+    rows_before_close, state, data = asyncio.run(main())
+
+    assert rows_before_close == []
+    assert state == 'ProfileStates:waiting_for_about'
+    assert data == {'name': 'Анна', 'about': about}
+
+
+def test_clear_deletes_the_row_and_noop_clear_writes_nothing(tmp_path):
+    db_path = str(tmp_path / 'fsm.db')
+    other = StorageKey(bot_id=1, chat_id=7, user_id=7)
+
+    async def main():
+        storage = SQLiteStorage(db_path, flush_interval_ms=60_000)
+        await storage.set_state(KEY, 'SearchStates:browsing')
+        await storage._flush()
+        rows_after_set = stored_rows(db_path)
+
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        # У этого пользователя состояния не было: сбрасывать нечего
+        await storage.set_state(other, None)
+        await storage.set_data(other, {})
+        await storage.close()
+        return rows_after_set, stored_rows(db_path), storage.get_stats()
+
+    rows_after_set, rows_after_clear, stats = asyncio.run(main())
+
+    assert rows_after_set == [(42, 'SearchStates:browsing')]
+    assert rows_after_clear == []
+    assert stats['rows_written'] == 1
+    assert stats['rows_deleted'] == 1
+
+
+def test_expired_state_reads_as_empty(tmp_path):
+    db_path = str(tmp_path / 'fsm.db')
+
+    async def main():
+        storage = SQLiteStorage(db_path)
+        await storage.set_state(KEY, 'ProfileStates:waiting_for_name')
+        await storage.close()
+
+        expired = SQLiteStorage(db_path, ttl=-1)
+        try:
+            return await expired.get_state(KEY), await expired.get_data(KEY)
+        finally:
+            await expired.close()
+
+    assert asyncio.run(main()) == (None, {})
+
+
+def test_pack_data_round_trip():
+    small = {'name': 'Анна'}
+    large = {'about': 'текст ' * 200}
+
+    small_blob, small_compressed = pack_data(small)
+    large_blob, large_compressed = pack_data(large)
+
+    assert small_compressed == 0 and large_compressed == 1
+    assert unpack_data(small_blob, small_compressed) == small
+    assert unpack_data(large_blob, large_compressed) == large
+    assert pack_data({}) == (None, 0)
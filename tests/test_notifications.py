@@ -0,0 +1,83 @@
+"""
+Тесты очереди исходящих уведомлений
+"""
+import asyncio
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError
+from aiogram.methods import SendMessage
+
+from notifications import BLOCKED, SENT, NotificationScheduler
+
+
+class FakeBot:
+    """Бот, у которого первые failures отправок падают с ошибкой error"""
+
+    def __init__(self, failures: int = 0, error=TelegramNetworkError):
+        self.failures = failures
+        self.error = error
+        self.attempts = 0
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise self.error(method=SendMessage(chat_id=chat_id, text=text), message='сбой')
+        self.sent.append((chat_id, text))
+
+
+def make_scheduler(bot: FakeBot) -> NotificationScheduler:
+    return NotificationScheduler(bot, global_rate=1000, chat_rate=1000, chat_burst=10)
+
+
+def test_close_delivers_retries_waiting_for_their_delay():
+    async def main():
+        bot = FakeBot(failures=2)
+        scheduler = make_scheduler(bot)
+        future = scheduler.submit(42, 'Новый интерес')
+        # Первая попытка упала, повтор ждет таймера (2 с) вне очереди
+        await asyncio.sleep(0.05)
+        pending = scheduler.get_stats()['pending']
+        started = asyncio.get_running_loop().time()
+        await scheduler.close(timeout=5)
+        elapsed = asyncio.get_running_loop().time() - started
+        return bot, future, pending, elapsed, scheduler._stats
+
+    bot, future, pending, elapsed, stats = asyncio.run(main())
+
+    assert pending == 1
+    assert future.result() == SENT
+    assert bot.sent == [(42, 'Новый интерес')]
+    assert stats['retries'] == 2
+    # Повторы не ждали своих задержек (2 с и 4 с)
+    assert elapsed < 1
+
+
+def test_blocked_user_is_not_retried():
+    async def main():
+        bot = FakeBot(failures=1, error=TelegramForbiddenError)
+        scheduler = make_scheduler(bot)
+        future = scheduler.submit(42, 'Новый интерес')
+        result = await asyncio.wait_for(future, 1)
+        await scheduler.close()
+        return bot, result
+
+    bot, result = asyncio.run(main())
+
+    assert result == BLOCKED
+    assert bot.attempts == 1 and bot.sent == []
+
+
+def test_close_cancels_what_did_not_fit_into_timeout():
+    class HangingBot(FakeBot):
+        async def send_message(self, chat_id, text, **kwargs):
+            await asyncio.sleep(60)
+
+    async def main():
+        scheduler = make_scheduler(HangingBot())
+        futures = [scheduler.submit(chat_id, 'Объявление') for chat_id in range(10)]
+        await scheduler.close(timeout=0.2)
+        return futures
+
+    futures = asyncio.run(main())
+
+    assert all(future.cancelled() for future in futures)
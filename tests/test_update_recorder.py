@@ -0,0 +1,62 @@
+"""
+Тесты обезличивания записи и базы для воспроизведения
+"""
+import asyncio
+import sqlite3
+
+from database import Database
+from update_recorder import Anonymizer, anonymize_database
+
+SALT = b'test-salt'
+
+
+def test_anonymized_database_matches_anonymized_updates(tmp_path):
+    db_path = str(tmp_path / 'copy.db')
+
+    async def fill():
+        db = Database(db_path)
+        await db.open()
+        try:
+            await db.add_user(111111111, 'Анна', 'Москва', 'Инженер', 'люблю шахматы')
+            await db.add_user(222222222, 'Иван', 'Казань', 'Юрист', '', photo_file_id='AgAD1')
+            await db.like(222222222, 111111111)
+            await db.like(111111111, 222222222)
+            await db.add_view(111111111, 222222222)
+        finally:
+            await db.close()
+    asyncio.run(fill())
+
+    anonymize_database(db_path, Anonymizer(SALT))
+
+    # Запись обезличивается отдельным экземпляром с тем же секретом
+    update = Anonymizer(SALT).anonymize({
+        'update_id': 1,
+        'message': {'message_id': 5, 'from': {'id': 111111111, 'first_name': 'Анна'},
+                    'chat': {'id': 111111111}, 'text': 'шахматы'},
+    })
+    anna = update['message']['from']['id']
+    ivan = Anonymizer(SALT).user_id(222222222)
+
+    with sqlite3.connect(db_path) as conn:
+        users = dict(conn.execute("SELECT telegram_id, about FROM users").fetchall())
+        photos = [row[0] for row in conn.execute("SELECT photo_file_id FROM users ORDER BY telegram_id")]
+        likes = set(conn.execute("SELECT from_user_id, to_user_id FROM likes").fetchall())
+        views = conn.execute("SELECT viewer_id, viewed_id FROM views").fetchall()
+        matches = conn.execute("SELECT user_low, user_high FROM matches").fetchall()
+
+    assert set(users) == {anna, ivan}
+    assert users[anna].split()[-1] == update['message']['text']
+    assert None in photos and 'AgAD1' not in photos
+    assert likes == {(anna, ivan), (ivan, anna)}
+    assert views == [(anna, ivan)]
+    assert matches == [(min(anna, ivan), max(anna, ivan))]
+
+    async def search():
+        db = Database(db_path)
+        await db.open()
+        try:
+            return await db.search_users_by_keywords(update['message']['text'])
+        finally:
+            await db.close()
+    # Полнотекстовый индекс обновился триггерами вместе с анкетами
+    assert [user['telegram_id'] for user in asyncio.run(search())] == [anna]
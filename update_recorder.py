@@ -0,0 +1,267 @@
+"""
+Запись входящих обновлений для воспроизведения (replay.py)
+"""
+import asyncio
+import contextvars
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+logger = logging.getLogger(__name__)
+
+# Файл записи (gzip JSONL, дописывается); пусто - запись выключена
+RECORD_UPDATES_PATH = os.getenv('RECORD_UPDATES_PATH', '')
+
+# Секрет обезличивания: одинаковые id и слова получают одинаковые замены только при
+# одном секрете. Пусто - случайный секрет на каждый запуск бота
+RECORD_UPDATES_SALT = os.getenv('RECORD_UPDATES_SALT', '')
+
+# Как часто накопленные записи сбрасываются в файл, в секундах
+RECORD_UPDATES_FLUSH_INTERVAL = float(os.getenv('RECORD_UPDATES_FLUSH_INTERVAL', '1'))
+
+# Объекты пользователей и чатов, чей id обезличивается
+_PERSON_KEYS = {
+    'from', 'chat', 'user', 'sender_chat', 'forward_from', 'forward_from_chat', 'via_bot',
+    'new_chat_members', 'left_chat_member', 'old_chat_member', 'new_chat_member',
+}
+# Поля со свободным текстом: буквы и цифры заменяются, длина и пунктуация сохраняются
+_TEXT_KEYS = {
+    'text', 'caption', 'first_name', 'last_name', 'username', 'title', 'bio', 'description',
+    'query', 'phone_number', 'vcard', 'url', 'address', 'invite_link', 'name',
+}
+# Непрозрачные строковые идентификаторы: заменяются хешем
+_OPAQUE_KEYS = {'file_id', 'file_unique_id', 'chat_instance', 'inline_message_id'}
+# Геоданные не записываются вовсе
+_DROPPED_KEYS = {'location', 'venue'}
+
+_LETTERS = re.compile(r'[^\W\d_]+')
+_DIGITS = re.compile(r'\d+')
+# Числа такой длины в callback_data - это telegram_id (respond_like_<id>, skip_like_<id>)
+_CALLBACK_IDS = re.compile(r'\d{6,}')
+_CYRILLIC = re.compile(r'[а-яё]', re.IGNORECASE)
+
+_CYRILLIC_ALPHABET = 'абвгдежзийклмнопрстуфхцчшщъыьэюя'
+
+# Столбцы базы бота с telegram_id (для anonymize_database)
+_DATABASE_ID_COLUMNS = {
+    'users': ('telegram_id',),
+    'likes': ('from_user_id', 'to_user_id'),
+    'views': ('viewer_id', 'viewed_id'),
+    'matches': ('user_low', 'user_high'),
+}
+_LATIN_ALPHABET = 'abcdefghijklmnopqrstuvwxyz'
+
+
+class Anonymizer:
+    """Согласованная замена id и текста в обновлениях
+
+    Замена детерминирована (HMAC с секретом): один и тот же пользователь
+    получает один и тот же id во всех обновлениях, одно и то же слово -
+    одну и ту же замену той же длины, поэтому при воспроизведении
+    совпадают колоды, поиск по словам и распределение по филиалам.
+    Команды (/start) сохраняются, длина текста в UTF-16 не меняется,
+    так что смещения entities остаются верными.
+    """
+
+    def __init__(self, salt: bytes):
+        self.salt = salt
+        self._ids: Dict[int, int] = {}
+        self._words: Dict[str, str] = {}
+
+    def _digest(self, kind: str, value: Any) -> int:
+        digest = hmac.new(self.salt, f"{kind}:{value}".encode(), hashlib.sha256).digest()
+        return int.from_bytes(digest[:8], 'big')
+
+    def user_id(self, value: int) -> int:
+        """Новый id: больше 10^9, как у настоящих аккаунтов; знак (группы) сохраняется"""
+        if not value:
+            return value
+        mapped = self._ids.get(value)
+        if mapped is None:
+            mapped = 1_000_000_000 + self._digest('id', abs(value)) % 8_000_000_000
+            mapped = self._ids[value] = mapped if value > 0 else -mapped
+        return mapped
+
+    def word(self, value: str) -> str:
+        """Слово той же длины и того же алфавита, регистр букв сохраняется"""
+        key = value.lower()
+        replacement = self._words.get(key)
+        if replacement is None:
+            alphabet = _CYRILLIC_ALPHABET if _CYRILLIC.search(key) else _LATIN_ALPHABET
+            rng = random.Random(self._digest('word', key))
+            replacement = self._words[key] = ''.join(rng.choices(alphabet, k=len(key)))
+        return ''.join(new.upper() if old.isupper() else new for old, new in zip(value, replacement))
+
+    def number(self, value: str) -> str:
+        rng = random.Random(self._digest('number', value))
+        return ''.join(rng.choices('0123456789', k=len(value)))
+
+    def text(self, value: str) -> str:
+        if value.startswith('/'):
+            command, separator, rest = value.partition(' ')
+            return command + separator + self.text(rest) if rest else value
+        value = _LETTERS.sub(lambda match: self.word(match.group()), value)
+        return _DIGITS.sub(lambda match: self.number(match.group()), value)
+
+    def callback_data(self, value: str) -> str:
+        return _CALLBACK_IDS.sub(lambda match: str(self.user_id(int(match.group()))), value)
+
+    def opaque(self, value: str) -> str:
+        return f"{self._digest('opaque', value):016x}"
+
+    def anonymize(self, value: Any, key: Optional[str] = None, person: bool = False) -> Any:
+        """Обезличенная копия обновления (словаря из Update.model_dump)"""
+        if isinstance(value, dict):
+            return {
+                child_key: self.anonymize(child, child_key, key in _PERSON_KEYS)
+                for child_key, child in value.items()
+                if child_key not in _DROPPED_KEYS
+            }
+        if isinstance(value, list):
+            return [self.anonymize(item, key, person) for item in value]
+        if isinstance(value, int) and not isinstance(value, bool):
+            if (key == 'id' and person) or key in ('user_id', 'chat_id'):
+                return self.user_id(value)
+            return value
+        if isinstance(value, str):
+            if key == 'data':
+                return self.callback_data(value)
+            if key in _OPAQUE_KEYS or key == 'id':
+                # Строковый id - это id callback-запроса, а не пользователя
+                return self.opaque(value)
+            if key in _TEXT_KEYS:
+                return self.text(value)
+        return value
+
+
+def anonymize_database(path: str, anonymizer: Anonymizer):
+    """Обезличить копию базы бота так же, как обезличена запись
+
+    Без этого участники записи (с замененными id) не находят своих анкет
+    в копии настоящей базы, и воспроизведение идет по пути регистрации.
+    telegram_id во всех таблицах и тексты анкет заменяются тем же
+    Anonymizer, что и в записи; состояния FSM и рассылки удаляются.
+    Файл меняется на месте - передавайте только копию.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        conn.create_function('anon_id', 1, anonymizer.user_id, deterministic=True)
+        conn.create_function('anon_text', 1, anonymizer.text, deterministic=True)
+        conn.create_function('anon_opaque', 1, anonymizer.opaque, deterministic=True)
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        with conn:
+            for table, columns in _DATABASE_ID_COLUMNS.items():
+                if table not in tables:
+                    continue
+                # Сначала меняем знак: UNIQUE проверяется построчно, и новый id
+                # не должен столкнуться со старым, который еще не заменен
+                conn.execute(f"UPDATE {table} SET " + ", ".join(f"{c} = -{c}" for c in columns))
+                conn.execute(f"UPDATE {table} SET " + ", ".join(f"{c} = anon_id(-{c})" for c in columns))
+            if 'matches' in tables:
+                conn.execute("""
+                    UPDATE matches SET user_low = user_high, user_high = user_low
+                    WHERE user_low > user_high
+                """)
+            conn.execute("""
+                UPDATE users SET name = anon_text(name), branch = anon_text(branch),
+                                 job_title = anon_text(job_title), about = anon_text(about),
+                                 photo_file_id = CASE WHEN photo_file_id IS NULL THEN NULL
+                                                 ELSE anon_opaque(photo_file_id) END
+            """)
+            for table in ('fsm_states', 'broadcasts'):
+                if table in tables:
+                    conn.execute(f"DELETE FROM {table}")
+    finally:
+        conn.close()
+
+
+class UpdateRecorderMiddleware(BaseMiddleware):
+    """Пишет каждое входящее обновление в gzip JSONL для replay.py
+
+    Регистрируется внешней middleware на dp.update первой, чтобы момент
+    записи совпадал с моментом получения. Строка файла:
+    {"t": unix-время получения, "update": обезличенное обновление}.
+    Записи копятся в памяти и дописываются в файл фоновой задачей в
+    отдельном потоке, обработка обновления файла не ждет.
+    """
+
+    def __init__(self, path: str, salt: str = RECORD_UPDATES_SALT,
+                 flush_interval: float = RECORD_UPDATES_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.anonymizer = Anonymizer((salt or secrets.token_hex(16)).encode())
+        self.recorded = 0
+        self._buffer: List[str] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._closed = False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if isinstance(event, Update) and not self._closed:
+            try:
+                self._record(event)
+            except Exception as e:
+                logger.error("Не удалось записать обновление %s: %s", event.update_id, e)
+        return await handler(event, data)
+
+    def _record(self, update: Update):
+        payload = update.model_dump(mode='json', exclude_none=True, by_alias=True)
+        self._buffer.append(json.dumps(
+            {'t': round(time.time(), 3), 'update': self.anonymizer.anonymize(payload)},
+            ensure_ascii=False,
+        ))
+        self.recorded += 1
+        if self._flush_task is None:
+            self._wakeup = asyncio.Event()
+            # Фоновая задача не должна унаследовать контекст обновления (логи, метрики)
+            self._flush_task = contextvars.Context().run(asyncio.create_task, self._flush_loop())
+
+    def _write(self, lines: List[str]):
+        # Каждый сброс - отдельный gzip-член; gzip.open читает такой файл целиком
+        with gzip.open(self.path, 'at', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    async def _flush(self):
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        try:
+            await asyncio.to_thread(self._write, lines)
+        except Exception as e:
+            logger.error("Не удалось дописать %s обновлений в %s: %s", len(lines), self.path, e)
+
+    async def _flush_loop(self):
+        """Фоновая задача: сброс накопленных записей, последний - при закрытии"""
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self._flush()
+
+    async def close(self):
+        """Дописать накопленные записи; новые обновления больше не записываются"""
+        self._closed = True
+        if self._flush_task is not None:
+            self._wakeup.set()
+            await self._flush_task
+            self._flush_task = None
+        await self._flush()
+        logger.info("Записано обновлений: %s (%s)", self.recorded, self.path)